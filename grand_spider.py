@@ -2,35 +2,49 @@ import os
 import logging
 import requests
 import functools
+import hashlib
 import threading
 import time
+import random
 import uuid
+import sqlite3
+import zlib
+import gzip
 import json
 import csv
 import re
 import collections
+import itertools
+import io
+import codecs
 import concurrent.futures
+import contextlib
+import queue
+import atexit
+import asyncio
+import importlib.util
 import xml.etree.ElementTree as ET
-from flask import Flask, request, jsonify
-from openai import OpenAI, APIError, RateLimitError, APITimeoutError, APIConnectionError
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from openai import (OpenAI, AsyncOpenAI, APIError, RateLimitError, APITimeoutError, APIConnectionError,
+                    InternalServerError)
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion
 from dotenv import load_dotenv
-from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit
+from html import unescape as html_unescape
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from bs4 import BeautifulSoup, Comment
+import soupsieve
 import tiktoken
 
 # --- Selenium Imports ---
-try:
-    from selenium import webdriver
-    from selenium.webdriver.chrome.service import Service as ChromeService
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.chrome.options import Options as ChromeOptions
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
-    from webdriver_manager.chrome import ChromeDriverManager
-    SELENIUM_AVAILABLE = True
-except ImportError:
-    SELENIUM_AVAILABLE = False
+# Only checked for here; the modules are imported on first browser use (_import_selenium), since
+# selenium.webdriver and webdriver_manager add noticeably to every worker's start-up.
+SELENIUM_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("selenium", "webdriver_manager"))
+if not SELENIUM_AVAILABLE:
     logging.warning("Selenium or WebDriver Manager not installed. 'use_selenium' option will not be available.")
 
 # --- Additional imports for screenshot functionality ---
@@ -59,6 +73,44 @@ try:
 except ImportError:
     READABILITY_AVAILABLE = False
 
+# --- Fast HTML parser for BeautifulSoup (C-backed lxml; pure-Python html.parser as fallback) ---
+try:
+    from lxml import etree as lxml_etree, html as lxml_html
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+    logging.warning("lxml not installed. Falling back to the slower built-in html.parser.")
+HTML_PARSER = 'lxml' if LXML_AVAILABLE else 'html.parser'
+
+# --- Fast JSON (orjson) for LLM responses and API payloads; stdlib json as fallback ---
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# --- Optional persistent cache backend (LLM responses survive restarts when configured) ---
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+# --- Optional response compression (gzip/br for large completed-job payloads) ---
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
+    logging.warning("flask-compress not installed. API responses will be sent uncompressed.")
+
+# --- Optional shared job store (JOB_STORE=redis) ---
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 
 # --- Configuration & Initialization ---
 load_dotenv()
@@ -67,6 +119,51 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def json_loads(data):
+    """Decode JSON text/bytes with orjson when available (raises json.JSONDecodeError subclasses)."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def json_dumps(data, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Encode to UTF-8 JSON bytes with orjson when available; unknown types are str()-ed."""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, default=str, option=option)
+        except TypeError:  # e.g. integers beyond 64 bits; the stdlib encoder copes
+            pass
+    return json.dumps(data, ensure_ascii=False, default=str, indent=2 if indent else None,
+                      sort_keys=sort_keys).encode("utf-8")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; defers to the default provider for odd types."""
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except (TypeError, orjson.JSONEncodeError):
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
+
+if COMPRESS_AVAILABLE:
+    # A completed KB is hundreds of KB of Markdown and compresses 5-10x; tiny status polls
+    # stay under COMPRESS_MIN_SIZE and are sent as-is.
+    app.config.setdefault("COMPRESS_MIMETYPES", ["application/json", "text/plain", "text/csv"])
+    app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+    Compress(app)
+
 # --- API Keys & OpenAI Client ---
 EXPECTED_SERVICE_API_KEY = os.getenv("SERVICE_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -81,23 +178,36 @@ try:
         openai_client = OpenAI(
             api_key=OPENAI_API_KEY,
             timeout=120.0,
-            max_retries=3
+            max_retries=0  # create_chat_completion() retries, outside the OpenAI concurrency limit
+        )
+        # Async twin used where many completions fan out at once (section synthesis).
+        async_openai_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=120.0,
+            max_retries=0  # create_chat_completion() retries, outside the OpenAI concurrency limit
         )
         logger.info("OpenAI client initialized successfully.")
     else:
         openai_client = None
+        async_openai_client = None
         logger.error("OpenAI client could not be initialized: OPENAI_API_KEY is missing.")
 except Exception as e:
     logger.error(f"Failed to initialize OpenAI client: {e}")
     openai_client = None
+    async_openai_client = None
 
 # --- Constants ---
 REQUEST_TIMEOUT = 30
 SELENIUM_PAGE_LOAD_TIMEOUT = 45
-SELENIUM_RENDER_WAIT_SECONDS = 3
+SELENIUM_RENDER_WAIT_SECONDS = 3  # upper bound on waiting for client-side rendering to settle
+SELENIUM_DRIVER_POOL_SIZE = int(os.getenv("SELENIUM_DRIVER_POOL_SIZE", 2))  # warm headless drivers kept between jobs
+SELENIUM_CRAWL_WORKERS = int(os.getenv("SELENIUM_CRAWL_WORKERS", SELENIUM_DRIVER_POOL_SIZE))  # browsers rendering in parallel per crawl
+SELENIUM_PREWARM_DRIVERS = os.getenv("SELENIUM_PREWARM_DRIVERS", "false").lower() == "true"  # fill the driver pool at startup
 MAX_HTML_CONTENT_LENGTH = 3500000
 MAX_HTML_SNIPPET_FOR_LANG_DETECT = 20000
 MAX_CONTENT_LENGTH = 15000 # For simple text extraction
+MAX_TEXT_FETCH_BYTES = 2 * 1024 * 1024  # body bytes read for text extraction; the rest is never downloaded
+MAX_HTML_FETCH_BYTES = 2 * MAX_HTML_CONTENT_LENGTH  # body bytes read for raw HTML (room for 2-byte UTF-8 scripts)
 
 # --- Tiered model strategy ---
 # Cheap model: bulk classification, per-page extraction, completeness checks.
@@ -123,15 +233,21 @@ MAX_RESPONSE_TOKENS_KB_COMPILATION = 16000
 
 # --- New pipeline tunables (overhauled KB generation) ---
 MAX_CLEAN_TEXT_CHARS = 40000                 # cap clean main-content text per page before LLM
+MAX_CLEAN_TEXT_TOKENS = 10000                 # ...and its token budget (Persian/Arabic text packs fewer chars per token)
 MAX_DISCOVERY_URLS = 5000                     # hard cap on URLs pulled from sitemap/crawl
 DEFAULT_KB_PAGE_BUDGET = 25                   # default # of knowledge pages to deeply extract
 MAX_KB_PAGE_BUDGET = 80                       # safety ceiling for a single job
-KB_EXTRACTION_WORKERS = 6                     # parallel per-page extraction threads
+KB_EXTRACTION_WORKERS = int(os.getenv("KB_EXTRACTION_WORKERS", 8))  # parallel per-page fetch+extract threads
 MAX_RESPONSE_TOKENS_PAGE_EXTRACTION = 4000    # per-page structured extraction output
+KB_BATCH_PAGE_MAX_TOKENS = 1500               # pages with at most this much clean text are extracted in batches
+KB_BATCH_INPUT_TOKEN_BUDGET = 6000            # combined clean text per batched extraction call
+KB_BATCH_MAX_PAGES = 8                        # pages per batched extraction call
+MAX_RESPONSE_TOKENS_BATCH_EXTRACTION = 8000   # output budget of one batched extraction call
 MAX_RESPONSE_TOKENS_SECTION_SYNTH = 8000      # per-section synthesis output (NOT a global cap)
 MAX_RESPONSE_TOKENS_ASSEMBLY = 4000           # intro/overview + table of contents
 MAX_RESPONSE_TOKENS_COMPLETENESS = 1200       # completeness critic
 SECTION_SYNTH_INPUT_TOKEN_BUDGET = 14000      # sub-batch threshold for map-reduce within a section
+STREAM_PROGRESS_INTERVAL_SECONDS = 1.0        # min gap between live progress updates while streaming
 TARGET_DOC_TOKENS = 18000                     # soft size budget for the final single-context doc
 
 # Canonical sections for the final single-context document, in output order.
@@ -181,6 +297,38 @@ MAX_PAGES_FOR_KB_GENERATION = 20
 MAX_URLS_FROM_SITEMAP_TO_PROCESS_TITLES = 200
 MIN_DISCOVERED_PAGES_BEFORE_FALLBACK_CRAWL = 20
 MAX_PAGES_FOR_FALLBACK_DISCOVERY_CRAWL = 30
+CRAWL_WORKERS = 8                             # parallel fetch threads for the requests-based crawler / sitemaps
+PAGE_ANALYSIS_WORKERS = 16                    # parallel fetch+summarize threads for company analysis
+QUALIFY_WORKERS = int(os.getenv("QUALIFY_WORKERS", 16))  # parallel prospect fetch+qualify threads
+
+# --- Shared HTTP Session ---
+# One pooled session for all page/sitemap fetches and HEAD probes so Keep-Alive reuses TCP+TLS connections
+# across calls (and across crawler threads) instead of handshaking on every request.
+# 429/5xx are retried with backoff (Retry honours Retry-After) rather than failing the page.
+# Each host's pool keeps HTTP_POOL_MAXSIZE idle connections; it is never smaller than the largest
+# fetch-thread pool, since connections beyond it are closed after use instead of reused.
+HTTP_POOL_MAXSIZE = max(int(os.getenv("HTTP_POOL_MAXSIZE", 64)),
+                        KB_EXTRACTION_WORKERS, QUALIFY_WORKERS, PAGE_ANALYSIS_WORKERS, CRAWL_WORKERS)
+HTTP_RETRY_AFTER_MAX_SECONDS = 10            # longest Retry-After a fetch thread will sleep for
+
+class _BoundedRetry(Retry):
+    """Retry whose Retry-After sleeps are capped: a site answering 429 with "Retry-After: 3600"
+    must not park a crawl or request thread for an hour."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, HTTP_RETRY_AFTER_MAX_SECONDS)
+
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.headers.update({'User-Agent': CRAWLER_USER_AGENT})
+_http_adapter = HTTPAdapter(
+    pool_connections=32, pool_maxsize=HTTP_POOL_MAXSIZE,
+    # Only the idempotent reads this service issues are retried.
+    max_retries=_BoundedRetry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                              allowed_methods=frozenset({"GET", "HEAD"}), raise_on_status=False),
+)
+HTTP_SESSION.mount('http://', _http_adapter)
+HTTP_SESSION.mount('https://', _http_adapter)
 
 # --- Directories ---
 REPORTS_DIR = "reports"
@@ -208,9 +356,11 @@ PROGRESS_MESSAGES_FA = {
     "Compiling comprehensive knowledge base...": "تدوین پایگاه دانش جامع...",
     # Overhauled deep pipeline
     "Fetching homepage...": "دریافت صفحه اصلی...",
+    "Fetching selected pages...": "دریافت صفحات انتخاب‌شده...",
     "Extracting knowledge from pages...": "استخراج دانش از صفحات...",
     "Extracting knowledge": "استخراج دانش از صفحات...",
     "Writing section": "در حال نوشتن بخش پایگاه دانش...",
+    "Writing knowledge base sections": "در حال نوشتن بخش‌های پایگاه دانش...",
     "Auditing knowledge base completeness...": "بررسی کامل بودن پایگاه دانش...",
 }
 
@@ -242,20 +392,81 @@ def get_progress_fa(progress_en: str) -> str:
 
 def update_job_progress(job_id: str, progress_message: str):
     """Update job progress with both English and Farsi messages."""
-    with jobs_lock:
-        jobs[job_id]["progress"] = progress_message
-        jobs[job_id]["progress_fa"] = get_progress_fa(progress_message)
+    job_store.update(job_id, {"progress": progress_message, "progress_fa": get_progress_fa(progress_message)})
+
+# Coroutines on the shared event loop must not write the job store themselves: a SQLite lock
+# wait or a Redis round trip would stall every coroutine of every job. They hand progress to
+# this single thread instead, which also keeps each job's updates in order.
+_progress_publisher = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-progress")
+
+
+def _publish_progress(job_id: str, progress_message: str):
+    try:
+        update_job_progress(job_id, progress_message)
+    except Exception as e:
+        logger.warning(f"Could not publish progress for job {job_id}: {e}")
+
+
+def update_job_progress_nowait(job_id: str, progress_message: str):
+    """update_job_progress() without blocking the caller; for code running on the event loop."""
+    _progress_publisher.submit(_publish_progress, job_id, progress_message)
+
+
+def update_job_progress_ordered(job_id: str, progress_message: str):
+    """update_job_progress() queued behind any pending nowait writes, returning once it is stored.
+
+    For job threads whose coroutines also publish progress: a late nowait write can then never
+    overwrite the newer message.
+    """
+    _progress_publisher.submit(update_job_progress, job_id, progress_message).result()
+
+PROGRESS_PUBLISH_STEPS = 100  # max "done/total" progress writes per counted stage
+
+
+class ProgressCounter:
+    """Counts completed items of a stage and publishes "done/total" progress sparingly.
+
+    next() on itertools.count is atomic in CPython, so workers can step() without a lock;
+    the job store is written only every ~total/PROGRESS_PUBLISH_STEPS items and on the last
+    one, instead of once per item.
+    """
+
+    def __init__(self, job_id: str, total: int, template: str, publish=None):
+        self._job_id = job_id
+        self._publish = publish or update_job_progress  # update_job_progress_nowait on the event loop
+        self._total = total
+        self._template = template  # str.format template using {done}, {total} and step() kwargs
+        self._counter = itertools.count(1)
+        self._every = max(1, total // PROGRESS_PUBLISH_STEPS)
+
+    def step(self, **fields) -> int:
+        done = next(self._counter)
+        if self._job_id and (done % self._every == 0 or done >= self._total):
+            self._publish(self._job_id, self._template.format(done=done, total=self._total, **fields))
+        return done
 
 # --- Tokenizer and Pricing ---
-try:
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer(model: str):
+    """Resolve (once per model) the tiktoken encoding, falling back to cl100k_base."""
     try:
-        TOKENIZER = tiktoken.encoding_for_model(OPENAI_MODEL)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        logger.warning(f"Tokenizer for model '{OPENAI_MODEL}' not found. Falling back to 'cl100k_base'.")
-        TOKENIZER = tiktoken.get_encoding("cl100k_base")
-except Exception as e:
-    logger.error(f"Could not initialize tiktoken tokenizer: {e}. Token counting may be inaccurate.")
-    TOKENIZER = None
+        logger.warning(f"Tokenizer for model '{model}' not found. Falling back to 'cl100k_base'.")
+        return tiktoken.get_encoding("cl100k_base")
+
+@functools.lru_cache(maxsize=1)
+def load_tokenizer():
+    """The OPENAI_MODEL encoding, or None if it can't be loaded (token counts then fall back to 0).
+
+    Loading the BPE ranks (and downloading them on first use) is slow, so it happens on first
+    use rather than at import; servers call this from a background thread at start-up.
+    """
+    try:
+        return _get_tokenizer(OPENAI_MODEL)
+    except Exception as e:
+        logger.error(f"Could not initialize tiktoken tokenizer: {e}. Token counting may be inaccurate.")
+        return None
 
 # Prices are per 1 Million tokens (gpt-5-nano)
 PRICE_PER_INPUT_TOKEN_MILLION = 0.05
@@ -264,17 +475,19 @@ PRICE_PER_CACHED_INPUT_TOKEN_MILLION = 0.005
 
 # Per-model pricing ($ per 1M tokens) for accurate tiered-cost accounting.
 # Unknown models fall back to DEFAULT_MODEL_PRICING (nano rates).
-DEFAULT_MODEL_PRICING = {"input": PRICE_PER_INPUT_TOKEN_MILLION, "output": PRICE_PER_OUTPUT_TOKEN_MILLION}
+# "cached_input" is the rate for prompt tokens served from OpenAI's automatic prefix cache.
+DEFAULT_MODEL_PRICING = {"input": PRICE_PER_INPUT_TOKEN_MILLION, "output": PRICE_PER_OUTPUT_TOKEN_MILLION,
+                         "cached_input": PRICE_PER_CACHED_INPUT_TOKEN_MILLION}
 MODEL_PRICING = {
-    "gpt-5-nano": {"input": 0.05, "output": 0.40},
-    "gpt-5-mini": {"input": 0.25, "output": 2.00},
-    "gpt-5": {"input": 1.25, "output": 10.00},
-    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
-    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-5-nano": {"input": 0.05, "output": 0.40, "cached_input": 0.005},
+    "gpt-5-mini": {"input": 0.25, "output": 2.00, "cached_input": 0.025},
+    "gpt-5": {"input": 1.25, "output": 10.00, "cached_input": 0.125},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "cached_input": 0.075},
+    "gpt-4o": {"input": 2.50, "output": 10.00, "cached_input": 1.25},
 }
 
 def get_model_pricing(model_name: str) -> dict:
-    """Return {input, output} $/1M for a model, tolerant of dated/suffixed variants."""
+    """Return {input, output, cached_input} $/1M for a model, tolerant of dated/suffixed variants."""
     if not model_name:
         return DEFAULT_MODEL_PRICING
     if model_name in MODEL_PRICING:
@@ -292,16 +505,26 @@ class CostAccumulator:
 
     Exposes aggregate prompt_tokens/completion_tokens (for the backward-compatible
     cost_estimation block) plus a per-model breakdown for accurate tiered pricing.
+    Prompt tokens served from OpenAI's prefix cache are billed at the cached-input rate.
     """
     def __init__(self):
         self._lock = threading.Lock()
-        self.by_model = {}  # model -> [prompt_tokens, completion_tokens]
+        self.by_model = {}  # model -> [prompt_tokens, completion_tokens, cached_prompt_tokens]
 
-    def add(self, model: str, prompt_tokens: int, completion_tokens: int):
+    def add(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
         with self._lock:
-            entry = self.by_model.setdefault(model or OPENAI_MODEL_CHEAP, [0, 0])
+            entry = self.by_model.setdefault(model or OPENAI_MODEL_CHEAP, [0, 0, 0])
             entry[0] += int(prompt_tokens or 0)
             entry[1] += int(completion_tokens or 0)
+            entry[2] += int(cached_tokens or 0)
+
+    @staticmethod
+    def _cost(model: str, p: int, c: int, cached: int) -> float:
+        pricing = get_model_pricing(model)
+        cached = min(cached, p)
+        return ((p - cached) / 1_000_000) * pricing["input"] \
+            + (cached / 1_000_000) * pricing.get("cached_input", pricing["input"]) \
+            + (c / 1_000_000) * pricing["output"]
 
     @property
     def prompt_tokens(self) -> int:
@@ -313,24 +536,24 @@ class CostAccumulator:
         with self._lock:
             return sum(v[1] for v in self.by_model.values())
 
+    @property
+    def cached_prompt_tokens(self) -> int:
+        with self._lock:
+            return sum(v[2] for v in self.by_model.values())
+
     def total_cost_usd(self) -> float:
         with self._lock:
-            total = 0.0
-            for model, (p, c) in self.by_model.items():
-                pricing = get_model_pricing(model)
-                total += (p / 1_000_000) * pricing["input"] + (c / 1_000_000) * pricing["output"]
-            return total
+            return sum(self._cost(model, p, c, cached) for model, (p, c, cached) in self.by_model.items())
 
     def breakdown(self) -> dict:
         with self._lock:
             out = {}
-            for model, (p, c) in self.by_model.items():
-                pricing = get_model_pricing(model)
+            for model, (p, c, cached) in self.by_model.items():
                 out[model] = {
                     "prompt_tokens": p,
+                    "cached_prompt_tokens": cached,
                     "completion_tokens": c,
-                    "cost_usd": round((p / 1_000_000) * pricing["input"]
-                                      + (c / 1_000_000) * pricing["output"], 6),
+                    "cost_usd": round(self._cost(model, p, c, cached), 6),
                 }
             return out
 
@@ -339,43 +562,518 @@ class CostAccumulator:
         return {
             "total_cost_usd": f"{self.total_cost_usd():.6f}",
             "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
             "completion_tokens": self.completion_tokens,
             "by_model": self.breakdown(),
         }
 
 
-def llm_chat(messages, model=None, max_tokens=2000, json_mode=False,
-             cost: "CostAccumulator" = None, input_text_for_count=None):
-    """Single OpenAI chat call used by the overhauled KB pipeline.
+class TTLCache:
+    """Small thread-safe LRU mapping whose entries expire ttl_seconds after being set.
 
-    Returns (content_str, prompt_tokens, completion_tokens) and records usage into
-    `cost` when provided. Uses the API-reported token usage when available.
+    With max_weight and weigher, the summed weigher(value) of all entries is bounded too
+    (e.g. total characters of cached pages), evicting least recently used entries first.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_weight: int = None, weigher=None):
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()  # key -> (expires_at, value, weight)
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._max_weight = max_weight
+        self._weigher = weigher
+        self._weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key):
+        self._weight -= self._data.pop(key)[2]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.time():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Store value for ttl seconds (default: the cache's ttl_seconds)."""
+        weight = self._weigher(value) if self._weigher else 0
+        now = time.time()
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (now + (self._ttl if ttl is None else ttl), value, weight)
+            self._weight += weight
+            # Least recently used entries that have already expired go first, whatever the size.
+            while self._data:
+                oldest = next(iter(self._data))
+                if self._data[oldest][0] >= now:
+                    break
+                self._pop(oldest)
+            while self._data and (len(self._data) > self._max_entries
+                                  or (self._max_weight is not None and self._weight > self._max_weight)):
+                self._pop(next(iter(self._data)))
+
+
+# --- LLM Response Cache ---
+# Identical requests (same model, messages, limits, response format) are answered from cache
+# instead of the API: re-runs against the same site and overlapping prospect batches repeat
+# many prompts verbatim. In-memory LRU by default; set LLM_CACHE_DIR (requires diskcache)
+# to persist entries across restarts. LLM_CACHE_ENABLED=0 turns caching off.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+LLM_CACHE_MAX_ENTRIES = 2048
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+
+
+_CACHE_KEY_WS_RE = re.compile(r'\s+')
+
+
+def _normalize_message_for_key(message: dict) -> dict:
+    content = message.get("content")
+    if isinstance(content, str):
+        content = _CACHE_KEY_WS_RE.sub(" ", content).strip()
+    elif isinstance(content, list):
+        content = [
+            {**part, "text": _CACHE_KEY_WS_RE.sub(" ", part["text"]).strip()}
+            if isinstance(part, dict) and isinstance(part.get("text"), str) else part
+            for part in content
+        ]
+    return {**message, "content": content}
+
+
+class LLMCache:
+    """Thread-safe TTL cache of chat completions keyed on a hash of the full request."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int, directory: str = None):
+        self._lock = threading.Lock()  # guards stats
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._ttl = ttl_seconds
+        self._disk = None
+        if directory:
+            if DISKCACHE_AVAILABLE:
+                self._disk = diskcache.Cache(directory)
+            else:
+                logger.warning("LLM_CACHE_DIR is set but diskcache is not installed; using in-memory LLM cache.")
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(request_kwargs: dict) -> str:
+        """sha256 of the request with message text whitespace-normalised.
+
+        Re-fetched pages routinely differ only in whitespace/indentation, which changes nothing
+        for the model but would otherwise miss the cache.
+        """
+        normalized = dict(request_kwargs)
+        if "messages" in normalized:
+            normalized["messages"] = [_normalize_message_for_key(m) for m in normalized["messages"]]
+        return hashlib.sha256(json_dumps(normalized, sort_keys=True)).hexdigest()
+
+    def get(self, key: str):
+        value = self._memory.get(key)
+        if value is None and self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._memory.set(key, value)
+        with self._lock:
+            self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key: str, value):
+        self._memory.set(key, value)
+        if self._disk is not None:
+            self._disk.set(key, value, expire=self._ttl)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": LLM_CACHE_ENABLED,
+                "backend": "disk" if self._disk is not None else "memory",
+                "entries_in_memory": len(self._memory),
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+llm_cache = LLMCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS, LLM_CACHE_DIR)
+
+# Cap on in-flight OpenAI requests, shared by threaded callers (extraction workers, concurrent
+# jobs) and coroutines on the shared event loop. The cap adapts AIMD-style: it starts at
+# OPENAI_MAX_CONCURRENCY, halves when a request is rate limited and creeps back up by about
+# one slot per window of successful requests, so concurrent jobs back off together instead of
+# feeding a 429 storm.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+OPENAI_MIN_CONCURRENCY = int(os.getenv("OPENAI_MIN_CONCURRENCY", 1))
+OPENAI_CONCURRENCY_DECREASE_FACTOR = 0.5
+OPENAI_CONCURRENCY_DECREASE_COOLDOWN = 2.0    # seconds; one burst of 429s counts as one decrease
+
+
+class AdaptiveConcurrencyLimit:
+    """Counting limit whose size follows additive-increase / multiplicative-decrease.
+
+    Usable as `with limit:` from threads and `async with limit:` from coroutines; leaving the
+    block with RateLimitError shrinks the limit, leaving it cleanly grows it.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self._max = max(1, maximum)
+        self._min = max(1, min(minimum, self._max))
+        self._limit = float(self._max)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, future) of coroutines waiting for a slot
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _try_acquire(self) -> bool:
+        if self._in_flight < int(self._limit):
+            self._in_flight += 1
+            return True
+        return False
+
+    def _release(self, throttled: bool, succeeded: bool):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled and now - self._last_decrease >= OPENAI_CONCURRENCY_DECREASE_COOLDOWN:
+                self._last_decrease = now
+                self._limit = max(self._min, self._limit * OPENAI_CONCURRENCY_DECREASE_FACTOR)
+                logger.warning(f"OpenAI rate limited; concurrency limit lowered to {int(self._limit)}.")
+            elif succeeded:
+                self._limit = min(self._max, self._limit + 1 / self._limit)
+            waiters, self._async_waiters = self._async_waiters, []
+            self._cond.notify_all()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake_waiter, waiter)
+
+    def __enter__(self):
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release(exc_type is not None and issubclass(exc_type, RateLimitError), exc_type is None)
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    return self
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(waiter, timeout=1.0)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+
+
+def _wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_openai_limit = AdaptiveConcurrencyLimit(OPENAI_MAX_CONCURRENCY, OPENAI_MIN_CONCURRENCY)
+
+# The SDK clients don't retry (max_retries=0): a rate-limited request (or a 5xx / dropped
+# connection) is retried here with full-jitter exponential backoff (uniform 0..min(60, 2**attempt)
+# seconds, but never sooner than the server's Retry-After), waiting outside the concurrency limit
+# so every 429 reaches its AIMD decrease. Timeouts already cost up to 120s each, so they get
+# only OPENAI_TIMEOUT_RETRIES retries.
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", 6))
+OPENAI_TIMEOUT_RETRIES = 2
+OPENAI_RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+OPENAI_MAX_BACKOFF_SECONDS = 60
+
+
+def _retry_after_hint(error) -> float:
+    """Seconds the server asked us to wait (retry-after-ms / retry-after headers), else 0."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after") or 0)
+    except (TypeError, ValueError):  # an HTTP-date Retry-After; fall back to our own backoff
+        return 0.0
+
+
+def _retry_backoff(error: APIError, attempt: int):
+    """Seconds to wait before retrying a failed request, or None to give up."""
+    if (attempt >= OPENAI_RATE_LIMIT_RETRIES
+            or (isinstance(error, APITimeoutError) and attempt >= OPENAI_TIMEOUT_RETRIES)
+            or getattr(error, "code", None) == "insufficient_quota"):
+        return None  # out of attempts, or out of credit (waiting will not help)
+    delay = random.uniform(0, min(OPENAI_MAX_BACKOFF_SECONDS, 2 ** attempt))
+    delay = max(delay, min(OPENAI_MAX_BACKOFF_SECONDS, _retry_after_hint(error)))
+    logger.warning(f"OpenAI request failed ({type(error).__name__}); retrying in {delay:.1f}s "
+                   f"(attempt {attempt + 1}/{OPENAI_RATE_LIMIT_RETRIES}).")
+    return delay
+
+# --- Shared asyncio event loop ---
+# Job runners are plain threads; they hand coroutines to one long-lived loop running in a
+# daemon thread, so a single thread can drive many concurrent async OpenAI calls.
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+
+def _get_async_loop():
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-llm-loop", daemon=True).start()
+            _async_loop = loop
+        return _async_loop
+
+
+def run_coroutine(coro, timeout: float = None):
+    """Run a coroutine on the shared event loop from synchronous code and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_async_loop()).result(timeout)
+
+
+_ZERO_USAGE = CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+
+def _cached_completion(key):
+    cached = llm_cache.get(key) if key else None
+    return cached.model_copy(update={"usage": _ZERO_USAGE}) if cached is not None else None
+
+
+def _after_completion(key, kwargs, completion):
+    """Log prompt-cache usage and store cleanly finished, non-empty completions."""
+    details = getattr(completion.usage, "prompt_tokens_details", None) if completion.usage else None
+    if details is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"OpenAI {kwargs.get('model')}: {details.cached_tokens or 0}/{completion.usage.prompt_tokens} prompt tokens served from prompt cache")
+    if key and completion.choices:
+        choice = completion.choices[0]
+        if choice.finish_reason == "stop" and (choice.message.content or "").strip():
+            llm_cache.set(key, completion)
+
+
+class _StreamCollector:
+    """Rebuilds a ChatCompletion from streamed chunks, reporting text deltas as they arrive.
+
+    `reported` is how many characters earlier (failed) attempts of the same request already
+    passed to on_delta; a retry only reports text beyond that, so progress isn't counted twice.
+    """
+
+    def __init__(self, model: str, on_delta, reported: int = 0):
+        self.model = model
+        self.on_delta = on_delta
+        self.reported = reported
+        self.length = 0
+        self.parts = []
+        self.id = None
+        self.created = None
+        self.finish_reason = None
+        self.usage = None
+
+    def feed(self, chunk):
+        self.id = self.id or chunk.id
+        self.created = self.created or chunk.created
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices or ():
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+            delta = choice.delta.content if choice.delta else None
+            if delta:
+                self.parts.append(delta)
+                start, self.length = self.length, self.length + len(delta)
+                if self.length <= self.reported:
+                    continue
+                fresh = delta[max(0, self.reported - start):]
+                self.reported = self.length
+                try:
+                    self.on_delta(fresh)
+                except Exception as e:
+                    logger.debug(f"Stream progress callback failed: {e}")
+
+    def completion(self) -> ChatCompletion:
+        return ChatCompletion.model_validate({
+            "id": self.id or "stream", "object": "chat.completion", "created": self.created or int(time.time()),
+            "model": self.model,
+            "choices": [{"index": 0, "finish_reason": self.finish_reason or "stop",
+                         "message": {"role": "assistant", "content": "".join(self.parts)}}],
+            "usage": self.usage.model_dump() if self.usage is not None else None,
+        })
+
+
+def create_chat_completion(on_delta=None, **kwargs):
+    """Single entry point for every chat completion request, with response caching.
+
+    A cache hit returns the stored completion with zeroed usage, so cost accounting reflects
+    that no tokens were spent. Only cleanly finished, non-empty completions are stored.
+    With `on_delta`, the response is streamed and each text delta is passed to the callback
+    as it arrives; the return value is still a regular ChatCompletion (usage included).
     """
     if not openai_client:
         raise ConnectionError("OpenAI client not initialized.")
-    model = model or OPENAI_MODEL_CHEAP
-    kwargs = {"model": model, "messages": messages, "max_completion_tokens": max_tokens}
+    key = LLMCache.make_key(kwargs) if LLM_CACHE_ENABLED else None
+    cached = _cached_completion(key)
+    if cached is not None:
+        return cached
+    collector = None
+    for attempt in itertools.count():
+        try:
+            with _openai_limit:
+                if on_delta is None:
+                    completion = openai_client.chat.completions.create(**kwargs)
+                else:
+                    collector = _StreamCollector(kwargs.get("model"), on_delta,
+                                                 collector.reported if collector else 0)
+                    stream = openai_client.chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, **kwargs)
+                    for chunk in stream:
+                        collector.feed(chunk)
+                    completion = collector.completion()
+            break
+        except OPENAI_RETRYABLE_ERRORS as e:
+            delay = _retry_backoff(e, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+    _after_completion(key, kwargs, completion)
+    return completion
+
+
+async def acreate_chat_completion(on_delta=None, **kwargs):
+    """Async counterpart of create_chat_completion(); shares the same response cache."""
+    if not async_openai_client:
+        raise ConnectionError("OpenAI client not initialized.")
+    key = LLMCache.make_key(kwargs) if LLM_CACHE_ENABLED else None
+    cached = _cached_completion(key)
+    if cached is not None:
+        return cached
+    collector = None
+    for attempt in itertools.count():
+        try:
+            async with _openai_limit:
+                if on_delta is None:
+                    completion = await async_openai_client.chat.completions.create(**kwargs)
+                else:
+                    collector = _StreamCollector(kwargs.get("model"), on_delta,
+                                                 collector.reported if collector else 0)
+                    stream = await async_openai_client.chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, **kwargs)
+                    async for chunk in stream:
+                        collector.feed(chunk)
+                    completion = collector.completion()
+            break
+        except OPENAI_RETRYABLE_ERRORS as e:
+            delay = _retry_backoff(e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+    _after_completion(key, kwargs, completion)
+    return completion
+
+
+def _chat_kwargs(messages, model, max_tokens, json_mode) -> dict:
+    kwargs = {"model": model or OPENAI_MODEL_CHEAP, "messages": messages, "max_completion_tokens": max_tokens}
     if json_mode:
         kwargs["response_format"] = {"type": "json_object"}
-    completion = openai_client.chat.completions.create(**kwargs)
-    content = (completion.choices[0].message.content or "").strip()
+    return kwargs
+
+
+TOKENS_PER_MESSAGE = 3  # chat format overhead per message (role + separators)
+TOKENS_PER_REPLY = 3    # every reply is primed with <|start|>assistant<|message|>
+
+
+def count_message_tokens(messages: list) -> int:
+    """Approximate prompt tokens of a chat request, counting each message separately.
+
+    Instruction messages repeat verbatim across calls, so their counts come from the
+    count_tokens() memo and only the per-page content is actually encoded (all in one
+    count_tokens_batch() call). Image parts are not counted.
+    """
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif content:
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return TOKENS_PER_REPLY + TOKENS_PER_MESSAGE * len(messages) + sum(count_tokens_batch(texts))
+
+
+def _usage_tokens(completion, prompt=None) -> tuple[int, int]:
+    """(prompt_tokens, completion_tokens) as billed by the API.
+
+    The prompt (a string or a chat messages list) is only tokenized locally when the
+    response carries no usage block.
+    """
     usage = completion.usage
     if usage:
-        p_tokens = usage.prompt_tokens or 0
-        c_tokens = usage.completion_tokens or 0
-    else:
-        p_tokens = count_tokens(input_text_for_count) if input_text_for_count else 0
-        c_tokens = 0
+        return usage.prompt_tokens or 0, usage.completion_tokens or 0
+    if not prompt:
+        return 0, 0
+    return (count_tokens(prompt) if isinstance(prompt, str) else count_message_tokens(prompt)), 0
+
+
+def _cached_prompt_tokens(completion) -> int:
+    """Prompt tokens OpenAI served from its prefix cache (billed at the cached-input rate)."""
+    details = getattr(completion.usage, "prompt_tokens_details", None) if completion.usage else None
+    return (details.cached_tokens or 0) if details is not None else 0
+
+
+def _record_chat_usage(completion, model, cost, messages):
+    content = (completion.choices[0].message.content or "").strip()
+    p_tokens, c_tokens = _usage_tokens(completion, messages)
     if cost is not None:
-        cost.add(model, p_tokens, c_tokens)
+        cost.add(model, p_tokens, c_tokens, _cached_prompt_tokens(completion))
     return content, p_tokens, c_tokens
 
 
+def llm_chat(messages, model=None, max_tokens=2000, json_mode=False,
+             cost: "CostAccumulator" = None, on_delta=None):
+    """Single OpenAI chat call used by the overhauled KB pipeline.
+
+    Returns (content_str, prompt_tokens, completion_tokens) and records usage into
+    `cost` when provided. Uses the API-reported token usage when available.
+    """
+    if not openai_client:
+        raise ConnectionError("OpenAI client not initialized.")
+    kwargs = _chat_kwargs(messages, model, max_tokens, json_mode)
+    completion = create_chat_completion(on_delta=on_delta, **kwargs)
+    return _record_chat_usage(completion, kwargs["model"], cost, messages)
+
+
+async def allm_chat(messages, model=None, max_tokens=2000, json_mode=False,
+                    cost: "CostAccumulator" = None, on_delta=None):
+    """Async llm_chat(): same return value and cost accounting, via the async client."""
+    kwargs = _chat_kwargs(messages, model, max_tokens, json_mode)
+    completion = await acreate_chat_completion(on_delta=on_delta, **kwargs)
+    return _record_chat_usage(completion, kwargs["model"], cost, messages)
+
+
 def parse_json_response(content: str):
-    """Best-effort JSON parse that tolerates markdown code fences around the object."""
+    """Best-effort JSON parse that tolerates markdown code fences around the object.
+
+    JSON-mode responses are a bare object, so those are decoded in one pass; the fence scan
+    only runs when that fails (and can no longer cut into a ``` inside a string value).
+    """
     if not content:
         raise ValueError("Empty response content")
     text = content.strip()
+    if text[:1] in ('{', '['):
+        try:
+            return json_loads(text)
+        except json.JSONDecodeError:
+            pass
     if '```json' in text:
         start = text.find('```json') + 7
         end = text.find('```', start)
@@ -386,7 +1084,7 @@ def parse_json_response(content: str):
         end = text.rfind('```')
         if end != -1 and end > start:
             text = text[start:end].strip()
-    return json.loads(text)
+    return json_loads(text)
 
 KB_WRITING_GUIDELINES_TEMPLATE = """
 Guidelines for structuring the knowledge base in {target_language}:
@@ -414,6 +1112,37 @@ STANDARD_CORE_PAGE_PATHS = {
                 "بازگشت-کالا", "سوالات-متداول", "پرسش-های-متداول", "راهنمای-خرید", "خدمات"]
 }
 
+# HEAD-probe outcomes (reachable or not) are remembered across jobs, so re-running core
+# discovery on the same site skips the ~35 common-path probes. Network errors are not cached.
+PROBE_CACHE_TTL_SECONDS = 3600
+_probe_cache = TTLCache(max_entries=8192, ttl_seconds=PROBE_CACHE_TTL_SECONDS)
+
+def _probe_url(url: str, timeout: float) -> int:
+    """HTTP status of a HEAD request to url (following redirects), cached per URL.
+
+    Raises requests.exceptions.RequestException on network errors, which are not cached.
+    """
+    status = _probe_cache.get(url)
+    if status is None:
+        status = HTTP_SESSION.head(url, timeout=timeout, allow_redirects=True).status_code
+        _probe_cache.set(url, status)
+    return status
+
+CORE_PROBE_WORKERS = 16                       # concurrent HEAD probes per discovery (kept low for small sites)
+
+def _probe_urls(urls: list, timeout: float) -> list:
+    """_probe_url() for many URLs concurrently; statuses in input order (the exception for failures)."""
+    def _probe(url):
+        try:
+            return _probe_url(url, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    if not urls:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(CORE_PROBE_WORKERS, len(urls))) as executor:
+        return list(executor.map(_probe, urls))
+
 def discover_core_pages_only(base_url: str, specific_pages: list = None) -> list[dict]:
     """
     Discover only core website pages that are essential for chatbot knowledge.
@@ -425,24 +1154,22 @@ def discover_core_pages_only(base_url: str, specific_pages: list = None) -> list
     # If specific pages are provided, use them directly
     if specific_pages:
         logger.info(f"Using provided specific pages: {len(specific_pages)} pages")
-        for page_url in specific_pages:
-            try:
-                # Validate the URL is accessible
-                response = requests.head(page_url, headers={'User-Agent': CRAWLER_USER_AGENT}, timeout=10, allow_redirects=True)
-                if response.status_code < 400:
-                    discovered_pages.append({
-                        'url': page_url,
-                        'title': 'N/A',
-                        'type': 'specified_core_page'
-                    })
-                    logger.info(f"✓ Core page accessible: {page_url}")
-                else:
-                    logger.warning(f"✗ Core page not accessible (HTTP {response.status_code}): {page_url}")
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"✗ Core page not accessible (Error): {page_url} - {e}")
+        # Validate the URLs are accessible (probed concurrently, reported in the given order)
+        for page_url, status in zip(specific_pages, _probe_urls(specific_pages, timeout=10)):
+            if isinstance(status, Exception):
+                logger.warning(f"✗ Core page not accessible (Error): {page_url} - {status}")
+            elif status < 400:
+                discovered_pages.append({
+                    'url': page_url,
+                    'title': 'N/A',
+                    'type': 'specified_core_page'
+                })
+                logger.info(f"✓ Core page accessible: {page_url}")
+            else:
+                logger.warning(f"✗ Core page not accessible (HTTP {status}): {page_url}")
         
         # Always include the main page
-        if base_url not in [p['url'] for p in discovered_pages]:
+        if not any(p['url'] == base_url for p in discovered_pages):
             discovered_pages.insert(0, {
                 'url': base_url,
                 'title': 'Main Page',
@@ -479,27 +1206,383 @@ def discover_core_pages_only(base_url: str, specific_pages: list = None) -> list
         "/installments-rules/", "/اقساط/"
     ]
     
-    for pattern in core_patterns:
-        test_url = base_path + pattern
-        try:
-            response = requests.head(test_url, headers={'User-Agent': CRAWLER_USER_AGENT}, timeout=5, allow_redirects=True)
-            if response.status_code < 400:
-                discovered_pages.append({
-                    'url': test_url,
-                    'title': pattern.strip('/').replace('-', ' ').title(),
-                    'type': 'auto_discovered_core_page'
-                })
-                logger.info(f"✓ Found core page: {test_url}")
-        except requests.exceptions.RequestException:
-            # Silently continue - many URLs won't exist
-            pass
+    test_urls = [base_path + pattern for pattern in core_patterns]
+    for pattern, test_url, status in zip(core_patterns, test_urls, _probe_urls(test_urls, timeout=5)):
+        # Errors are skipped silently - many URLs won't exist
+        if not isinstance(status, Exception) and status < 400:
+            discovered_pages.append({
+                'url': test_url,
+                'title': pattern.strip('/').replace('-', ' ').title(),
+                'type': 'auto_discovered_core_page'
+            })
+            logger.info(f"✓ Found core page: {test_url}")
     
     logger.info(f"Core page discovery completed: {len(discovered_pages)} pages found")
     return discovered_pages
 
 # --- Job Management (Thread-Safe) ---
-jobs = {}
-jobs_lock = threading.Lock()
+# Jobs live behind a small store interface so their state can be kept outside the worker
+# process. JOB_STORE=memory (default) keeps the original in-process dict; JOB_STORE=sqlite
+# persists jobs to JOB_STORE_PATH, so status survives restarts and is visible to every
+# Gunicorn worker on the host; JOB_STORE=redis shares them across hosts via REDIS_URL.
+# Finished jobs older than JOB_TTL_SECONDS are purged.
+JOB_STORE_BACKEND = os.getenv("JOB_STORE", "memory").lower()
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(REPORTS_DIR, "jobs.sqlite3"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", 24 * 3600))
+
+
+JOB_STORE_SHARDS = 32                         # lock stripes for the in-memory job store
+MEMORY_JOB_STORE_MAX_FINISHED = int(os.getenv("MEMORY_JOB_STORE_MAX_FINISHED", 1000))  # finished jobs kept in memory
+JOB_SUMMARY_FIELDS = ("id", "job_type", "status", "created_at", "finished_at")  # what list() returns
+
+
+class MemoryJobStore:
+    """In-process job store (single worker only).
+
+    Jobs are spread over lock-striped shards so progress updates from running jobs and
+    status polls for other jobs do not all serialise on one lock. Finished jobs are dropped
+    once older than ttl_seconds or beyond the newest max_finished, so a long-running worker
+    does not accumulate every result it ever produced; pending and running jobs are never dropped.
+    """
+
+    def __init__(self, num_shards: int = JOB_STORE_SHARDS, ttl_seconds: int = JOB_TTL_SECONDS,
+                 max_finished: int = MEMORY_JOB_STORE_MAX_FINISHED):
+        self._shards = [{} for _ in range(num_shards)]
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+        self._ttl = ttl_seconds
+        self._max_finished = max_finished
+        self._finished = collections.deque()  # (finished_at, job_id), oldest first
+        self._finished_lock = threading.Lock()
+
+    def _shard(self, job_id: str) -> int:
+        return hash(job_id) % len(self._shards)
+
+    def create(self, job_type: str, **fields) -> str:
+        job_id = str(uuid.uuid4())
+        job = {"id": job_id, "job_type": job_type, "status": "pending", "created_at": time.time()}
+        job.update(fields)
+        i = self._shard(job_id)
+        with self._locks[i]:
+            self._shards[i][job_id] = job
+        return job_id
+
+    def get(self, job_id: str):
+        """Shallow copy of the job, or None."""
+        i = self._shard(job_id)
+        with self._locks[i]:
+            job = self._shards[i].get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id: str, patch: dict):
+        i = self._shard(job_id)
+        with self._locks[i]:
+            job = self._shards[i].get(job_id)
+            if job is None:
+                return
+            job.update(patch)
+        if patch.get("finished_at") is not None:
+            self._retire(job_id, patch["finished_at"])
+        job_events.publish(job_id, patch)
+
+    def _retire(self, job_id: str, finished_at: float):
+        """Record a finished job and evict finished jobs past the TTL or over the cap."""
+        evicted = []
+        with self._finished_lock:
+            self._finished.append((finished_at, job_id))
+            cutoff = time.time() - self._ttl
+            while self._finished and (len(self._finished) > self._max_finished
+                                      or self._finished[0][0] < cutoff):
+                evicted.append(self._finished.popleft()[1])
+        for old_id in evicted:
+            i = self._shard(old_id)
+            with self._locks[i]:
+                self._shards[i].pop(old_id, None)
+
+    def list(self) -> list:
+        """Summary fields of every job; each shard is locked only while its jobs are read."""
+        jobs = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                rows = [tuple(j.get(f) for f in JOB_SUMMARY_FIELDS) for j in shard.values()]
+            jobs.extend(dict(zip(JOB_SUMMARY_FIELDS, row)) for row in rows)
+        return jobs
+
+
+class SQLiteJobStore:
+    """SQLite-backed job store shared by all processes on the host.
+
+    Each job is one row: indexed summary columns plus the full document as zlib-compressed
+    JSON (knowledge bases and page results compress several-fold).
+    """
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self._path = path
+        self._ttl = ttl_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()  # serialises read-modify-write updates within this process
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().conn.execute("PRAGMA journal_mode=WAL")  # must run outside a transaction
+        with self._conn() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, job_type TEXT, status TEXT,
+                created_at REAL, finished_at REAL, data BLOB)""")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return _SQLiteTransaction(conn)
+
+    @staticmethod
+    def _encode(job: dict) -> bytes:
+        return zlib.compress(json_dumps(job), 3)
+
+    @staticmethod
+    def _decode(blob: bytes) -> dict:
+        return json_loads(zlib.decompress(blob))
+
+    def _write(self, conn, job: dict):
+        conn.execute("INSERT OR REPLACE INTO jobs (id, job_type, status, created_at, finished_at, data) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (job["id"], job.get("job_type"), job.get("status"), job.get("created_at"),
+                      job.get("finished_at"), self._encode(job)))
+
+    def create(self, job_type: str, **fields) -> str:
+        job_id = str(uuid.uuid4())
+        job = {"id": job_id, "job_type": job_type, "status": "pending", "created_at": time.time()}
+        job.update(fields)
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                         (time.time() - self._ttl,))
+            self._write(conn, job)
+        return job_id
+
+    def get(self, job_id: str):
+        with self._conn() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row[0]) if row else None
+
+    def update(self, job_id: str, patch: dict):
+        with self._lock, self._conn() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = self._decode(row[0])
+            job.update(patch)
+            self._write(conn, job)
+        job_events.publish(job_id, patch)
+
+    def list(self) -> list:
+        with self._conn() as conn:
+            rows = conn.execute("SELECT id, job_type, status, created_at, finished_at FROM jobs").fetchall()
+        return [{"id": r[0], "job_type": r[1], "status": r[2], "created_at": r[3], "finished_at": r[4]}
+                for r in rows]
+
+
+class RedisJobStore:
+    """Redis-backed job store shared by every worker and host pointing at REDIS_URL.
+
+    Each job is a hash ``job:<id>`` with one JSON-encoded value per field, so an update is a
+    single pipelined HSET of the patched fields rather than a read-modify-write of the whole
+    document. A sorted set indexes job ids by creation time for list().
+    """
+
+    INDEX_KEY = "jobs:index"
+
+    def __init__(self, url: str, ttl_seconds: int):
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = ttl_seconds
+        self._redis.ping()  # fail fast at startup rather than on the first request
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def create(self, job_type: str, **fields) -> str:
+        job_id = str(uuid.uuid4())
+        job = {"id": job_id, "job_type": job_type, "status": "pending", "created_at": time.time()}
+        job.update(fields)
+        pipe = self._redis.pipeline()
+        pipe.hset(self._key(job_id), mapping={k: json_dumps(v) for k, v in job.items()})
+        pipe.zadd(self.INDEX_KEY, {job_id: job["created_at"]})
+        pipe.execute()
+        return job_id
+
+    def get(self, job_id: str):
+        raw = self._redis.hgetall(self._key(job_id))
+        if not raw:
+            return None
+        return {k.decode("utf-8"): json_loads(v) for k, v in raw.items()}
+
+    def update(self, job_id: str, patch: dict):
+        key = self._key(job_id)
+        if not self._redis.exists(key):
+            return  # expired or unknown; don't resurrect a partial hash
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping={k: json_dumps(v) for k, v in patch.items()})
+        if patch.get("finished_at") is not None:
+            pipe.expire(key, self._ttl)
+        pipe.execute()
+        job_events.publish(job_id, patch)
+
+    def list(self) -> list:
+        # Expired job hashes leave their id behind in the index; prune those as we go.
+        job_ids = [j.decode("utf-8") for j in self._redis.zrange(self.INDEX_KEY, 0, -1)]
+        pipe = self._redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(self._key(job_id), JOB_SUMMARY_FIELDS)
+        jobs, stale = [], []
+        for job_id, values in zip(job_ids, pipe.execute()):
+            if values[0] is None:
+                stale.append(job_id)
+                continue
+            jobs.append({f: json_loads(v) if v is not None else None for f, v in zip(JOB_SUMMARY_FIELDS, values)})
+        if stale:
+            self._redis.zrem(self.INDEX_KEY, *stale)
+        return jobs
+
+    def get_cached(self, key: str):
+        """Value stored with set_cached, or None; lets other caches share this Redis."""
+        try:
+            raw = self._redis.get(f"cache:{key}")
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache read failed for {key}: {e}")
+            return None
+        return json_loads(raw) if raw is not None else None
+
+    def set_cached(self, key: str, value, ttl_seconds: int):
+        try:
+            self._redis.set(f"cache:{key}", json_dumps(value), ex=ttl_seconds)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache write failed for {key}: {e}")
+
+
+class _SQLiteTransaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT on a connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_job_store():
+    if JOB_STORE_BACKEND == "sqlite":
+        logger.info(f"Using SQLite job store at {JOB_STORE_PATH}")
+        return SQLiteJobStore(JOB_STORE_PATH, JOB_TTL_SECONDS)
+    if JOB_STORE_BACKEND == "redis":
+        if REDIS_AVAILABLE:
+            logger.info(f"Using Redis job store at {REDIS_URL}")
+            return RedisJobStore(REDIS_URL, JOB_TTL_SECONDS)
+        logger.warning("JOB_STORE=redis but redis is not installed; using in-memory job store.")
+    elif JOB_STORE_BACKEND != "memory":
+        logger.warning(f"Unknown JOB_STORE '{JOB_STORE_BACKEND}'; using in-memory job store.")
+    return MemoryJobStore()
+
+
+job_store = create_job_store()
+
+# Job fields pushed to /api/jobs/<id>/stream subscribers; results and knowledge bases stay
+# on the status endpoint.
+JOB_EVENT_FIELDS = ("status", "progress", "progress_fa", "error", "finished_at")
+JOB_TERMINAL_STATUSES = frozenset({"completed", "failed", "cancelled"})
+JOB_STREAM_KEEPALIVE_SECONDS = 15
+
+
+class JobEventBroker:
+    """Fans job updates out to the stream subscribers in this process (one queue each)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = collections.defaultdict(list)  # job_id -> [queue.Queue]
+
+    def subscribe(self, job_id: str) -> queue.Queue:
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[job_id].append(q)
+        return q
+
+    def unsubscribe(self, job_id: str, q: queue.Queue):
+        with self._lock:
+            subs = self._subscribers.get(job_id)
+            if subs and q in subs:
+                subs.remove(q)
+                if not subs:
+                    del self._subscribers[job_id]
+
+    def publish(self, job_id: str, patch: dict):
+        with self._lock:
+            subs = list(self._subscribers.get(job_id, ()))
+        if not subs:
+            return
+        event = {k: patch[k] for k in JOB_EVENT_FIELDS if k in patch}
+        if event:
+            for q in subs:
+                q.put(event)
+
+
+job_events = JobEventBroker()
+
+
+def _sse_event(data: dict) -> str:
+    return f"data: {json_dumps(data).decode('utf-8')}\n\n"
+
+# Background jobs run on one bounded pool instead of a new thread per request; submissions
+# beyond MAX_CONCURRENT_JOBS queue (status stays "pending") until a worker frees up.
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 8))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", 32))  # waiting jobs before new ones are refused with 503
+JOB_QUEUE_RETRY_AFTER_SECONDS = 30
+JOB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="job")
+_job_futures = {}  # job_id -> Future, for jobs submitted by this process
+_job_futures_lock = threading.Lock()
+
+
+def submit_job(job_id: str, fn, *args, **kwargs):
+    """Queue a job runner on JOB_EXECUTOR and track its future for cancellation."""
+    future = JOB_EXECUTOR.submit(fn, job_id, *args, **kwargs)
+    with _job_futures_lock:
+        _job_futures[job_id] = future
+
+    def _done(f):
+        with _job_futures_lock:
+            _job_futures.pop(job_id, None)
+        if not f.cancelled() and f.exception() is not None:
+            e = f.exception()
+            logger.error(f"Job {job_id} crashed: {e}", exc_info=e)
+            job_store.update(job_id, {"status": "failed", "error": str(e), "finished_at": time.time()})
+
+    future.add_done_callback(_done)
+    return future
+
+
+def job_queue_full() -> bool:
+    """True when MAX_CONCURRENT_JOBS jobs are running and MAX_QUEUED_JOBS more are waiting in this process."""
+    with _job_futures_lock:
+        return len(_job_futures) >= MAX_CONCURRENT_JOBS + MAX_QUEUED_JOBS
+
+
+def _job_queue_full_response():
+    response = jsonify({"error": "Too many jobs in progress. Please retry later."})
+    response.headers["Retry-After"] = str(JOB_QUEUE_RETRY_AFTER_SECONDS)
+    return response, 503
+
+
+def cancel_job(job_id: str) -> bool:
+    """Cancel a job that is still queued. Running jobs cannot be interrupted."""
+    with _job_futures_lock:
+        future = _job_futures.get(job_id)
+    if future is None or not future.cancel():
+        return False
+    job_store.update(job_id, {"status": "cancelled", "finished_at": time.time()})
+    return True
 
 
 # --- Authentication Decorator ---
@@ -523,162 +1606,620 @@ def require_api_key(f):
 
 # --- Helper Functions (Shared & Feature-Specific) ---
 
+TOKEN_COUNT_CACHE_SIZE = 4096
+TOKENIZER_THREADS = min(8, os.cpu_count() or 1)  # encode_batch() threads (tiktoken's default of 8 oversubscribes small boxes)
+_token_count_cache = collections.OrderedDict()  # blake2b digest -> token count (LRU order)
+_token_count_cache_lock = threading.Lock()
+
 def count_tokens(text: str) -> int:
-    """Counts tokens using the tiktoken library for better accuracy."""
-    if TOKENIZER and text:
+    """Counts tokens using the tiktoken library for better accuracy.
+
+    Memoized in an LRU keyed on a 16-byte blake2b digest: the same prompts and section
+    texts are re-counted repeatedly (batching, size budgets), and hashing is far cheaper
+    than BPE encoding while not pinning large strings in memory.
+    """
+    tokenizer = load_tokenizer()
+    if not tokenizer or not text:
+        return 0
+    key = _token_digest(text)
+    with _token_count_cache_lock:
+        cached = _token_count_cache.get(key)
+        if cached is not None:
+            _token_count_cache.move_to_end(key)
+            return cached
+    try:
+        # disallowed_special=(): scraped text may contain "<|endoftext|>"-style strings, which
+        # encode() otherwise rejects (and the count would silently fall to 0).
+        n_tokens = len(tokenizer.encode(text, disallowed_special=()))
+    except Exception:
+        return 0
+    _remember_token_counts({key: n_tokens})
+    return n_tokens
+
+def _token_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+def _fits_without_tokenizing(text: str, max_tokens: int) -> bool:
+    """True when text certainly has at most max_tokens tokens, decided without running the BPE.
+
+    Every token covers at least one UTF-8 byte, and a character is at most 4 bytes.
+    """
+    if len(text) * 4 <= max_tokens:
+        return True
+    return len(text) <= max_tokens and len(text.encode('utf-8', 'surrogatepass')) <= max_tokens
+
+def _remember_token_counts(counts: dict):
+    with _token_count_cache_lock:
+        _token_count_cache.update(counts)
+        while len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _token_count_cache.popitem(last=False)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens (unchanged if it already fits or no tokenizer)."""
+    tokenizer = load_tokenizer()
+    if not tokenizer or not text or _fits_without_tokenizing(text, max_tokens):
+        return text
+    key = _token_digest(text)
+    with _token_count_cache_lock:
+        cached = _token_count_cache.get(key)
+    if cached is not None and cached <= max_tokens:
+        return text
+    # Encoded once: the count is taken from (and memoised off) the same tokens that are cut.
+    try:
+        tokens = tokenizer.encode(text, disallowed_special=())
+    except Exception:
+        return text
+    _remember_token_counts({key: len(tokens)})
+    if len(tokens) <= max_tokens:
+        return text
+    # A cut inside a multi-byte character decodes to U+FFFD; drop it.
+    return tokenizer.decode(tokens[:max_tokens]).rstrip("\ufffd")
+
+def count_tokens_batch(texts: list) -> list:
+    """count_tokens() for many texts at once.
+
+    Memo hits are looked up as usual; the misses are encoded in a single encode_batch() call,
+    which tiktoken spreads over TOKENIZER_THREADS threads outside the GIL (a lone miss is
+    encoded directly, skipping the thread pool).
+    """
+    counts = [0] * len(texts)
+    tokenizer = load_tokenizer()
+    if not tokenizer:
+        return counts
+    keys = [_token_digest(t) if t else None for t in texts]
+    missing = {}  # digest -> text, deduplicated
+    with _token_count_cache_lock:
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            cached = _token_count_cache.get(key)
+            if cached is not None:
+                _token_count_cache.move_to_end(key)
+                counts[i] = cached
+            else:
+                missing[key] = texts[i]
+    if missing:
         try:
-            return len(TOKENIZER.encode(text))
+            if len(missing) == 1:
+                encoded = [tokenizer.encode(next(iter(missing.values())), disallowed_special=())]
+            else:
+                encoded = tokenizer.encode_batch(list(missing.values()), num_threads=TOKENIZER_THREADS,
+                                                 disallowed_special=())
         except Exception:
-            return 0
-    return 0
+            return [count_tokens(t) for t in texts]
+        fresh = {key: len(tokens) for key, tokens in zip(missing, encoded)}
+        _remember_token_counts(fresh)
+        for i, key in enumerate(keys):
+            if key in fresh:
+                counts[i] = fresh[key]
+    return counts
 
 # --- Feature: HTML Element/XPath Analysis (from Code 1) ---
 
+# Lookup tables for generate_xpath_for_element, built once instead of per element.
+# Pattern lists keep their original substring semantics via precompiled alternations.
+# Includes Persian and Arabic-Indic digits, which str.isdigit() also matched.
+_DIGIT_CHARS = "0123456789\u06f0\u06f1\u06f2\u06f3\u06f4\u06f5\u06f6\u06f7\u06f8\u06f9\u0660\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669"
+_DIGITS = frozenset(_DIGIT_CHARS)
+_DIGIT_STRIP_TABLE = str.maketrans("", "", _DIGIT_CHARS)
+_COUNT_STRIP_TABLE = str.maketrans("", "", ".MK,")
+_DYNAMIC_ID_RE = re.compile("random|temp|gen|auto")
+_USER_ID_RE = re.compile("username|user_|profile_")
+_STABLE_IDS = frozenset(['react-root', 'app', 'main', 'header', 'footer', 'content', 'nav', 'menu'])
+_ACTION_WORDS_RE = re.compile("|".join([
+    'follow', 'following', 'unfollow', 'like', 'share', 'comment', 'login', 'sign', 'submit', 'home',
+    'profile', 'search', 'menu', 'save', 'edit', 'delete', 'add', 'create', 'more', 'view', 'show',
+    'hide', 'close', 'open', 'next', 'previous', 'back', 'forward', 'up', 'down', 'settings',
+    'options', 'message', 'send', 'posts', 'story', 'stories', 'reels', 'tagged']))
+_COUNT_LABEL_RE = re.compile("followers|following|posts")
+_SEMANTIC_ATTRS = (
+    ('role', frozenset(['button', 'link', 'menu', 'dialog', 'tab', 'navigation', 'main'])),
+    ('type', frozenset(['button', 'submit', 'search'])),
+    ('aria-label', None), ('data-testid', None), ('name', None), ('placeholder', None), ('alt', None), ('title', None),
+)
+_USER_HREF_RE = re.compile("/@|/user/|/profile/")
+_SEMANTIC_CLASS_RE = re.compile("btn|button|nav|menu|header|footer|post|like|share|follow")
+MAX_XPATH_TEXT_LENGTH = 30  # longer element text is never used in a text() XPath
+
+
+def _short_text(strings) -> str:
+    """Concatenated stripped strings, or "" as soon as they reach MAX_XPATH_TEXT_LENGTH.
+
+    Container matches (forms, role=button wrappers) can hold whole page sections; the
+    text is only usable when short, so stop walking the subtree once it cannot be.
+    """
+    parts, length = [], 0
+    for s in strings:
+        s = s.strip()
+        length += len(s)
+        if length >= MAX_XPATH_TEXT_LENGTH:
+            return ""
+        parts.append(s)
+    return "".join(parts)
+
 def generate_xpath_for_element(element, soup):
     """Generate generic xpath queries that work across different users/profiles."""
     if not element or not element.name:
         return ""
-    
+    return _generic_xpaths(element.name, element.get, _short_text(element.stripped_strings), element.get('class'))
+
+def _generate_xpath_for_lxml_element(element) -> list:
+    """generate_xpath_for_element() for an lxml element (same text/class semantics as bs4)."""
+    text = _short_text(element.itertext())
+    classes = element.get('class')
+    return _generic_xpaths(element.tag, element.get, text, classes.split() if classes else None)
+
+def _generic_xpaths(tag_name: str, get_attr, text: str, classes) -> list:
     xpath_queries = []
-    tag_name = element.name
     
     # 1. XPath by ID (only if generic/meaningful and stable)
-    if element.get('id'):
-        element_id = element.get('id')
+    element_id = get_attr('id')
+    if element_id:
+        id_has_digit = not _DIGITS.isdisjoint(element_id)
+        id_lower = element_id.lower()
         is_dynamic_id = (
-            len(element_id) > 10 and any(char.isdigit() for char in element_id) or
+            len(element_id) > 10 and id_has_digit or
             '__' in element_id or element_id.startswith('id_') or
-            len([c for c in element_id if c.isdigit()]) > 3 or
-            any(pattern in element_id.lower() for pattern in ['random', 'temp', 'gen', 'auto'])
+            len(element_id) - len(element_id.translate(_DIGIT_STRIP_TABLE)) > 3 or
+            _DYNAMIC_ID_RE.search(id_lower) is not None
         )
-        stable_ids = ['react-root', 'app', 'main', 'header', 'footer', 'content', 'nav', 'menu']
         if (not is_dynamic_id and 
-            (element_id in stable_ids or (len(element_id) < 8 and not any(char.isdigit() for char in element_id))) and
-            not any(social_term in element_id.lower() for social_term in ['username', 'user_', 'profile_'])):
+            (element_id in _STABLE_IDS or (len(element_id) < 8 and not id_has_digit)) and
+            not _USER_ID_RE.search(id_lower)):
             xpath_queries.append(f"//{tag_name}[@id='{element_id}']")
     
     # 2. XPath by generic text patterns (avoid user-specific content)
-    if element.get_text(strip=True):
-        text = element.get_text(strip=True)
-        action_words = ['follow', 'following', 'unfollow', 'like', 'share', 'comment', 'login', 'sign', 'submit', 'home', 
-                       'profile', 'search', 'menu', 'save', 'edit', 'delete', 'add', 'create', 'more', 'view', 'show', 
-                       'hide', 'close', 'open', 'next', 'previous', 'back', 'forward', 'up', 'down', 'settings', 
-                       'options', 'message', 'send', 'posts', 'story', 'stories', 'reels', 'tagged']
-        if (len(text) > 1 and len(text) < 30 and 
-            not text.replace('.', '').replace('M', '').replace('K', '').replace(',', '').isdigit() and
-            not any(char.isdigit() for char in text) and not '@' in text and
-            not 'followers' in text.lower() and not 'following' in text.lower() and not 'posts' in text.lower() and
-            any(word in text.lower() for word in action_words)):
+    if text and 1 < len(text) < MAX_XPATH_TEXT_LENGTH:
+        text_lower = text.lower()
+        if (not text.translate(_COUNT_STRIP_TABLE).isdigit() and
+            _DIGITS.isdisjoint(text) and '@' not in text and
+            not _COUNT_LABEL_RE.search(text_lower) and
+            _ACTION_WORDS_RE.search(text_lower)):
             escaped_text = text.replace("'", "\\'")
             xpath_queries.append(f"//{tag_name}[contains(text(), '{escaped_text}')]")
             xpath_queries.append(f"//{tag_name}[text()='{escaped_text}']")
 
     # 3. XPath by semantic attributes
-    semantic_attrs = {'role': ['button', 'link', 'menu', 'dialog', 'tab', 'navigation', 'main'], 'type': ['button', 'submit', 'search'],
-                      'aria-label': None, 'data-testid': None, 'name': None, 'placeholder': None, 'alt': None, 'title': None}
-    for attr, valid_values in semantic_attrs.items():
-        if element.get(attr):
-            attr_value = element.get(attr)
+    for attr, valid_values in _SEMANTIC_ATTRS:
+        attr_value = get_attr(attr)
+        if attr_value:
             if valid_values is None or attr_value in valid_values:
                 if len(attr_value) < 50:
                     if attr == 'alt' and 'profile picture' in attr_value.lower():
                         xpath_queries.append(f"//{tag_name}[contains(@alt, 'profile picture')]")
-                    elif not any(char.isdigit() for char in attr_value) and not '@' in attr_value:
+                    elif _DIGITS.isdisjoint(attr_value) and '@' not in attr_value:
                         xpath_queries.append(f"//{tag_name}[@{attr}='{attr_value}']")
 
     # (Simplified remaining XPath logic for brevity, full logic from original is complex)
-    if element.get('href') and not any(user_indicator in element.get('href').lower() for user_indicator in ['/@', '/user/', '/profile/']):
-        xpath_queries.append(f"//{tag_name}[@href='{element.get('href')}']")
+    href = get_attr('href')
+    if href and not _USER_HREF_RE.search(href.lower()):
+        xpath_queries.append(f"//{tag_name}[@href='{href}']")
 
     # Fallback to class if needed
-    if element.get('class') and not xpath_queries:
-        semantic_patterns = ['btn', 'button', 'nav', 'menu', 'header', 'footer', 'post', 'like', 'share', 'follow']
-        for cls in element.get('class'):
-            if any(pattern in cls.lower() for pattern in semantic_patterns) and len(cls) < 25:
+    if classes and not xpath_queries:
+        for cls in classes:
+            if len(cls) < 25 and _SEMANTIC_CLASS_RE.search(cls.lower()):
                 xpath_queries.append(f"//{tag_name}[contains(@class, '{cls}')]")
                 break
     
-    seen = set()
-    return [x for x in xpath_queries if not (x in seen or seen.add(x))][:5]
+    return list(dict.fromkeys(xpath_queries))[:5]
+
+ELEMENT_CATEGORIES = {
+    'buttons': ['button', '[role="button"]', 'input[type="button"]', 'input[type="submit"]'],
+    'links': ['a[href]'], 'inputs': ['input', 'textarea', 'select'], 'forms': ['form'],
+    'images': ['img'], 'headings': ['h1', 'h2', 'h3'],
+    'like_buttons': ['[aria-label*="like" i]', '[data-testid*="like"]'],
+    'share_buttons': ['[aria-label*="share" i]', '[data-testid*="share"]'],
+    'follow_buttons': ['[aria-label*="follow" i]', '[data-testid*="follow"]', 'button:-soup-contains("Follow")'],
+    'follower_counts': ['[href*="/followers"]'], 'following_counts': ['[href*="/following"]'],
+    'tweet_content': ['[data-testid="tweetText"]']
+}
+MAX_ELEMENTS_PER_SELECTOR = 5  # limit to avoid excessive processing
+
+@functools.lru_cache(maxsize=None)
+def _compiled_element_selectors() -> tuple:
+    """(category, compiled CSS selector) pairs for the BeautifulSoup fallback, compiled on first use.
+
+    With lxml installed extraction runs on _COMPILED_ELEMENT_XPATHS and soupsieve never compiles.
+    """
+    return tuple((name, soupsieve.compile(sel)) for name, sels in ELEMENT_CATEGORIES.items() for sel in sels)
+
+# XPath 1.0 equivalents of ELEMENT_CATEGORIES for the lxml path (keep the two in sync).
+# Attribute selectors walk the attribute axis and step up to the owning element: libxml2
+# then tests only nodes carrying that attribute instead of every element via //*[...]
+# (several times faster on large pages; results stay in document order).
+_XPATH_LOWER = "translate({}, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+_ELEMENT_SELECTOR_XPATHS = {
+    'button': "//button",
+    '[role="button"]': "//@role[.='button']/..",
+    'input[type="button"]': f"//input[{_XPATH_LOWER.format('@type')}='button']",
+    'input[type="submit"]': f"//input[{_XPATH_LOWER.format('@type')}='submit']",
+    'a[href]': "//a[@href]",
+    'input': "//input", 'textarea': "//textarea", 'select': "//select", 'form': "//form",
+    'img': "//img", 'h1': "//h1", 'h2': "//h2", 'h3': "//h3",
+    '[aria-label*="like" i]': f"//@aria-label[contains({_XPATH_LOWER.format('.')}, 'like')]/..",
+    '[data-testid*="like"]': "//@data-testid[contains(., 'like')]/..",
+    '[aria-label*="share" i]': f"//@aria-label[contains({_XPATH_LOWER.format('.')}, 'share')]/..",
+    '[data-testid*="share"]': "//@data-testid[contains(., 'share')]/..",
+    '[aria-label*="follow" i]': f"//@aria-label[contains({_XPATH_LOWER.format('.')}, 'follow')]/..",
+    '[data-testid*="follow"]': "//@data-testid[contains(., 'follow')]/..",
+    'button:-soup-contains("Follow")': "//button[contains(string(.), 'Follow')]",
+    '[href*="/followers"]': "//@href[contains(., '/followers')]/..",
+    '[href*="/following"]': "//@href[contains(., '/following')]/..",
+    '[data-testid="tweetText"]': "//@data-testid[.='tweetText']/..",
+}
+_COMPILED_ELEMENT_XPATHS = [
+    (name, lxml_etree.XPath(f"({_ELEMENT_SELECTOR_XPATHS[sel]})[position() <= {MAX_ELEMENTS_PER_SELECTOR}]"))
+    for name, sels in ELEMENT_CATEGORIES.items() for sel in sels
+] if LXML_AVAILABLE else []
+
+_XML_DECLARATION_RE = re.compile(r'^\ufeff?\s*<\?xml[^>]*\?>')
+
+def _lxml_document(html_content: str, fragment: bool = False):
+    """Parse HTML with lxml, tolerating an XML encoding declaration in str input.
+
+    XHTML pages often start with <?xml ... encoding="..."?>, which lxml refuses on an
+    already-decoded str; the declaration is dropped (the text is decoded already) rather
+    than handing the page to the much slower BeautifulSoup fallback.
+    """
+    fromstring = lxml_html.fromstring if fragment else lxml_html.document_fromstring
+    try:
+        return fromstring(html_content)
+    except ValueError:  # "Unicode strings with encoding declaration are not supported"
+        return fromstring(_XML_DECLARATION_RE.sub('', html_content, count=1))
 
 def extract_all_elements(html_content: str) -> dict:
     """Extract all elements and their xpath queries from any HTML content."""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    elements_map = {}
-    logger.info(f"Found {len(soup.find_all())} total HTML tags in the page")
-    
-    element_categories = {
-        'buttons': ['button', '[role="button"]', 'input[type="button"]', 'input[type="submit"]'],
-        'links': ['a[href]'], 'inputs': ['input', 'textarea', 'select'], 'forms': ['form'],
-        'images': ['img'], 'headings': ['h1', 'h2', 'h3'],
-        'like_buttons': ['[aria-label*="like" i]', '[data-testid*="like"]'],
-        'share_buttons': ['[aria-label*="share" i]', '[data-testid*="share"]'],
-        'follow_buttons': ['[aria-label*="follow" i]', '[data-testid*="follow"]', 'button:contains("Follow")'],
-        'follower_counts': ['[href*="/followers"]'], 'following_counts': ['[href*="/following"]'],
-        'tweet_content': ['[data-testid="tweetText"]']
-    }
-    
-    for element_name, selectors in element_categories.items():
-        xpath_list = []
-        for selector in selectors:
-            try:
-                # This is a simplified selector logic for the merged file. The original was very complex.
-                found_elements = soup.select(selector)
-                for element in found_elements[:5]: # Limit to avoid excessive processing
-                    xpaths = generate_xpath_for_element(element, soup)
-                    for xpath in xpaths:
-                        if xpath and xpath not in xpath_list:
-                            xpath_list.append(xpath)
-            except Exception as e:
-                logger.debug(f"Error processing selector '{selector}': {e}")
-                continue
-        if xpath_list:
-            elements_map[element_name] = xpath_list
-            logger.info(f"Found {len(xpath_list)} xpaths for {element_name}")
-            
+    if LXML_AVAILABLE:
+        try:
+            return _extract_all_elements_lxml(html_content)
+        except lxml_etree.ParserError as e:
+            logger.warning(f"lxml could not parse HTML ({e}); falling back to BeautifulSoup.")
+    return _extract_all_elements_soup(html_content)
+
+def _log_elements_map(elements_map: dict) -> dict:
+    for element_name, xpath_list in elements_map.items():
+        logger.info(f"Found {len(xpath_list)} xpaths for {element_name}")
     logger.info(f"Total element types found: {len(elements_map)}")
     return elements_map
 
+def _extract_all_elements_lxml(html_content: str) -> dict:
+    # Parsing and selector matching run in libxml2; each XPath stops at the per-selector cap.
+    root = _lxml_document(html_content)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Found {sum(1 for _ in root.iter(lxml_etree.Element))} total HTML tags in the page")
+    ordered_xpaths = {}
+    for element_name, xpath in _COMPILED_ELEMENT_XPATHS:
+        category_xpaths = ordered_xpaths.setdefault(element_name, {})
+        for element in xpath(root):
+            for xp in _generate_xpath_for_lxml_element(element):
+                if xp:
+                    category_xpaths[xp] = None
+    return _log_elements_map({name: list(xpaths) for name, xpaths in ordered_xpaths.items() if xpaths})
+
+def _extract_all_elements_soup(html_content: str) -> dict:
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+    all_tags = soup.find_all(True)
+    logger.info(f"Found {len(all_tags)} total HTML tags in the page")
+
+    # One pass over the DOM, matching every still-open selector against each element,
+    # instead of a full soup.select() walk per selector.
+    selectors = _compiled_element_selectors()
+    matches = [[] for _ in selectors]
+    open_selectors = list(range(len(selectors)))
+    for element in all_tags:
+        if not open_selectors:
+            break
+        for i in open_selectors:
+            try:
+                if selectors[i][1].match(element):
+                    matches[i].append(element)
+            except Exception as e:
+                logger.debug(f"Error matching selector '{selectors[i][1].pattern}': {e}")
+        open_selectors = [i for i in open_selectors if len(matches[i]) < MAX_ELEMENTS_PER_SELECTOR]
+
+    # Insertion-ordered dict per category doubles as an ordered set: O(1) duplicate checks.
+    ordered_xpaths = {}
+    for (element_name, _), found_elements in zip(selectors, matches):
+        category_xpaths = ordered_xpaths.setdefault(element_name, {})
+        for element in found_elements:
+            for xpath in generate_xpath_for_element(element, soup):
+                if xpath:
+                    category_xpaths[xpath] = None
+    return _log_elements_map({name: list(xpaths) for name, xpaths in ordered_xpaths.items() if xpaths})
+
 # --- Feature: Knowledge Base Generation (from Code 2) & General Crawling ---
 
+_TITLE_RE = re.compile(r'<title[^>]*>([^<]*)</title', re.IGNORECASE)
+
 def get_page_title_from_html(html_content):
+    # A regex on the raw markup avoids building a whole soup just to read <title>.
     if not html_content: return "N/A"
+    match = _TITLE_RE.search(html_content)
+    title = html_unescape(match.group(1)).strip() if match else ""
+    return title or "N/A"
+
+def _read_capped_body(response, max_bytes: int) -> bytearray:
+    """Read a streamed response body up to max_bytes, then stop downloading."""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        if not chunk: continue
+        buf.extend(chunk)
+        if len(buf) >= max_bytes: break
+    del buf[max_bytes:]
+    return buf
+
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_BOM_ENCODINGS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+CHARSET_SNIFF_BYTES = 2048  # how far into the body to look for a BOM or <meta charset>
+
+def _pick_encoding(response, head: bytes) -> str | None:
+    """Declared encoding of an HTML response: Content-Type charset, then a BOM or <meta charset>
+    in the first CHARSET_SNIFF_BYTES. None when nothing is declared (only then is it worth
+    running a statistical detector over the body)."""
+    match = _HEADER_CHARSET_RE.search(response.headers.get('Content-Type', ''))
+    if match:
+        return match.group(1)
+    head = bytes(head[:CHARSET_SNIFF_BYTES])
+    for bom, encoding in _BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    match = _META_CHARSET_RE.search(head)
+    return match.group(1).decode('ascii') if match else None
+
+def _decode_body(buf: bytes, response) -> str:
+    """Decode body bytes: declared charset (header, BOM, <meta>), else detected from the bytes read."""
+    encoding = _pick_encoding(response, buf)
+    if not encoding and requests.compat.chardet is not None:
+        encoding = requests.compat.chardet.detect(bytes(buf))['encoding']
     try:
-        soup_title = BeautifulSoup(html_content, 'html.parser')
-        title_tag = soup_title.find('title')
-        return title_tag.string.strip() if title_tag and title_tag.string else "N/A"
-    except Exception: return "N/A"
+        return bytes(buf).decode(encoding or 'utf-8', errors='replace')
+    except LookupError:  # bogus charset label
+        return bytes(buf).decode('utf-8', errors='replace')
+
+# Raw page HTML fetched in the last HTML_CACHE_TTL_SECONDS is reused instead of downloaded
+# again: homepage, selected pages and language-detection snippets of one job, and repeat jobs
+# on the same site, all hit the same URLs. Set HTML_CACHE_DIR (requires diskcache) to keep
+# entries across restarts; HTML_CACHE_TTL_SECONDS=0 turns the cache off.
+# Pages served with an ETag or Last-Modified are kept for HTML_CACHE_REVALIDATE_SECONDS after
+# going stale, and refetched with If-None-Match / If-Modified-Since: a 304 reuses the cached
+# copy without transferring the body again.
+HTML_CACHE_TTL_SECONDS = int(os.getenv("HTML_CACHE_TTL_SECONDS", 3600))
+HTML_CACHE_REVALIDATE_SECONDS = int(os.getenv("HTML_CACHE_REVALIDATE_SECONDS", 7 * 24 * 3600))
+HTML_CACHE_DIR = os.getenv("HTML_CACHE_DIR")
+HTML_CACHE_MAX_ENTRIES = 256                  # in-memory pages (each at most MAX_HTML_CONTENT_LENGTH chars)
+HTML_CACHE_MAX_CHARS = 64_000_000             # total in-memory HTML, so a few huge pages can't pin GBs
+# Entries are (html, fetched_at, etag, last_modified) tuples; freshness is checked on read.
+# Each one expires with its own lifetime (see _html_entry_ttl), in memory as on disk.
+_html_cache = TTLCache(max_entries=HTML_CACHE_MAX_ENTRIES, ttl_seconds=HTML_CACHE_TTL_SECONDS,
+                       max_weight=HTML_CACHE_MAX_CHARS, weigher=lambda entry: len(entry[0]))
+_html_disk_cache = None
+if HTML_CACHE_DIR and HTML_CACHE_TTL_SECONDS > 0:
+    if DISKCACHE_AVAILABLE:
+        _html_disk_cache = diskcache.Cache(HTML_CACHE_DIR)
+    else:
+        logger.warning("HTML_CACHE_DIR is set but diskcache is not installed; using in-memory HTML cache.")
+
+
+def _html_cache_entry(url: str):
+    """Cached (html, fetched_at, etag, last_modified) for url, fresh or stale, or None."""
+    if HTML_CACHE_TTL_SECONDS <= 0:
+        return None
+    entry = _html_cache.get(url)
+    if entry is None and _html_disk_cache is not None:
+        entry = _html_disk_cache.get(url)
+        if not isinstance(entry, tuple):  # missing, or a bare page written by an older version
+            return None
+        _html_cache.set(url, entry, ttl=_html_entry_ttl(entry))
+    return entry
+
+
+def _html_entry_ttl(entry: tuple) -> float:
+    """Seconds left before an entry is useless: fresh for HTML_CACHE_TTL_SECONDS, then kept
+    HTML_CACHE_REVALIDATE_SECONDS longer only if it has a validator to revalidate with."""
+    revalidatable = entry[2] or entry[3]
+    lifetime = HTML_CACHE_TTL_SECONDS + (HTML_CACHE_REVALIDATE_SECONDS if revalidatable else 0)
+    return max(0.0, entry[1] + lifetime - time.time())
+
+
+def _store_html_entry(url: str, entry: tuple):
+    ttl = _html_entry_ttl(entry)
+    _html_cache.set(url, entry, ttl=ttl)
+    if _html_disk_cache is not None:
+        _html_disk_cache.set(url, entry, expire=ttl)
+
+
+def _cached_html(url: str):
+    """Cached page HTML if it was fetched (or revalidated) within HTML_CACHE_TTL_SECONDS."""
+    entry = _html_cache_entry(url)
+    if entry is None or entry[1] + HTML_CACHE_TTL_SECONDS < time.time():
+        return None
+    return entry[0]
+
+
+def _cache_html(url: str, html: str, headers=None):
+    """Cache a fetched page, with the response's ETag / Last-Modified for later revalidation."""
+    if HTML_CACHE_TTL_SECONDS <= 0:
+        return
+    headers = headers or {}
+    _store_html_entry(url, (html, time.time(), headers.get('ETag'), headers.get('Last-Modified')))
+
+
+def _revalidation_headers(url: str) -> dict:
+    """If-None-Match / If-Modified-Since headers for a stale cached page (empty if none)."""
+    entry = _html_cache_entry(url)
+    headers = {}
+    if entry is not None:
+        if entry[2]: headers['If-None-Match'] = entry[2]
+        if entry[3]: headers['If-Modified-Since'] = entry[3]
+    return headers
+
+
+def _not_modified_html(url: str, response):
+    """The cached page, marked fresh again, when response is a 304 for it; otherwise None."""
+    if response.status_code != 304:
+        return None
+    entry = _html_cache_entry(url)
+    if entry is None:
+        return None
+    _store_html_entry(url, (entry[0], time.time(), response.headers.get('ETag') or entry[2],
+                            response.headers.get('Last-Modified') or entry[3]))
+    return entry[0]
+
 
 def fetch_url_html_content(url: str, for_lang_detect=False) -> str | None:
-    headers = {'User-Agent': CRAWLER_USER_AGENT}
+    """Page HTML (capped at MAX_HTML_CONTENT_LENGTH), or just its head snippet for language detection."""
+    html = _cached_html(url)
+    if html is not None:
+        return html[:MAX_HTML_SNIPPET_FOR_LANG_DETECT] if for_lang_detect else html
+    return _fetch_url_html_uncached(url, for_lang_detect)
+
+def _fetch_url_html_uncached(url: str, for_lang_detect=False) -> str | None:
     try:
         if for_lang_detect:
-            with requests.get(url, headers=headers, timeout=15, allow_redirects=True, stream=True) as r:
+            with HTTP_SESSION.get(url, timeout=15, allow_redirects=True, stream=True) as r:
                 r.raise_for_status()
-                if 'text/html' not in r.headers.get('Content-Type', '').lower(): return None
-                r.encoding = r.apparent_encoding or 'utf-8'
-                html_chunk = ""
-                for chunk in r.iter_content(chunk_size=1024, decode_unicode=True):
-                    if chunk and len(html_chunk) < MAX_HTML_SNIPPET_FOR_LANG_DETECT:
-                        html_chunk += chunk
-                return html_chunk
+                content_type = r.headers.get('Content-Type', '').lower()
+                if 'text/html' not in content_type: return None
+                # Read raw bytes only until the snippet is full, then drop the connection.
+                # (apparent_encoding would have pulled the entire body to sniff it.)
+                buf = bytearray()
+                for chunk in r.iter_content(chunk_size=4096):
+                    if not chunk: continue
+                    buf.extend(chunk)
+                    if len(buf) >= MAX_HTML_SNIPPET_FOR_LANG_DETECT: break
+                encoding = _pick_encoding(r, buf) or 'utf-8'
+                try:
+                    return buf[:MAX_HTML_SNIPPET_FOR_LANG_DETECT].decode(encoding, errors='replace')
+                except LookupError:  # bogus charset label in the header
+                    return buf[:MAX_HTML_SNIPPET_FOR_LANG_DETECT].decode('utf-8', errors='replace')
         else:
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding or 'utf-8'
-            return response.text[:MAX_HTML_CONTENT_LENGTH]
+            # Streamed and capped like fetch_url_content: bytes past MAX_HTML_FETCH_BYTES would
+            # be sliced off anyway, so they are never downloaded (or decompressed).
+            # The full page is cached; a snippet is not the page.
+            with HTTP_SESSION.get(url, timeout=REQUEST_TIMEOUT, allow_redirects=True, stream=True,
+                                  headers=_revalidation_headers(url)) as response:
+                response.raise_for_status()
+                html = _not_modified_html(url, response)
+                if html is not None:
+                    return html
+                if 'html' not in response.headers.get('Content-Type', '').lower():
+                    logger.warning(f"URL {url} is not HTML content.")
+                    return None
+                html = _decode_body(_read_capped_body(response, MAX_HTML_FETCH_BYTES), response)
+            html = html[:MAX_HTML_CONTENT_LENGTH]
+            _cache_html(url, html, response.headers)
+            return html
     except requests.exceptions.RequestException as req_err:
         logger.error(f"Error fetching HTML for {url}: {req_err}")
         if not for_lang_detect: raise ConnectionError(f"Failed to fetch URL content: {req_err}") from req_err
     return None
 
+_PREPROCESS_NOISE_TAGS = ("script", "style", "nav", "footer", "header", "noscript", "meta", "link", "svg")
+
 def preprocess_html_for_extraction(html: str) -> str:
     """Strip noise tags before sending to AI to save tokens."""
-    soup = BeautifulSoup(html, 'html.parser')
-    for tag in soup(["script", "style", "nav", "footer", "header", "noscript", "meta", "link", "svg"]):
+    if LXML_AVAILABLE:
+        try:
+            tree = _lxml_document(html)
+            lxml_etree.strip_elements(tree, *_PREPROCESS_NOISE_TAGS, with_tail=False)
+            return lxml_html.tostring(tree, encoding="unicode")[:MAX_HTML_CONTENT_LENGTH]
+        except (lxml_etree.ParserError, ValueError) as e:
+            logger.debug(f"lxml HTML preprocessing failed, falling back to BeautifulSoup: {e}")
+    soup = BeautifulSoup(html, HTML_PARSER)
+    for tag in soup(list(_PREPROCESS_NOISE_TAGS)):
         tag.decompose()
     return str(soup)[:MAX_HTML_CONTENT_LENGTH]
 
+_LLM_NOISE_TAGS = ("script", "noscript", "svg", "iframe", "template")
+_LLM_NOISE_ATTR_PREFIXES = ("on", "data-")    # inline event handlers (JS) and framework data attributes
+_LLM_NOISE_ATTRS = frozenset({"srcset", "sizes", "integrity", "nonce"})
+
+def _is_noise_attr(name: str, keep_styles: bool) -> bool:
+    return (name.startswith(_LLM_NOISE_ATTR_PREFIXES) or name in _LLM_NOISE_ATTRS
+            or (name == "style" and not keep_styles))
+_DATA_URI_RE = re.compile(r'data:[a-z]+/[a-z0-9.+-]+;base64,[a-z0-9+/=\s]+', re.IGNORECASE)
+_WHITESPACE_RUN_RE = re.compile(r'\s+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+def clean_html_for_llm(html: str, keep_styles: bool = False) -> str:
+    """Shrink raw HTML that must be shown to the LLM as markup (not as extracted text).
+
+    Drops scripts, SVG, iframes, templates and comments (and <style> unless keep_styles),
+    inline event handlers, data-* and srcset-style attributes (and style="" unless keep_styles),
+    blanks inline base64 data URIs and collapses whitespace runs. Typically removes most of
+    a page's bytes while keeping the structure, classes and inline colours intact.
+    """
+    if not html:
+        return ""
+    tags = _LLM_NOISE_TAGS if keep_styles else _LLM_NOISE_TAGS + ("style",)
+    cleaned = None
+    if LXML_AVAILABLE:
+        try:
+            tree = _lxml_document(html, fragment=True)
+            lxml_etree.strip_elements(tree, lxml_etree.Comment, *tags, with_tail=False)
+            for el in tree.iter(lxml_etree.Element):
+                attrib = el.attrib
+                for name in [n for n in attrib if _is_noise_attr(n, keep_styles)]:
+                    del attrib[name]
+            cleaned = lxml_html.tostring(tree, encoding="unicode")
+        except (lxml_etree.ParserError, ValueError) as e:
+            logger.debug(f"lxml HTML cleanup failed, falling back to BeautifulSoup: {e}")
+    if cleaned is None:
+        soup = BeautifulSoup(html, HTML_PARSER)
+        for tag in soup(list(tags)):
+            tag.decompose()
+        for comment in soup.find_all(string=lambda t: isinstance(t, Comment)):
+            comment.extract()
+        for tag in soup.find_all(True):
+            tag.attrs = {k: v for k, v in tag.attrs.items() if not _is_noise_attr(k, keep_styles)}
+        cleaned = str(soup)
+    cleaned = _DATA_URI_RE.sub("data:,", cleaned)
+    return _WHITESPACE_RUN_RE.sub(" ", cleaned).strip()
+
+def _html_text(html: str, drop_tags=(), body_only: bool = False) -> str:
+    """Newline-joined, stripped text nodes of an HTML document (as BeautifulSoup's get_text(strip=True)).
+
+    Walks lxml's C-built tree directly when available instead of materialising a BeautifulSoup tree.
+    """
+    if LXML_AVAILABLE:
+        try:
+            tree = _lxml_document(html)
+            # get_text() never returns comment, <script>, <style> or <template> strings either.
+            lxml_etree.strip_elements(tree, lxml_etree.Comment, "script", "style", "template", *drop_tags, with_tail=False)
+            if body_only:
+                tree = tree.find('body')
+                if tree is None: return ""
+            return "\n".join(t for t in (s.strip() for s in tree.itertext()) if t)
+        except (lxml_etree.ParserError, ValueError) as e:
+            logger.debug(f"lxml text extraction failed, falling back to BeautifulSoup: {e}")
+    soup = BeautifulSoup(html, HTML_PARSER)
+    for tag in soup(list(drop_tags)):
+        tag.decompose()
+    root = (soup.body or soup) if body_only else soup
+    return root.get_text(separator='\n', strip=True)
+
 def clean_text_from_html(html: str, url: str = None) -> str:
     """Convert raw HTML into clean, boilerplate-free main content (markdown/text).
 
@@ -710,21 +2251,17 @@ def clean_text_from_html(html: str, url: str = None) -> str:
         try:
             doc = ReadabilityDocument(html)
             summary_html = doc.summary(html_partial=True)
-            soup = BeautifulSoup(summary_html, 'html.parser')
-            text = soup.get_text(separator='\n', strip=True)
+            text = _html_text(summary_html)
             if text and len(text.strip()) > 40:
                 return text.strip()[:MAX_CLEAN_TEXT_CHARS]
         except Exception as e:
             logger.debug(f"readability extract failed for {url}: {e}")
     # 3) Last-resort BeautifulSoup strip.
     try:
-        soup = BeautifulSoup(html, 'html.parser')
-        for tag in soup(["script", "style", "nav", "footer", "header", "noscript",
-                         "meta", "link", "svg", "form", "iframe"]):
-            tag.decompose()
-        body = soup.body or soup
-        text = body.get_text(separator='\n', strip=True)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        drop = ("script", "style", "nav", "footer", "header", "noscript",
+                "meta", "link", "svg", "form", "iframe")
+        text = _html_text(html, drop, body_only=True)
+        text = _BLANK_LINES_RE.sub('\n\n', text)
         return text[:MAX_CLEAN_TEXT_CHARS]
     except Exception as e:
         logger.error(f"All clean-text extraction failed for {url}: {e}")
@@ -732,149 +2269,475 @@ def clean_text_from_html(html: str, url: str = None) -> str:
 
 def fetch_url_content(url: str) -> str:
     """Fetches and extracts clean text content from a URL."""
-    headers = {'User-Agent': CRAWLER_USER_AGENT}
+    html = _cached_html(url)  # e.g. just crawled by simple_crawl_website
+    if html is not None:
+        return _html_text(html, ("script", "style"), body_only=True)[:MAX_CONTENT_LENGTH]
     try:
-        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-        response.raise_for_status()
-        if 'text/html' not in response.headers.get('Content-Type', '').lower():
-            logger.warning(f"URL {url} is not HTML content.")
-            return ""
-        response.encoding = response.apparent_encoding or 'utf-8'
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        body_text = soup.body.get_text(separator='\n', strip=True) if soup.body else ""
+        # Streamed and capped: only the first MAX_TEXT_FETCH_BYTES are downloaded, since the text
+        # is truncated to MAX_CONTENT_LENGTH anyway; non-HTML bodies are never read at all.
+        with HTTP_SESSION.get(url, timeout=REQUEST_TIMEOUT, allow_redirects=True, stream=True,
+                              headers=_revalidation_headers(url)) as response:
+            response.raise_for_status()
+            html = _not_modified_html(url, response)
+            if html is None:
+                if 'text/html' not in response.headers.get('Content-Type', '').lower():
+                    logger.warning(f"URL {url} is not HTML content.")
+                    return ""
+                html = _decode_body(_read_capped_body(response, MAX_TEXT_FETCH_BYTES), response)
+        body_text = _html_text(html, ("script", "style"), body_only=True)
         return body_text[:MAX_CONTENT_LENGTH]
     except requests.exceptions.RequestException as req_err:
         raise ConnectionError(f"Failed to fetch URL text content: {req_err}")
 
 
-def get_sitemap_urls_from_xml(xml_content: str) -> list[str]:
+# Sitemap/robots parsing invariants, built once at import.
+_ROBOTS_SITEMAP_RE = re.compile(r'^[ \t]*sitemap[ \t]*:[ \t]*(\S+)', re.IGNORECASE | re.MULTILINE)
+COMMON_SITEMAP_PATHS = ("/sitemap.xml", "/sitemap_index.xml")
+_SITEMAP_ENTRY_TAGS = frozenset(('url', 'sitemap'))
+_SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+# Sitemap-namespace or un-namespaced only: <image:loc>, <video:loc> etc. are not pages.
+_SITEMAP_LOC_TAGS = frozenset((_SITEMAP_NS + 'loc', 'loc'))
+_SITEMAP_ENTRY_ELEMENT_TAGS = frozenset(ns + tag for tag in _SITEMAP_ENTRY_TAGS for ns in (_SITEMAP_NS, ''))
+_SITEMAP_LXML_TAGS = tuple(_SITEMAP_LOC_TAGS | _SITEMAP_ENTRY_ELEMENT_TAGS)
+
+def iter_sitemap_locs(source):
+    """Stream <loc> values out of a sitemap or sitemap index (file-like source).
+
+    Parses incrementally and clears each finished <url>/<sitemap> entry, so memory stays
+    flat even for multi-megabyte sitemaps. Works with and without the sitemap namespace.
+    With lxml, tag filtering happens inside libxml2 and only loc/url/sitemap events reach Python.
+    """
+    if LXML_AVAILABLE:
+        # No entity expansion or network access: sitemaps are untrusted input.
+        for _, elem in lxml_etree.iterparse(source, events=('end',), tag=_SITEMAP_LXML_TAGS,
+                                            resolve_entities=False, no_network=True, huge_tree=True):
+            if elem.tag in _SITEMAP_LOC_TAGS:
+                if elem.text and elem.text.strip():
+                    yield elem.text.strip()
+                continue
+            elem.clear()
+            parent = elem.getparent()
+            while parent is not None and elem.getprevious() is not None:
+                del parent[0]
+        return
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = elem
+            continue
+        if event != 'end':
+            continue
+        if elem.tag in _SITEMAP_LOC_TAGS:
+            if elem.text and elem.text.strip():
+                yield elem.text.strip()
+        elif elem.tag in _SITEMAP_ENTRY_ELEMENT_TAGS:
+            root.clear()
+
+_SITEMAP_PARSE_ERRORS = (ET.ParseError, lxml_etree.XMLSyntaxError) if LXML_AVAILABLE else (ET.ParseError,)
+
+def get_sitemap_urls_from_xml(xml_content) -> list[str]:
+    """<loc> values of a sitemap given as str, bytes or a file-like stream (kept up to a parse error)."""
     urls = []
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    source = io.BytesIO(xml_content) if isinstance(xml_content, bytes) else xml_content
     try:
-        root = ET.fromstring(xml_content)
-        namespaces = {'s': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-        for url_element in root.findall('.//s:loc', namespaces) or root.findall('.//loc'):
-            if url_element.text: urls.append(url_element.text.strip())
-        for sitemap_element in root.findall('.//s:sitemap/s:loc', namespaces) or root.findall('.//sitemap/loc'):
-            if sitemap_element.text: urls.append(sitemap_element.text.strip())
-    except ET.ParseError as e: logger.error(f"Failed to parse sitemap XML: {e}")
+        urls.extend(iter_sitemap_locs(source))
+    except _SITEMAP_PARSE_ERRORS as e: logger.error(f"Failed to parse sitemap XML: {e}")
     return urls
 
+_GZIP_MAGIC = b'\x1f\x8b'
+_SITEMAP_SUFFIXES = ('.xml', '.xml.gz')        # index entries with these endings are child sitemaps
+
+def _sitemap_stream(response):
+    """Decoded body stream of a sitemap response, gunzipped on the fly for .xml.gz sitemaps.
+
+    Large sites usually serve sitemap.xml.gz as a gzip file (not Content-Encoding), which
+    urllib3 leaves compressed; the magic bytes are sniffed so it is never buffered whole.
+    """
+    response.raw.decode_content = True
+    response.raw.auto_close = False  # let io.BufferedReader see EOF instead of a closed file
+    stream = io.BufferedReader(response.raw)
+    if stream.peek(2)[:2] == _GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+# Sitemap discovery results per host (robots.txt + every sitemap file fetched and parsed).
+# Re-running a job on the same host within the TTL skips those downloads entirely; with
+# JOB_STORE=redis the results are also shared through Redis, so they survive restarts and
+# are reused by every worker.
+SITEMAP_CACHE_TTL_SECONDS = int(os.getenv("SITEMAP_CACHE_TTL_SECONDS", 24 * 3600))
+_sitemap_cache = TTLCache(max_entries=1024, ttl_seconds=SITEMAP_CACHE_TTL_SECONDS)
+
 def find_sitemap_urls(base_url: str) -> list[str]:
+    """Page URLs listed in the site's sitemaps (robots.txt-declared and common locations), cached per host."""
+    key = _url_netloc(base_url).lower()
+    cached = _sitemap_cache.get(key)
+    if cached is None and isinstance(job_store, RedisJobStore):
+        cached = job_store.get_cached(f"sitemap:{key}")
+        if cached is not None:
+            cached = tuple(cached)
+            _sitemap_cache.set(key, cached)
+    if cached is not None:
+        logger.info(f"Using cached sitemap URLs for {base_url} ({len(cached)} URLs).")
+        return list(cached)
+    urls = _find_sitemap_urls_uncached(base_url)
+    if urls:  # don't pin an empty result from a transient failure
+        _sitemap_cache.set(key, tuple(urls))
+        if isinstance(job_store, RedisJobStore):
+            job_store.set_cached(f"sitemap:{key}", urls, SITEMAP_CACHE_TTL_SECONDS)
+    return urls
+
+def _find_sitemap_urls_uncached(base_url: str) -> list[str]:
     logger.info(f"Attempting to find sitemaps for {base_url}")
     sitemap_paths_to_check = collections.deque()
     final_page_urls = set()
-    processed_sitemap_urls = set()
-    try:
-        robots_url = urljoin(base_url, "/robots.txt")
-        response = requests.get(robots_url, headers={'User-Agent': CRAWLER_USER_AGENT}, timeout=10)
-        if response.status_code == 200:
-            for line in response.text.splitlines():
-                if line.strip().lower().startswith("sitemap:"):
-                    sitemap_url = line.split(":", 1)[1].strip()
-                    if sitemap_url not in processed_sitemap_urls:
-                        sitemap_paths_to_check.append(sitemap_url)
-                        processed_sitemap_urls.add(sitemap_url)
-    except requests.exceptions.RequestException: pass
-    
-    common_sitemaps = ["/sitemap.xml", "/sitemap_index.xml"]
-    for common_path in common_sitemaps:
-        sitemap_url = urljoin(base_url, common_path)
-        if sitemap_url not in processed_sitemap_urls:
-            sitemap_paths_to_check.append(sitemap_url)
-            processed_sitemap_urls.add(sitemap_url)
+    processed_sitemap_digests = set()
 
-    while sitemap_paths_to_check:
-        sitemap_url = sitemap_paths_to_check.popleft()
+    def _robots_sitemaps():
         try:
-            response = requests.get(sitemap_url, headers={'User-Agent': CRAWLER_USER_AGENT}, timeout=15)
+            response = HTTP_SESSION.get(urljoin(base_url, "/robots.txt"), timeout=10)
             if response.status_code == 200:
-                content_type = response.headers.get('Content-Type', '').lower()
-                if 'xml' in content_type:
-                    extracted_urls = get_sitemap_urls_from_xml(response.text)
-                    for ext_url in extracted_urls:
-                        if ext_url.endswith('.xml') and ext_url not in processed_sitemap_urls:
-                            sitemap_paths_to_check.append(ext_url)
-                            processed_sitemap_urls.add(ext_url)
-                        elif not ext_url.endswith('.xml'):
-                            final_page_urls.add(ext_url)
+                return _ROBOTS_SITEMAP_RE.findall(response.text)
         except requests.exceptions.RequestException: pass
+        return []
+
+    for common_path in COMMON_SITEMAP_PATHS:
+        sitemap_url = urljoin(base_url, common_path)
+        digest = _url_digest(sitemap_url)
+        if digest not in processed_sitemap_digests:
+            sitemap_paths_to_check.append(sitemap_url)
+            processed_sitemap_digests.add(digest)
+
+    def _fetch_sitemap(sitemap_url):
+        try:
+            with HTTP_SESSION.get(sitemap_url, timeout=15, stream=True) as response:
+                if response.status_code == 200:
+                    content_type = response.headers.get('Content-Type', '').lower()
+                    if 'xml' in content_type or 'gzip' in content_type or sitemap_url.endswith('.gz'):
+                        # Parse straight off the socket instead of buffering response.text.
+                        return get_sitemap_urls_from_xml(_sitemap_stream(response))
+        # OSError/EOFError: a corrupt or truncated .gz sitemap
+        except (requests.exceptions.RequestException, Urllib3HTTPError, OSError, EOFError): pass
+        return []
+
+    # Sitemap indexes fan out into many child sitemaps; fetch each level concurrently. robots.txt
+    # is read alongside the first level (the common paths) and its sitemaps join the next one.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        robots_future = executor.submit(_robots_sitemaps)
+        while sitemap_paths_to_check or robots_future:
+            batch = list(sitemap_paths_to_check)
+            sitemap_paths_to_check.clear()
+            results = executor.map(_fetch_sitemap, batch)
+            if robots_future:
+                for sitemap_url in robots_future.result():
+                    digest = _url_digest(sitemap_url)
+                    if digest not in processed_sitemap_digests:
+                        sitemap_paths_to_check.append(sitemap_url)
+                        processed_sitemap_digests.add(digest)
+                robots_future = None
+            for extracted_urls in results:
+                for ext_url in extracted_urls:
+                    if not ext_url.endswith(_SITEMAP_SUFFIXES):
+                        final_page_urls.add(ext_url)
+                        continue
+                    digest = _url_digest(ext_url)
+                    if digest not in processed_sitemap_digests:
+                        sitemap_paths_to_check.append(ext_url)
+                        processed_sitemap_digests.add(digest)
     logger.info(f"Found {len(final_page_urls)} unique page URLs from sitemaps.")
     return list(final_page_urls)
 
 
+_DEFAULT_PORT_SUFFIXES = {"http": ":80", "https": ":443"}
+
+def canonicalize_url(url: str) -> str:
+    """Dedup key for a URL: lower-case scheme/host, no default port, fragment or trailing slash.
+
+    Only used for comparisons; the original URL is what gets fetched.
+    """
+    parts = urlsplit(url)
+    scheme, netloc = parts.scheme.lower(), parts.netloc.lower()
+    default_port = _DEFAULT_PORT_SUFFIXES.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/') or '/', parts.query, ''))
+
+def _url_digest(url: str) -> int:
+    """64-bit integer fingerprint of a URL for crawl bookkeeping sets.
+
+    Small ints hash and compare faster than long URL strings and take a fraction of the
+    memory; collisions are negligible at crawl scale (~1e-9 for 100k URLs).
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+@functools.lru_cache(maxsize=4096)
+def _url_netloc(url: str) -> str:
+    """urlsplit(url).netloc, memoized: crawl loops test the same links' host over and over."""
+    return urlsplit(url).netloc
+
+def _strip_fragment(url: str) -> str:
+    """URL without its #fragment (a plain string split; no ParseResult round-trip)."""
+    return url.partition('#')[0]
+
+_HREF_XPATH = lxml_etree.XPath('//a/@href') if LXML_AVAILABLE else None
+
+def _page_hrefs(html: str, url: str) -> list:
+    """Raw href values of every <a> in an HTML page.
+
+    With lxml, a single XPath query returns the attribute strings straight from the C tree.
+    """
+    if LXML_AVAILABLE:
+        try:
+            return [str(h) for h in _HREF_XPATH(_lxml_document(html, fragment=True))]
+        except (lxml_etree.ParserError, ValueError) as e:
+            logger.debug(f"lxml link extraction failed for {url}, falling back to BeautifulSoup: {e}")
+    soup = BeautifulSoup(html, HTML_PARSER)
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
 def simple_crawl_website(base_url, max_pages=10):
+    """Concurrent same-domain crawl using up to CRAWL_WORKERS fetch threads.
+
+    The main thread owns the frontier and seen set; workers only fetch and parse,
+    so no locking is needed. Never submits more pages than the remaining budget.
+    URLs are marked seen when enqueued (as digests), so the frontier holds no duplicates.
+    Bodies are streamed: non-HTML links (PDFs, images, archives) are dropped after the headers,
+    and each crawled page goes into the HTML cache so later stages don't download it again.
+    """
     logger.info(f"Starting simple crawl for {base_url}, max_pages={max_pages}")
-    urls_to_visit = {base_url}
-    visited_urls = set()
+    urls_to_visit = collections.deque([base_url])
+    seen_digests = {_url_digest(base_url)}
     found_pages_details = []
     base_domain = urlparse(base_url).netloc
-    headers = {'User-Agent': CRAWLER_USER_AGENT}
-    while urls_to_visit and len(found_pages_details) < max_pages:
-        current_url = urls_to_visit.pop()
-        if current_url in visited_urls or urlparse(current_url).netloc != base_domain:
-            continue
-        visited_urls.add(current_url)
-        try:
-            response = requests.get(current_url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-            response.raise_for_status()
-            if response.status_code == 200 and 'text/html' in response.headers.get('Content-Type', '').lower():
-                 found_pages_details.append({'url': current_url, 'status': 'found'})
-                 logger.info(f"[Simple] Found page ({len(found_pages_details)}/{max_pages}): {current_url}")
-                 soup = BeautifulSoup(response.text, 'html.parser')
-                 for link in soup.find_all('a', href=True):
-                    absolute_url = urljoin(base_url, link['href'])
-                    absolute_url = urlparse(absolute_url)._replace(fragment="").geturl()
-                    if urlparse(absolute_url).netloc == base_domain and absolute_url not in visited_urls:
-                         urls_to_visit.add(absolute_url)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[Simple] Error crawling URL {current_url}: {e}")
+
+    def _fetch_and_parse(current_url):
+        """Fetch one page; return its same-domain links, or None if it is not HTML."""
+        html = _cached_html(current_url)
+        if html is None:
+            with HTTP_SESSION.get(current_url, timeout=REQUEST_TIMEOUT, allow_redirects=True,
+                                  stream=True, headers=_revalidation_headers(current_url)) as response:
+                response.raise_for_status()
+                html = _not_modified_html(current_url, response)
+                if html is None:
+                    if response.status_code != 200 or 'text/html' not in response.headers.get('Content-Type', '').lower():
+                        return None
+                    html = _decode_body(_read_capped_body(response, MAX_HTML_FETCH_BYTES), response)
+                    html = html[:MAX_HTML_CONTENT_LENGTH]
+                    _cache_html(current_url, html, response.headers)
+        links = []
+        for href in _page_hrefs(html, current_url):
+            absolute_url = _strip_fragment(urljoin(current_url, href))
+            if _url_netloc(absolute_url) == base_domain:
+                links.append(absolute_url)
+        return links
+
+    workers = max(1, min(CRAWL_WORKERS, max_pages))
+    in_flight = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(found_pages_details) < max_pages and (urls_to_visit or in_flight):
+            while (urls_to_visit and len(in_flight) < workers
+                   and len(found_pages_details) + len(in_flight) < max_pages):
+                current_url = urls_to_visit.popleft()  # only same-domain URLs are enqueued
+                in_flight[executor.submit(_fetch_and_parse, current_url)] = current_url
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                current_url = in_flight.pop(fut)
+                try:
+                    links = fut.result()
+                except requests.exceptions.RequestException as e:
+                    logger.error(f"[Simple] Error crawling URL {current_url}: {e}")
+                    continue
+                if links is None or len(found_pages_details) >= max_pages:
+                    continue
+                found_pages_details.append({'url': current_url, 'status': 'found'})
+                logger.info(f"[Simple] Found page ({len(found_pages_details)}/{max_pages}): {current_url}")
+                for link_url in links:
+                    digest = _url_digest(link_url)
+                    if digest not in seen_digests:
+                        seen_digests.add(digest)
+                        urls_to_visit.append(link_url)
     return found_pages_details
 
 
+@functools.lru_cache(maxsize=1)
+def _import_selenium():
+    """Import the Selenium names used below into module globals, once, on first browser use."""
+    global webdriver, ChromeService, By, ChromeOptions, WebDriverWait, EC
+    global TimeoutException, WebDriverException, NoSuchElementException, ChromeDriverManager
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
+    from webdriver_manager.chrome import ChromeDriverManager
+
+@functools.lru_cache(maxsize=1)
+def _chromedriver_path() -> str:
+    """Resolve (and download if needed) chromedriver once; install() hits disk and network on every call."""
+    _import_selenium()
+    return ChromeDriverManager().install()
+
+def _new_chrome_driver(window_size: str = None, load_images: bool = True):
+    """Start a headless Chrome configured like every other Selenium path in this service."""
+    _import_selenium()
+    chrome_options = ChromeOptions()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    if not load_images:
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    if window_size:
+        chrome_options.add_argument(f"--window-size={window_size}")
+    chrome_options.add_argument(f"user-agent={CRAWLER_USER_AGENT}")
+    service = ChromeService(_chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver.set_page_load_timeout(SELENIUM_PAGE_LOAD_TIMEOUT)
+    return driver
+
+# Chrome + chromedriver startup costs seconds, so crawl/scrape drivers are kept warm between
+# jobs. Pooled drivers never load images (only DOM and links are read from them); screenshots
+# use their own driver.
+_driver_pool = queue.LifoQueue(maxsize=SELENIUM_DRIVER_POOL_SIZE)
+
+@contextlib.contextmanager
+def pooled_chrome_driver():
+    """Borrow a warm headless driver (or start one); it is reset and returned to the pool after use."""
+    try:
+        driver = _driver_pool.get_nowait()
+    except queue.Empty:
+        driver = _new_chrome_driver(load_images=False)
+    try:
+        yield driver
+    finally:
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+            _driver_pool.put_nowait(driver)
+        except Exception:  # driver died or the pool is full: don't keep it
+            with contextlib.suppress(Exception):
+                driver.quit()
+
+def prewarm_driver_pool():
+    """Start SELENIUM_DRIVER_POOL_SIZE drivers so the first Selenium job skips Chrome startup."""
+    if not SELENIUM_AVAILABLE:
+        return
+    started = 0
+    while started < SELENIUM_DRIVER_POOL_SIZE:
+        try:
+            driver = _new_chrome_driver(load_images=False)
+        except Exception as e:
+            logger.warning(f"Could not prewarm Chrome driver pool: {e}")
+            return
+        try:
+            _driver_pool.put_nowait(driver)
+        except queue.Full:
+            driver.quit()
+            return
+        started += 1
+    logger.info(f"Prewarmed {started} Chrome driver(s).")
+
+@atexit.register
+def _close_pooled_drivers():
+    while True:
+        try:
+            driver = _driver_pool.get_nowait()
+        except queue.Empty:
+            return
+        with contextlib.suppress(Exception):
+            driver.quit()
+
+def _wait_for_page_ready(driver):
+    """Wait until the document has loaded and its DOM stops growing.
+
+    Replaces a fixed render sleep: static pages return as soon as readyState is complete,
+    client-rendered pages get up to SELENIUM_RENDER_WAIT_SECONDS to settle.
+    """
+    wait = WebDriverWait(driver, SELENIUM_PAGE_LOAD_TIMEOUT)
+    wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+    wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
+    deadline = time.monotonic() + SELENIUM_RENDER_WAIT_SECONDS
+    last_size = -1
+    while time.monotonic() < deadline:
+        size = driver.execute_script("return document.body ? document.body.innerHTML.length : 0")
+        if size == last_size:
+            break
+        last_size = size
+        time.sleep(0.25)
+
+# Anchor .href is already absolute (resolved by the browser); the Set drops duplicates before they cross IPC.
+_COLLECT_HREFS_JS = "return Array.from(new Set(Array.from(document.querySelectorAll('a[href]'), a => a.href)));"
+
+
 def selenium_crawl_website(base_url, max_pages=10):
+    """Concurrent same-domain crawl in headless Chrome, SELENIUM_CRAWL_WORKERS pages at a time.
+
+    Same scheme as simple_crawl_website: the main thread owns the BFS frontier and the seen
+    set (URL digests, marked when enqueued); each worker thread borrows one pooled driver on
+    its first page and keeps it for the rest of the crawl.
+    """
     if not SELENIUM_AVAILABLE: raise RuntimeError("Selenium is not available.")
+    _import_selenium()  # the except clauses below name Selenium exceptions
     logger.info(f"Starting Selenium crawl for {base_url}, max_pages={max_pages}")
-    urls_to_visit = {base_url}
-    visited_urls = set()
+    urls_to_visit = collections.deque([base_url])
+    seen_digests = {_url_digest(base_url)}
     found_pages_details = []
     base_domain = urlparse(base_url).netloc
-    driver = None
-    try:
-        chrome_options = ChromeOptions()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument(f"user-agent={CRAWLER_USER_AGENT}")
-        service = ChromeService(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        driver.set_page_load_timeout(SELENIUM_PAGE_LOAD_TIMEOUT)
-        while urls_to_visit and len(found_pages_details) < max_pages:
-            current_url = urls_to_visit.pop()
-            if current_url in visited_urls or urlparse(current_url).netloc != base_domain:
-                continue
-            visited_urls.add(current_url)
-            try:
-                driver.get(current_url)
-                WebDriverWait(driver, SELENIUM_PAGE_LOAD_TIMEOUT).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                time.sleep(SELENIUM_RENDER_WAIT_SECONDS)
-                page_title = driver.title.strip() or "N/A"
-                page_html = driver.page_source
+    local = threading.local()
+    drivers_lock = threading.Lock()
+
+    def _render(current_url, drivers):
+        driver = getattr(local, "driver", None)
+        if driver is None:
+            with drivers_lock:
+                driver = local.driver = drivers.enter_context(pooled_chrome_driver())
+        try:
+            driver.get(current_url)
+            _wait_for_page_ready(driver)
+            # One script call returns every resolved href; per-element get_attribute() is an IPC round-trip each.
+            return driver.title.strip() or "N/A", driver.page_source, driver.execute_script(_COLLECT_HREFS_JS) or []
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            local.driver = None  # may have crashed: borrow a fresh one for this thread's next page
+            raise
+
+    workers = max(1, min(SELENIUM_CRAWL_WORKERS, max_pages))
+    in_flight = {}
+    # Drivers go back to the pool (ExitStack) only after the executor has shut down.
+    with contextlib.ExitStack() as drivers, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(found_pages_details) < max_pages and (urls_to_visit or in_flight):
+            while (urls_to_visit and len(in_flight) < workers
+                   and len(found_pages_details) + len(in_flight) < max_pages):
+                current_url = urls_to_visit.popleft()  # only same-domain URLs are enqueued
+                in_flight[executor.submit(_render, current_url, drivers)] = current_url
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                current_url = in_flight.pop(fut)
+                try:
+                    page_title, page_html, hrefs = fut.result()
+                except (TimeoutException, WebDriverException) as e:
+                    logger.error(f"[Selenium] Error for URL {current_url}: {e}")
+                    continue
+                if len(found_pages_details) >= max_pages:
+                    continue
                 found_pages_details.append({'url': current_url, 'title': page_title, 'status': 'found_by_selenium', 'html_source': page_html})
                 logger.info(f"[Selenium] Found page ({len(found_pages_details)}/{max_pages}): {current_url}")
-                links = driver.find_elements(By.TAG_NAME, 'a')
-                for link in links:
-                    href = link.get_attribute('href')
-                    if href:
-                        absolute_url = urljoin(current_url, href)
-                        absolute_url = urlparse(absolute_url)._replace(fragment="").geturl()
-                        if urlparse(absolute_url).netloc == base_domain and absolute_url not in visited_urls:
-                            urls_to_visit.add(absolute_url)
-            except (TimeoutException, WebDriverException) as e:
-                logger.error(f"[Selenium] Error for URL {current_url}: {e}")
-    finally:
-        if driver: driver.quit()
+                for href in hrefs:
+                    absolute_url = _strip_fragment(href)
+                    if _url_netloc(absolute_url) != base_domain:
+                        continue
+                    digest = _url_digest(absolute_url)
+                    if digest not in seen_digests:
+                        seen_digests.add(digest)
+                        urls_to_visit.append(absolute_url)
     return found_pages_details
 
 def capture_full_page_screenshot(url: str) -> str | None:
@@ -885,21 +2748,11 @@ def capture_full_page_screenshot(url: str) -> str | None:
     
     driver = None
     try:
-        chrome_options = ChromeOptions()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument(f"user-agent={CRAWLER_USER_AGENT}")
-        
-        service = ChromeService(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        driver.set_page_load_timeout(SELENIUM_PAGE_LOAD_TIMEOUT)
+        driver = _new_chrome_driver(window_size="1920,1080")
         
         # Navigate to the URL
         driver.get(url)
-        WebDriverWait(driver, SELENIUM_PAGE_LOAD_TIMEOUT).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(SELENIUM_RENDER_WAIT_SECONDS)
+        _wait_for_page_ready(driver)
         
         # Get the full page height and set window size
         total_height = driver.execute_script("return document.body.scrollHeight")
@@ -926,7 +2779,7 @@ def scrape_single_page(url: str, use_selenium: bool = False, include_screenshot:
     """Synchronously scrape and extract structured knowledge from a single URL."""
     # Validate URL accessibility
     try:
-        head_resp = requests.head(url, headers={'User-Agent': CRAWLER_USER_AGENT}, timeout=10, allow_redirects=True)
+        head_resp = HTTP_SESSION.head(url, timeout=10, allow_redirects=True)
         if head_resp.status_code >= 400:
             raise ValueError(f"URL returned HTTP {head_resp.status_code}")
     except requests.exceptions.RequestException as e:
@@ -936,23 +2789,10 @@ def scrape_single_page(url: str, use_selenium: bool = False, include_screenshot:
     if use_selenium:
         if not SELENIUM_AVAILABLE:
             raise RuntimeError("Selenium is not available on this server.")
-        driver = None
-        try:
-            chrome_options = ChromeOptions()
-            chrome_options.add_argument("--headless")
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument(f"user-agent={CRAWLER_USER_AGENT}")
-            service = ChromeService(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            driver.set_page_load_timeout(SELENIUM_PAGE_LOAD_TIMEOUT)
+        with pooled_chrome_driver() as driver:
             driver.get(url)
-            WebDriverWait(driver, SELENIUM_PAGE_LOAD_TIMEOUT).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-            time.sleep(SELENIUM_RENDER_WAIT_SECONDS)
+            _wait_for_page_ready(driver)
             html = driver.page_source
-        finally:
-            if driver:
-                driver.quit()
     else:
         html = fetch_url_html_content(url)
 
@@ -968,13 +2808,13 @@ def scrape_single_page(url: str, use_selenium: bool = False, include_screenshot:
 
     # Detect language
     html_snippet = html[:MAX_HTML_SNIPPET_FOR_LANG_DETECT]
-    lang, _, _ = detect_language_from_html_with_openai(html_snippet, url)
+    lang, *_ = detect_language_from_html_with_openai(html_snippet, url)
 
     # Get page title
     title = get_page_title_from_html(html)
 
     # Extract knowledge
-    result, p_tokens, c_tokens = extract_knowledge_from_page_with_openai(html, url, title, lang, screenshot_b64)
+    result, p_tokens, c_tokens, _ = extract_knowledge_from_page_with_openai(html, url, title, lang, screenshot_b64)
 
     # Compute cost
     input_cost = (p_tokens / 1_000_000) * PRICE_PER_INPUT_TOKEN_MILLION
@@ -998,42 +2838,64 @@ def scrape_single_page(url: str, use_selenium: bool = False, include_screenshot:
 # --- OpenAI Helper Functions (Feature-Specific) ---
 
 # For Company Analysis
+# Fixed instructions go in the developer message and the per-request data last, so repeated
+# calls share a byte-identical prefix that OpenAI's automatic prompt cache can reuse.
+PAGE_ANALYSIS_INSTRUCTIONS = ("Analyze ONLY the text content of the web page the user provides. "
+                              "Describe the page's purpose. Be concise (1-2 sentences).")
+COMPANY_SUMMARY_INSTRUCTIONS = ("Synthesize the page descriptions the user provides into a comprehensive overview "
+                                "of the company. Describe its main purpose, offerings, and mission.")
+
 def analyze_single_page_with_openai(page_content: str, url: str) -> str:
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
-    prompt = f"Analyze ONLY the following text content from '{url}'. Describe the page's purpose. Be concise (1-2 sentences). Content: ```{page_content}```"
-    completion = openai_client.chat.completions.create(model=OPENAI_MODEL, messages=[{"role": "user", "content": prompt}], max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE)
+    messages = [
+        {"role": "developer", "content": PAGE_ANALYSIS_INSTRUCTIONS},
+        {"role": "user", "content": f"URL: {url}\nContent: ```{page_content}```"},
+    ]
+    completion = create_chat_completion(model=OPENAI_MODEL, messages=messages, max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE)
     return completion.choices[0].message.content.strip()
 
 def summarize_company_with_openai(page_summaries: list[dict], root_url: str) -> str:
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
     combined_text = f"Based on analyses of pages from {root_url}:\n\n" + "\n".join([f"- URL: {s['url']}\n  Summary: {s['description']}" for s in page_summaries])
-    prompt = f"Synthesize these descriptions into a comprehensive overview of the company at {root_url}. Describe its main purpose, offerings, and mission. Summaries:\n{combined_text}"
-    completion = openai_client.chat.completions.create(model=OPENAI_MODEL, messages=[{"role": "user", "content": prompt}], max_completion_tokens=MAX_RESPONSE_TOKENS_SUMMARY)
+    messages = [
+        {"role": "developer", "content": COMPANY_SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Company website: {root_url}\nSummaries:\n{combined_text}"},
+    ]
+    completion = create_chat_completion(model=OPENAI_MODEL, messages=messages, max_completion_tokens=MAX_RESPONSE_TOKENS_SUMMARY)
     return completion.choices[0].message.content.strip()
 
 # For Prospect Qualification
+PROSPECT_QUALIFICATION_INSTRUCTIONS = """You are a B2B sales analyst. Determine if a company is a good potential customer based on their website.
+The user provides their business profile, their ideal customer personas, and the prospect's website content.
+**Your Task:** Based *only* on the page content, analyze the prospect.
+1. Do they align with the user's business and personas?
+2. Provide a confidence score from 0 to 100.
+3. State the reasons for your assessment.
+**Output Format:** Respond with ONLY a valid JSON object:
+{
+  "is_potential_customer": boolean, "confidence_score": integer,
+  "reasoning_for": "Why this company IS a good fit.",
+  "reasoning_against": "Why this company might NOT be a good fit."
+}"""
+
 def qualify_prospect_with_openai(page_content: str, prospect_url: str, user_profile: str, user_personas: list[str]):
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
     personas_str = "\n".join([f"- {p}" for p in user_personas])
-    prompt = f"""You are a B2B sales analyst. Determine if a company is a good potential customer based on their website.
-    **My Business Profile:** {user_profile}
-    **My Ideal Customer Personas:** {personas_str}
-    **Prospect's Website to Analyze:** URL: {prospect_url}, Page Content: ```{page_content}```
-    **Your Task:** Based *only* on the page content, analyze the prospect.
-    1. Do they align with my business and personas?
-    2. Provide a confidence score from 0 to 100.
-    3. State the reasons for your assessment.
-    **Output Format:** Respond with ONLY a valid JSON object:
-    {{
-      "is_potential_customer": boolean, "confidence_score": integer,
-      "reasoning_for": "Why this company IS a good fit.",
-      "reasoning_against": "Why this company might NOT be a good fit."
-    }}"""
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL, messages=[{"role": "user", "content": prompt}],
+    # Task + output format are fixed and the profile/personas repeat for every prospect in a
+    # job, so only the prospect URL and page content vary at the end of the prompt.
+    messages = [
+        {"role": "developer", "content": PROSPECT_QUALIFICATION_INSTRUCTIONS},
+        {"role": "user", "content": (
+            f"**My Business Profile:** {user_profile}\n"
+            f"**My Ideal Customer Personas:**\n{personas_str}\n\n"
+            f"**Prospect's Website to Analyze:** URL: {prospect_url}, Page Content: ```{page_content}```"
+        )},
+    ]
+    completion = create_chat_completion(
+        model=OPENAI_MODEL, messages=messages,
         max_completion_tokens=MAX_RESPONSE_TOKENS_PROSPECT, response_format={"type": "json_object"}
     )
-    result_json = json.loads(completion.choices[0].message.content)
+    result_json = json_loads(completion.choices[0].message.content)
     return result_json, completion.usage
 
 # For Knowledge Base Generation
@@ -1074,12 +2936,23 @@ def detect_language_deterministic(text: str, threshold: float = 0.15):
     return None
 
 
-def _llm_detect_language(text: str, url: str) -> tuple[str, int, int]:
+_HTML_LANG_RE = re.compile(r'<html\b[^>]*?\blang\s*=\s*["\']?\s*([A-Za-z]{2})(?![A-Za-z])', re.IGNORECASE)
+
+
+def language_from_html_lang(html: str):
+    """Primary subtag of the <html lang="..."> attribute ('fa-IR' -> 'fa'), or None."""
+    if not html:
+        return None
+    match = _HTML_LANG_RE.search(html[:MAX_HTML_SNIPPET_FOR_LANG_DETECT])
+    return match.group(1).lower() if match else None
+
+
+def _llm_detect_language(text: str, url: str) -> tuple[str, int, int, int]:
     """LLM language identification from clean visible text. Returns (code, p, c)."""
     if not openai_client:
         raise ConnectionError("OpenAI client not initialized.")
     if not text or not text.strip():
-        return DEFAULT_TARGET_LANGUAGE, 0, 0
+        return DEFAULT_TARGET_LANGUAGE, 0, 0, 0
     messages = [
         {"role": "developer", "content": (
             "You are a language identification tool. Your ONLY output is a single 2-letter "
@@ -1087,17 +2960,17 @@ def _llm_detect_language(text: str, url: str) -> tuple[str, int, int]:
         )},
         {"role": "user", "content": f"Identify the primary language of this text:\n\n{text}"},
     ]
-    p_tokens = count_tokens(text)
-    completion = openai_client.chat.completions.create(
+    completion = create_chat_completion(
         model=OPENAI_MODEL_CHEAP, messages=messages, max_completion_tokens=MAX_RESPONSE_TOKENS_LANG_DETECT)
     lang = (completion.choices[0].message.content or "").strip().lower()
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, text)
+    cached_tokens = _cached_prompt_tokens(completion)
     if len(lang) == 2 and lang.isalpha():
-        return lang, p_tokens, c_tokens
-    return DEFAULT_TARGET_LANGUAGE, p_tokens, c_tokens
+        return lang, p_tokens, c_tokens, cached_tokens
+    return DEFAULT_TARGET_LANGUAGE, p_tokens, c_tokens, cached_tokens
 
 
-def detect_language_from_html_with_openai(html_snippet: str, url: str) -> tuple[str, int, int]:
+def detect_language_from_html_with_openai(html_snippet: str, url: str) -> tuple[str, int, int, int]:
     """Detect language from a page's CLEAN visible text (deterministic first, LLM fallback).
 
     Signature-compatible with the previous version (used by /api/scrape-page). The key fix:
@@ -1105,11 +2978,11 @@ def detect_language_from_html_with_openai(html_snippet: str, url: str) -> tuple[
     """
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
     if not html_snippet or not html_snippet.strip():
-        return DEFAULT_TARGET_LANGUAGE, 0, 0
+        return DEFAULT_TARGET_LANGUAGE, 0, 0, 0
     clean = clean_text_from_html(html_snippet, url) or html_snippet
-    det = detect_language_deterministic(clean)
+    det = detect_language_deterministic(clean) or language_from_html_lang(html_snippet)
     if det:
-        return det, 0, 0
+        return det, 0, 0, 0
     return _llm_detect_language(clean[:6000], url)
 
 
@@ -1118,39 +2991,143 @@ def detect_site_language(main_page_html: str, base_url: str, candidate_pages: li
     """Robustly determine the site's primary language from SOURCE content.
 
     Deterministic script detection first (reliable for Persian/Arabic and immune to slow or
-    head-heavy homepages), then LLM on clean visible text, falling back across a few candidate
-    pages before defaulting. Prevents silently defaulting Farsi sites to English.
+    head-heavy homepages), then the page's <html lang> attribute, then LLM on clean visible
+    text, falling back across a few candidate pages before defaulting. Prevents silently
+    defaulting Farsi sites to English.
     """
-    if main_page_html:
-        clean = clean_text_from_html(main_page_html, base_url)
+    def _page_language(html, url):
+        clean = clean_text_from_html(html, url)
         det = detect_language_deterministic(clean)
         if det:
             return det
+        # Script detection ruled out Arabic script, so a declared lang is trustworthy here and
+        # saves the LLM round-trip on the common case.
+        declared = language_from_html_lang(html)
+        if declared:
+            return declared
         if clean and clean.strip():
-            lang, p, c = _llm_detect_language(clean[:6000], base_url)
-            cost.add(OPENAI_MODEL_CHEAP, p, c)
-            if lang and lang != DEFAULT_TARGET_LANGUAGE:
-                return lang
+            lang, p, c, cached = _llm_detect_language(clean[:6000], url)
+            cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
+            return lang
+        return None
 
-    for pg in (candidate_pages or [])[:4]:
-        try:
-            html = fetch_url_html_content(pg.get("url"))
-        except Exception:
-            html = None
-        if not html:
-            continue
-        clean = clean_text_from_html(html, pg.get("url"))
-        det = detect_language_deterministic(clean)
-        if det:
-            return det
-        if clean and clean.strip():
-            lang, p, c = _llm_detect_language(clean[:6000], pg.get("url"))
-            cost.add(OPENAI_MODEL_CHEAP, p, c)
-            if lang and lang != DEFAULT_TARGET_LANGUAGE:
-                return lang
+    def _pages():
+        # Lazily yields (html, url): later candidates are only fetched if still undecided.
+        if main_page_html:
+            yield main_page_html, base_url
+        for pg in (candidate_pages or [])[:4]:
+            if "html" in pg:
+                yield pg["html"], pg.get("url")
+                continue
+            try:
+                yield fetch_url_html_content(pg.get("url")), pg.get("url")
+            except Exception:
+                continue
+
+    for html, url in _pages():
+        if not html:
+            continue
+        lang = _page_language(html, url)
+        if lang and lang != DEFAULT_TARGET_LANGUAGE:
+            return lang
 
     return DEFAULT_TARGET_LANGUAGE
 
+URL_SAMPLING_SEED = 42  # fixed so the same site yields the same URL sample across runs
+
+
+class ReservoirSample:
+    """Uniform random sample of at most `size` items from a stream, in one pass (Algorithm R).
+
+    Memory stays O(size) however many items are offered; `seen` counts all of them.
+    """
+
+    def __init__(self, size: int, rng: random.Random):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self._rng = rng
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            j = self._rng.randrange(self.seen)
+            if j < self.size:
+                self.items[j] = item
+
+    def take(self, n: int) -> list:
+        """Uniform sample of n of the kept items (all of them if n >= len)."""
+        if n >= len(self.items):
+            return list(self.items)
+        return self._rng.sample(self.items, max(0, n))
+
+
+def _substring_search(needles):
+    """search(text) -> match or None when any needle occurs in text.
+
+    One precompiled alternation scans each URL once in C instead of a Python-level
+    any(needle in text ...) loop over every needle.
+    """
+    return re.compile("|".join(re.escape(n) for n in needles)).search
+
+# URL-hint matchers for the sampling heuristics below (URLs are lower-cased before matching).
+_PRIORITY_URL_MATCH = _substring_search(('about', 'contact', 'home', 'index', 'service', 'policy', 'help', 'faq',
+                                         'support', 'terms', 'privacy'))
+_SAMPLING_SKIP_MATCH = _substring_search(('wp-content', 'assets', 'css', 'js', 'images', 'uploads', 'cache', 'admin',
+                                          'login', 'register', 'cart', 'checkout'))
+_CLUSTER_SKIP_MATCH = _substring_search(('wp-admin', 'wp-content', 'assets', 'css', 'js', 'images', 'cache', 'login',
+                                         'register', 'cart', 'checkout'))
+_KNOWLEDGE_URL_MATCH = _substring_search((
+    'how-to', 'guide', 'tutorial', 'tips', 'best-', 'what-is', 'vs-', 'comparison',
+    'install', 'setup', 'troubleshoot', 'solve', 'fix', 'error', 'problem',
+    'about', 'contact', 'policy', 'terms', 'faq', 'help', 'support', 'service',
+    'branch', 'location', 'درباره', 'تماس', 'راهنما', 'آموزش', 'نصب', 'حل'
+))
+_LISTING_URL_MATCH = _substring_search(('category', 'brand', 'tag', 'archive'))
+# Keyword fallbacks used when the LLM's URL categorisation can't be parsed.
+_FALLBACK_COMPANY_KEYWORDS = ('about', 'contact', 'home', 'index', 'درباره', 'تماس', 'قوانین', 'شرایط', 'privacy',
+                              'policy', 'terms', 'faq', 'help', 'support')
+_FALLBACK_SERVICE_KEYWORDS = ('service', 'support', 'help', 'خدمات', 'پشتیبانی', 'راهنما')
+_FALLBACK_SKIP_KEYWORDS = ('login', 'register', 'cart', 'checkout', 'wp-admin', 'wp-content', 'assets', 'css', 'js',
+                           'images')
+_FALLBACK_COMPANY_MATCH = _substring_search(_FALLBACK_COMPANY_KEYWORDS)
+_FALLBACK_SERVICE_MATCH = _substring_search(_FALLBACK_SERVICE_KEYWORDS)
+_FALLBACK_PRODUCT_EXCLUDE_MATCH = _substring_search(
+    _FALLBACK_SKIP_KEYWORDS + _FALLBACK_COMPANY_KEYWORDS + _FALLBACK_SERVICE_KEYWORDS)
+_FALLBACK_EDUCATIONAL_MATCH = _substring_search(('how-to', 'tutorial', 'guide', 'install', 'setup', 'آموزش', 'نصب'))
+_FALLBACK_CLUSTER_COMPANY_MATCH = _substring_search(('about', 'contact', 'policy', 'terms', 'branch', 'location',
+                                                     'درباره', 'تماس', 'قوانین', 'شرایط'))
+_FALLBACK_SUPPORT_MATCH = _substring_search(('help', 'support', 'faq', 'troubleshoot', 'solve', 'fix', 'error',
+                                             'problem', 'پشتیبانی', 'راهنما'))
+
+URL_CATEGORIZATION_INSTRUCTIONS = """Analyze ALL the URLs the user provides from one website and categorize them comprehensively.
+
+Categorize each URL into the following categories:
+1. company_info_pages: About us, contact, company information, policies, terms, privacy, FAQ, help, support
+2. product_pages: Individual product pages, product categories, brand pages, shopping pages
+3. service_pages: Services offered, features, capabilities, solutions
+4. technical_pages: Admin, login, cart, checkout, account, API, technical pages
+5. asset_pages: Images, CSS, JS, media files, static assets
+6. other_pages: Any other pages that don't fit above categories
+
+IMPORTANT:
+- Only include URLs that actually exist and are accessible
+- Do not guess or assume URL patterns
+- Be thorough and comprehensive
+- Consider the URL structure and patterns
+
+Respond with a JSON object containing arrays of URLs for each category:
+{
+    "company_info_pages": ["url1", "url2", ...],
+    "product_pages": ["url1", "url2", ...],
+    "service_pages": ["url1", "url2", ...],
+    "technical_pages": ["url1", "url2", ...],
+    "asset_pages": ["url1", "url2", ...],
+    "other_pages": ["url1", "url2", ...]
+}"""
+
 def analyze_all_urls_comprehensively(page_details: list[dict], root_url: str, lang: str) -> tuple[dict, int, int]:
     """Analyze ALL discovered URLs and categorize them comprehensively."""
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
@@ -1160,96 +3137,56 @@ def analyze_all_urls_comprehensively(page_details: list[dict], root_url: str, la
     
     # If too many URLs, sample them intelligently with priority for important pages
     if len(urls_list) > 300:  # Reduced limit for better reliability
-        import random
-        random.seed(42)
-        
-        # Prioritize important pages
+        # One pass: priority pages are kept in order (first 50), regular pages go through a
+        # reservoir sampler, so no full list of regular URLs is ever built. A private RNG keeps
+        # the sample reproducible without reseeding the global `random` module.
+        rng = random.Random(URL_SAMPLING_SEED)
         priority_urls = []
-        regular_urls = []
+        priority_count = 0
+        regular_urls = ReservoirSample(250, rng)
         
         for url in urls_list:
             url_lower = url.lower()
-            if any(keyword in url_lower for keyword in ['about', 'contact', 'home', 'index', 'service', 'policy', 'help', 'faq', 'support', 'terms', 'privacy']):
-                priority_urls.append(url)
-            elif not any(skip in url_lower for skip in ['wp-content', 'assets', 'css', 'js', 'images', 'uploads', 'cache', 'admin', 'login', 'register', 'cart', 'checkout']):
-                regular_urls.append(url)
+            if _PRIORITY_URL_MATCH(url_lower):
+                priority_count += 1
+                if len(priority_urls) < 50:
+                    priority_urls.append(url)
+            elif not _SAMPLING_SKIP_MATCH(url_lower):
+                regular_urls.add(url)
         
         # Take priority pages and sample regular pages
-        sampled_urls = priority_urls[:50]  # Take up to 50 priority pages
+        sampled_urls = priority_urls  # Take up to 50 priority pages
         remaining_slots = 250 - len(sampled_urls)  # Leave room for 250 total URLs
-        if remaining_slots > 0 and regular_urls:
-            sampled_urls.extend(random.sample(regular_urls, min(remaining_slots, len(regular_urls))))
+        if remaining_slots > 0:
+            sampled_urls.extend(regular_urls.take(remaining_slots))
         
         urls_list = sampled_urls
-        logger.info(f"Sampled {len(urls_list)} URLs for analysis ({len(priority_urls)} priority pages found)")
+        logger.info(f"Sampled {len(urls_list)} URLs for analysis ({priority_count} priority pages found)")
     
     urls_text = "\n".join([f"- {url}" for url in urls_list])
     
-    prompt = f"""Analyze ALL the following URLs from {root_url} and categorize them comprehensively.
-
-    Categorize each URL into the following categories:
-    1. company_info_pages: About us, contact, company information, policies, terms, privacy, FAQ, help, support
-    2. product_pages: Individual product pages, product categories, brand pages, shopping pages
-    3. service_pages: Services offered, features, capabilities, solutions
-    4. technical_pages: Admin, login, cart, checkout, account, API, technical pages
-    5. asset_pages: Images, CSS, JS, media files, static assets
-    6. other_pages: Any other pages that don't fit above categories
-
-    IMPORTANT: 
-    - Only include URLs that actually exist and are accessible
-    - Do not guess or assume URL patterns
-    - Be thorough and comprehensive
-    - Consider the URL structure and patterns
-
-    URLs to analyze:
-    {urls_text}
-
-    Respond with a JSON object containing arrays of URLs for each category:
-    {{
-        "company_info_pages": ["url1", "url2", ...],
-        "product_pages": ["url1", "url2", ...],
-        "service_pages": ["url1", "url2", ...],
-        "technical_pages": ["url1", "url2", ...],
-        "asset_pages": ["url1", "url2", ...],
-        "other_pages": ["url1", "url2", ...]
-    }}
-    """
-    
-    p_tokens = count_tokens(prompt)
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL, messages=[{"role": "user", "content": prompt}],
+    messages = [
+        {"role": "developer", "content": URL_CATEGORIZATION_INSTRUCTIONS},
+        {"role": "user", "content": f"Website: {root_url}\n\nURLs to analyze:\n{urls_text}"},
+    ]
+    completion = create_chat_completion(
+        model=OPENAI_MODEL, messages=messages,
         max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE_SELECTION * 2, response_format={"type": "json_object"}
     )
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, messages)
     
     try:
-        response_content = completion.choices[0].message.content.strip()
-        # Try to extract JSON from the response if it's wrapped in markdown or other text
-        if '```json' in response_content:
-            json_start = response_content.find('```json') + 7
-            json_end = response_content.find('```', json_start)
-            if json_end != -1:
-                response_content = response_content[json_start:json_end].strip()
-        elif '```' in response_content:
-            json_start = response_content.find('```') + 3
-            json_end = response_content.rfind('```')
-            if json_end != -1 and json_end > json_start:
-                response_content = response_content[json_start:json_end].strip()
-        
-        response_data = json.loads(response_content)
+        response_data = parse_json_response(completion.choices[0].message.content)
         return response_data, p_tokens, c_tokens
-    except (json.JSONDecodeError, TypeError) as e:
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error parsing AI response for URL analysis: {e}")
         logger.error(f"Raw response content: {completion.choices[0].message.content[:500]}...")
         
-        # Return a fallback structure with improved basic categorization
-        company_keywords = ['about', 'contact', 'home', 'index', 'درباره', 'تماس', 'قوانین', 'شرایط', 'privacy', 'policy', 'terms', 'faq', 'help', 'support']
-        service_keywords = ['service', 'support', 'help', 'خدمات', 'پشتیبانی', 'راهنما']
-        skip_keywords = ['login', 'register', 'cart', 'checkout', 'wp-admin', 'wp-content', 'assets', 'css', 'js', 'images']
-        
-        company_pages = [page['url'] for page in page_details[:20] if any(keyword in page['url'].lower() for keyword in company_keywords)]
-        service_pages = [page['url'] for page in page_details[:20] if any(keyword in page['url'].lower() for keyword in service_keywords)]
-        product_pages = [page['url'] for page in page_details[:15] if not any(keyword in page['url'].lower() for keyword in skip_keywords + company_keywords + service_keywords)]
+        # Return a fallback structure with improved basic categorization (each URL lower-cased once)
+        lowered = [(page['url'], page['url'].lower()) for page in page_details[:20]]
+        company_pages = [url for url, low in lowered if _FALLBACK_COMPANY_MATCH(low)]
+        service_pages = [url for url, low in lowered if _FALLBACK_SERVICE_MATCH(low)]
+        product_pages = [url for url, low in lowered[:15] if not _FALLBACK_PRODUCT_EXCLUDE_MATCH(low)]
         
         fallback_response = {
             "company_info_pages": company_pages,
@@ -1263,7 +3200,7 @@ def analyze_all_urls_comprehensively(page_details: list[dict], root_url: str, la
 # Product catalog generation removed - focusing on knowledge base creation for chatbots
 # If categories are found during analysis, they will be mentioned in the knowledge base
 
-def identify_knowledge_rich_content_clusters(page_details: list[dict], root_url: str, lang: str) -> tuple[dict, int, int]:
+def identify_knowledge_rich_content_clusters(page_details: list[dict], root_url: str, lang: str) -> tuple[dict, int, int, int]:
     """Identify and prioritize knowledge-rich content clusters for chatbot training."""
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
     
@@ -1272,53 +3209,48 @@ def identify_knowledge_rich_content_clusters(page_details: list[dict], root_url:
     
     # Smart sampling with priority for knowledge content
     if len(urls_list) > 400:
-        import random
-        random.seed(42)
-        
-        # Define knowledge-rich URL patterns
-        knowledge_patterns = [
-            'how-to', 'guide', 'tutorial', 'tips', 'best-', 'what-is', 'vs-', 'comparison',
-            'install', 'setup', 'troubleshoot', 'solve', 'fix', 'error', 'problem',
-            'about', 'contact', 'policy', 'terms', 'faq', 'help', 'support', 'service',
-            'branch', 'location', 'درباره', 'تماس', 'راهنما', 'آموزش', 'نصب', 'حل'
-        ]
+        rng = random.Random(URL_SAMPLING_SEED)  # private RNG: reproducible, global `random` untouched
         
-        # Categorize URLs by knowledge value
+        # Categorize URLs by knowledge value in one pass; medium/low pages are reservoir-sampled
+        # (at most the 400-URL budget each) instead of collected into full lists.
         high_value_urls = []
-        medium_value_urls = []
-        low_value_urls = []
+        high_value_count = 0
+        medium_value_urls = ReservoirSample(400, rng)
+        low_value_urls = ReservoirSample(400, rng)
         
         for url in urls_list:
             url_lower = url.lower()
             # Skip technical/admin pages
-            if any(skip in url_lower for skip in ['wp-admin', 'wp-content', 'assets', 'css', 'js', 'images', 'cache', 'login', 'register', 'cart', 'checkout']):
+            if _CLUSTER_SKIP_MATCH(url_lower):
                 continue
             # High value: knowledge-rich content
-            elif any(pattern in url_lower for pattern in knowledge_patterns):
-                high_value_urls.append(url)
+            elif _KNOWLEDGE_URL_MATCH(url_lower):
+                high_value_count += 1
+                if len(high_value_urls) < 150:
+                    high_value_urls.append(url)
             # Medium value: category/brand pages
-            elif any(cat in url_lower for cat in ['category', 'brand', 'tag', 'archive']):
-                medium_value_urls.append(url)
+            elif _LISTING_URL_MATCH(url_lower):
+                medium_value_urls.add(url)
             # Low value: individual products
             elif 'product' in url_lower:
-                low_value_urls.append(url)
+                low_value_urls.add(url)
             else:
-                medium_value_urls.append(url)
+                medium_value_urls.add(url)
         
         # Sample intelligently: prioritize high-value content
         sampled_urls = []
-        sampled_urls.extend(high_value_urls[:150])  # Take most high-value content
+        sampled_urls.extend(high_value_urls)  # Take most high-value content (first 150)
         remaining_slots = 400 - len(sampled_urls)
         
-        if remaining_slots > 0 and medium_value_urls:
-            sampled_urls.extend(random.sample(medium_value_urls, min(remaining_slots // 2, len(medium_value_urls))))
+        if remaining_slots > 0:
+            sampled_urls.extend(medium_value_urls.take(remaining_slots // 2))
         
         remaining_slots = 400 - len(sampled_urls)
-        if remaining_slots > 0 and low_value_urls:
-            sampled_urls.extend(random.sample(low_value_urls, min(remaining_slots, len(low_value_urls))))
+        if remaining_slots > 0:
+            sampled_urls.extend(low_value_urls.take(remaining_slots))
         
         urls_list = sampled_urls
-        logger.info(f"Prioritized {len(urls_list)} URLs for knowledge analysis: {len(high_value_urls)} high-value, {len(medium_value_urls)} medium-value, {len(low_value_urls)} low-value")
+        logger.info(f"Prioritized {len(urls_list)} URLs for knowledge analysis: {high_value_count} high-value, {medium_value_urls.seen} medium-value, {low_value_urls.seen} low-value")
     
     urls_text = "\n".join([f"- {url}" for url in urls_list])
 
@@ -1372,41 +3304,25 @@ Output this JSON schema:
         }
     ]
 
-    p_tokens = count_tokens(urls_text)
-    completion = openai_client.chat.completions.create(
+    completion = create_chat_completion(
         model=OPENAI_MODEL, messages=messages,
         max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE_SELECTION * 2, response_format={"type": "json_object"}
     )
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, urls_text)
+    cached_tokens = _cached_prompt_tokens(completion)
     
     try:
-        response_content = completion.choices[0].message.content.strip()
-        # Try to extract JSON from the response if it's wrapped in markdown or other text
-        if '```json' in response_content:
-            json_start = response_content.find('```json') + 7
-            json_end = response_content.find('```', json_start)
-            if json_end != -1:
-                response_content = response_content[json_start:json_end].strip()
-        elif '```' in response_content:
-            json_start = response_content.find('```') + 3
-            json_end = response_content.rfind('```')
-            if json_end != -1 and json_end > json_start:
-                response_content = response_content[json_start:json_end].strip()
-        
-        response_data = json.loads(response_content)
-        return response_data, p_tokens, c_tokens
-    except (json.JSONDecodeError, TypeError) as e:
+        response_data = parse_json_response(completion.choices[0].message.content)
+        return response_data, p_tokens, c_tokens, cached_tokens
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error parsing knowledge cluster analysis: {e}")
         logger.error(f"Raw response content: {completion.choices[0].message.content[:500]}...")
         
-        # Enhanced fallback with knowledge-focused categorization
-        knowledge_patterns = ['how-to', 'guide', 'tutorial', 'tips', 'best-', 'what-is', 'vs-', 'install', 'درباره', 'تماس', 'راهنما', 'آموزش']
-        company_patterns = ['about', 'contact', 'policy', 'terms', 'branch', 'location', 'درباره', 'تماس', 'قوانین', 'شرایط']
-        support_patterns = ['help', 'support', 'faq', 'troubleshoot', 'solve', 'fix', 'error', 'problem', 'پشتیبانی', 'راهنما']
-        
-        educational_urls = [url for url in urls_list if any(pattern in url.lower() for pattern in ['how-to', 'tutorial', 'guide', 'install', 'setup', 'آموزش', 'نصب'])]
-        company_urls = [url for url in urls_list if any(pattern in url.lower() for pattern in company_patterns)]
-        support_urls = [url for url in urls_list if any(pattern in url.lower() for pattern in support_patterns)]
+        # Enhanced fallback with knowledge-focused categorization (each URL lower-cased once)
+        lowered = [(url, url.lower()) for url in urls_list]
+        educational_urls = [url for url, low in lowered if _FALLBACK_EDUCATIONAL_MATCH(low)]
+        company_urls = [url for url, low in lowered if _FALLBACK_CLUSTER_COMPANY_MATCH(low)]
+        support_urls = [url for url, low in lowered if _FALLBACK_SUPPORT_MATCH(low)]
         
         # Create language-appropriate descriptions
         if lang == 'fa':
@@ -1443,7 +3359,36 @@ Output this JSON schema:
         }
         
         logger.info(f"Using fallback knowledge cluster analysis: {fallback_response['total_knowledge_pages_identified']} knowledge pages identified")
-        return fallback_response, p_tokens, c_tokens
+        return fallback_response, p_tokens, c_tokens, cached_tokens
+
+COMPREHENSIVE_KB_INSTRUCTIONS = """Create a COMPREHENSIVE and DETAILED knowledge base for the website named by the user, in the language the user asks for.
+
+Use ALL the information the user provides, extracted from knowledge-rich content clusters, to create the most complete knowledge base possible.
+
+CRITICAL REQUIREMENTS FOR CHATBOT KNOWLEDGE BASE:
+1. Create a VERY DETAILED and COMPREHENSIVE knowledge base optimized for AI chatbot use
+2. Include ALL information from all knowledge clusters in a structured, searchable format
+3. Create SEPARATE, DETAILED SECTIONS for each knowledge cluster type
+4. Focus EXCLUSIVELY on educational content, company information, troubleshooting guides, and customer service information
+5. COMPLETELY AVOID product specifications, individual product details, or product catalogs
+6. Use proper Markdown formatting with clear hierarchical structure (##, ###, ####)
+7. Write entirely in the requested language
+8. Include comprehensive tables, lists, and structured information that chatbots can easily parse
+9. Be extremely detailed with step-by-step instructions, complete procedures, and actionable information
+10. Include all contact details, policies, procedures, and FAQ-type information
+11. Structure content for optimal chatbot knowledge retrieval and customer assistance
+12. Create in-depth sections for:
+    - Educational tutorials and how-to guides (with complete step-by-step instructions)
+    - Troubleshooting guides (with detailed problem-solving steps)
+    - Company information and policies (comprehensive contact info, terms, procedures)
+    - Technical explanations (detailed concept definitions and explanations)
+    - Buying guides (general advice and comparison criteria, NOT specific products)
+    - Service information (support processes, warranty info, service procedures)
+13. Make each section comprehensive enough to answer complex customer questions
+14. Focus on KNOWLEDGE that helps customers learn, understand, and solve problems
+15. Avoid any product pricing, product specifications, or individual product recommendations
+
+Create a professional, well-structured, comprehensive knowledge base document optimized for AI chatbot customer service use, with detailed separate sections for each knowledge cluster."""
 
 def compile_comprehensive_knowledge_base(extracted_content: dict, knowledge_clusters: dict, base_url: str, lang: str) -> tuple[str, int, int]:
     """Compile a comprehensive knowledge base from knowledge clusters."""
@@ -1463,53 +3408,42 @@ def compile_comprehensive_knowledge_base(extracted_content: dict, knowledge_clus
         section_title = cluster_name.replace('_', ' ').title()
         content_sections_text += f"\n\n{section_title.upper()}:\n{cluster_text}"
     
-    prompt = f"""Create a COMPREHENSIVE and DETAILED knowledge base for {base_url} in {lang}.
-
-    Use ALL the following information extracted from knowledge-rich content clusters to create the most complete knowledge base possible:
-
-    {content_sections_text}
-
-    KNOWLEDGE ANALYSIS SUMMARY:
-    - Total knowledge pages identified: {knowledge_clusters.get('total_knowledge_pages_identified', 0)}
-    - Analysis summary: {knowledge_clusters.get('analysis_summary', 'Knowledge cluster analysis completed')}
-    - Content clusters processed: {', '.join(extracted_content.keys())}
-
-    CRITICAL REQUIREMENTS FOR CHATBOT KNOWLEDGE BASE:
-    1. Create a VERY DETAILED and COMPREHENSIVE knowledge base optimized for AI chatbot use
-    2. Include ALL information from all knowledge clusters in a structured, searchable format
-    3. Create SEPARATE, DETAILED SECTIONS for each knowledge cluster type
-    4. Focus EXCLUSIVELY on educational content, company information, troubleshooting guides, and customer service information
-    5. COMPLETELY AVOID product specifications, individual product details, or product catalogs
-    6. Use proper Markdown formatting with clear hierarchical structure (##, ###, ####)
-    7. Write entirely in {lang}
-    8. Include comprehensive tables, lists, and structured information that chatbots can easily parse
-    9. Be extremely detailed with step-by-step instructions, complete procedures, and actionable information
-    10. Include all contact details, policies, procedures, and FAQ-type information
-    11. Structure content for optimal chatbot knowledge retrieval and customer assistance
-    12. Create in-depth sections for:
-        - Educational tutorials and how-to guides (with complete step-by-step instructions)
-        - Troubleshooting guides (with detailed problem-solving steps)
-        - Company information and policies (comprehensive contact info, terms, procedures)
-        - Technical explanations (detailed concept definitions and explanations)
-        - Buying guides (general advice and comparison criteria, NOT specific products)
-        - Service information (support processes, warranty info, service procedures)
-    13. Make each section comprehensive enough to answer complex customer questions
-    14. Focus on KNOWLEDGE that helps customers learn, understand, and solve problems
-    15. Avoid any product pricing, product specifications, or individual product recommendations
-
-    Create a professional, well-structured, comprehensive knowledge base document optimized for AI chatbot customer service use, with detailed separate sections for each knowledge cluster.
-    """
-    
-    p_tokens = count_tokens(prompt)
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL, messages=[{"role": "user", "content": prompt}],
+    messages = [
+        {"role": "developer", "content": COMPREHENSIVE_KB_INSTRUCTIONS},
+        {"role": "user", "content": (
+            f"Website: {base_url}\nWrite the knowledge base entirely in {lang}.\n\n"
+            f"KNOWLEDGE ANALYSIS SUMMARY:\n"
+            f"- Total knowledge pages identified: {knowledge_clusters.get('total_knowledge_pages_identified', 0)}\n"
+            f"- Analysis summary: {knowledge_clusters.get('analysis_summary', 'Knowledge cluster analysis completed')}\n"
+            f"- Content clusters processed: {', '.join(extracted_content.keys())}\n\n"
+            f"EXTRACTED KNOWLEDGE CLUSTERS:{content_sections_text}"
+        )},
+    ]
+    completion = create_chat_completion(
+        model=OPENAI_MODEL, messages=messages,
         max_completion_tokens=MAX_RESPONSE_TOKENS_KB_COMPILATION
     )
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, messages)
 
     return completion.choices[0].message.content.strip(), p_tokens, c_tokens
         
-def extract_website_colors_with_openai(html_content: str, url: str, screenshot_base64: str = None) -> tuple[dict, int, int]:
+COLOR_EXTRACTION_INSTRUCTIONS = """Analyze the website the user provides to identify its color scheme.
+
+Your task is to identify:
+1. Main background color (most common background color used across the website)
+2. Primary brand color (the main color used for branding, buttons, links, headers, etc.)
+
+Look at the HTML content and visual context to determine these colors.
+
+Respond with a JSON object:
+{
+    "main_background_color": "hex color code (e.g., #ffffff)",
+    "primary_brand_color": "hex color code (e.g., #007bff)",
+    "background_color_description": "Brief description of the background color",
+    "brand_color_description": "Brief description of the brand color and where it's used"
+}"""
+
+def extract_website_colors_with_openai(html_content: str, url: str, screenshot_base64: str = None) -> tuple[dict, int, int, int]:
     """Extract website background color and primary brand color using AI analysis."""
     if not openai_client: 
         raise ConnectionError("OpenAI client not initialized.")
@@ -1524,42 +3458,23 @@ def extract_website_colors_with_openai(html_content: str, url: str, screenshot_b
     Screenshot (base64): data:image/png;base64,{screenshot_base64[:100]}... [truncated for prompt length]
     """
     
-    prompt = f"""Analyze the website at '{url}' to identify its color scheme.{screenshot_context}
-    
-    Your task is to identify:
-    1. Main background color (most common background color used across the website)
-    2. Primary brand color (the main color used for branding, buttons, links, headers, etc.)
-    
-    Look at the HTML content and visual context to determine these colors.
-    
-    Respond with a JSON object:
-    {{
-        "main_background_color": "hex color code (e.g., #ffffff)",
-        "primary_brand_color": "hex color code (e.g., #007bff)",
-        "background_color_description": "Brief description of the background color",
-        "brand_color_description": "Brief description of the brand color and where it's used"
-    }}
-    
-    HTML Content: ```{html_content[:5000]}```"""
-    
-    p_tokens = count_tokens(prompt)
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL_CHEAP, messages=[{"role": "user", "content": prompt}],
+    messages = [
+        {"role": "developer", "content": COLOR_EXTRACTION_INSTRUCTIONS},
+        {"role": "user", "content": (
+            f"Website: {url}{screenshot_context}\n"
+            f"HTML Content: ```{clean_html_for_llm(html_content, keep_styles=True)[:5000]}```"
+        )},
+    ]
+    completion = create_chat_completion(
+        model=OPENAI_MODEL_CHEAP, messages=messages,
         max_completion_tokens=300, response_format={"type": "json_object"}
     )
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, messages)
+    cached_tokens = _cached_prompt_tokens(completion)
     
     try:
-        response_content = completion.choices[0].message.content.strip()
-        # Handle potential markdown wrapping
-        if '```json' in response_content:
-            json_start = response_content.find('```json') + 7
-            json_end = response_content.find('```', json_start)
-            if json_end != -1:
-                response_content = response_content[json_start:json_end].strip()
-        
-        return json.loads(response_content), p_tokens, c_tokens
-    except (json.JSONDecodeError, TypeError) as e:
+        return parse_json_response(completion.choices[0].message.content), p_tokens, c_tokens, cached_tokens
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error parsing color extraction response: {e}")
         # Return a fallback response
         return {
@@ -1567,29 +3482,13 @@ def extract_website_colors_with_openai(html_content: str, url: str, screenshot_b
             "primary_brand_color": "#000000",
             "background_color_description": "Default white background (fallback)",
             "brand_color_description": "Default black text (fallback)"
-        }, p_tokens, c_tokens
-
-def extract_knowledge_from_page_with_openai(html_content: str, url: str, title: str, lang: str, screenshot_base64: str = None) -> tuple[dict, int, int]:
-    """Extract customer-relevant knowledge from one page into a structured chunk.
-
-    Feeds CLEAN main-content text (not raw HTML) to the cheap model and classifies the page
-    into exactly one canonical KB section, so the final document can be synthesised
-    section-by-section instead of through a single token-capped compile call.
-    Returns (data, prompt_tokens, completion_tokens) where data has keys:
-    url, title_suggestion, primary_category, extracted_chunk.
-    """
-    if not openai_client: raise ConnectionError("OpenAI client not initialized.")
-
-    clean_text = clean_text_from_html(html_content, url)
-    section_keys_str = ", ".join(KB_SECTION_KEYS)
-    lang_name = language_name(lang)
-
-    user_text = f"""Extract ALL customer-relevant knowledge from this web page for a customer-support chatbot.
+        }, p_tokens, c_tokens, cached_tokens
 
-URL: {url}
-Page Title: {title}
+_KB_EXTRACTION_PREAMBLE = """You are a precise knowledge-extraction engine for chatbot training data.
+Write ALL output in {lang_name} (translate source content into {lang_name}; never use English unless {lang_name} is English).
+Keep contact details, prices and policy text verbatim. Output ONLY valid JSON matching the schema provided."""
 
-Capture (when present): contact details (phones, emails, addresses, hours, social links),
+_KB_EXTRACTION_RULES = """Capture (when present): contact details (phones, emails, addresses, hours, social links),
 company background/mission, policies (shipping, returns, refunds, warranty, privacy, terms),
 services and procedures, FAQ as question+answer pairs, branch/location info, payment methods
 and ordering/checkout steps, and any educational / how-to / troubleshooting content.
@@ -1601,15 +3500,66 @@ Rules:
 - Write the extracted_chunk entirely in {lang_name}. If the source text is in another language, translate it INTO {lang_name}. Do NOT output English unless {lang_name} is English.
 - If the page has no useful customer knowledge, return an empty string for extracted_chunk.
 
-Classify the page's PRIMARY purpose into exactly one of: {section_keys_str}
+Classify the page's PRIMARY purpose into exactly one of: {section_keys}"""
+
+KB_EXTRACTION_INSTRUCTIONS_TEMPLATE = _KB_EXTRACTION_PREAMBLE + """
+
+Extract ALL customer-relevant knowledge from the web page given by the user for a customer-support chatbot.
+
+""" + _KB_EXTRACTION_RULES + """
 
 Output ONLY this JSON:
 {{
-  "url": "{url}",
+  "url": "<the page URL given by the user>",
   "title_suggestion": "<short descriptive title in {lang_name}>",
-  "primary_category": "<one of: {section_keys_str}>",
+  "primary_category": "<one of: {section_keys}>",
   "extracted_chunk": "<comprehensive Markdown in {lang_name} covering everything useful on this page>"
-}}
+}}"""
+
+KB_BATCH_EXTRACTION_INSTRUCTIONS_TEMPLATE = _KB_EXTRACTION_PREAMBLE + """
+
+The user gives a JSON array of web pages, each with "url", "title" and "content".
+Extract ALL customer-relevant knowledge from EACH page separately for a customer-support chatbot;
+never merge knowledge from different pages into one entry. Apply these rules to every page:
+
+""" + _KB_EXTRACTION_RULES + """
+
+Output ONLY this JSON, with exactly one entry per input page, in input order:
+{{
+  "pages": [
+    {{
+      "url": "<the page's url exactly as given>",
+      "title_suggestion": "<short descriptive title in {lang_name}>",
+      "primary_category": "<one of: {section_keys}>",
+      "extracted_chunk": "<comprehensive Markdown in {lang_name} covering everything useful on this page>"
+    }}
+  ]
+}}"""
+
+@functools.lru_cache(maxsize=64)
+def _extraction_instructions(lang: str, batched: bool = False) -> str:
+    """Extraction developer message for lang, formatted once per language rather than per page."""
+    template = KB_BATCH_EXTRACTION_INSTRUCTIONS_TEMPLATE if batched else KB_EXTRACTION_INSTRUCTIONS_TEMPLATE
+    return template.format(lang_name=language_name(lang), section_keys=", ".join(KB_SECTION_KEYS))
+
+def _extraction_text(html_content: str, url: str) -> str:
+    """Clean main-content text of a page, capped at MAX_CLEAN_TEXT_TOKENS, as sent for extraction."""
+    return truncate_to_tokens(clean_text_from_html(html_content, url), MAX_CLEAN_TEXT_TOKENS)
+
+def _extraction_text_and_tokens(html_content: str, url: str) -> tuple[str, int]:
+    """_extraction_text() plus its token count, so both run off the event loop together."""
+    clean_text = _extraction_text(html_content, url)
+    return clean_text, count_tokens(clean_text) or len(clean_text) // 4
+
+def _build_extraction_messages(html_content: str, url: str, title: str, lang: str,
+                               screenshot_base64: str = None, clean_text: str = None) -> tuple[list, str]:
+    """Messages for per-page knowledge extraction, plus the clean text (for token fallback)."""
+    if clean_text is None:
+        clean_text = _extraction_text(html_content, url)
+    # Static instructions first, page-specific content last: the developer message is then a
+    # byte-identical prefix across every page of a job, which OpenAI's prompt cache can reuse.
+    user_text = f"""URL: {url}
+Page Title: {title}
 
 PAGE CONTENT:
 ```{clean_text}```"""
@@ -1622,36 +3572,29 @@ PAGE CONTENT:
         })
 
     messages = [
-        {
-            "role": "developer",
-            "content": (
-                f"You are a precise knowledge-extraction engine for chatbot training data. "
-                f"Write ALL output in {lang_name} (translate source content into {lang_name}; "
-                f"never use English unless {lang_name} is English). "
-                f"Keep contact details, prices and policy text verbatim. "
-                f"Output ONLY valid JSON matching the schema provided."
-            )
-        },
+        {"role": "developer", "content": _extraction_instructions(lang)},
         {"role": "user", "content": user_content_parts},
     ]
+    return messages, clean_text
 
-    completion = openai_client.chat.completions.create(
-        model=OPENAI_MODEL_CHEAP, messages=messages,
-        max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE_EXTRACTION, response_format={"type": "json_object"}
-    )
-    usage = completion.usage
-    p_tokens = usage.prompt_tokens if usage else count_tokens(clean_text)
-    c_tokens = usage.completion_tokens if usage else 0
+
+def _normalize_extraction(data: dict, url: str, title: str) -> dict:
+    cat = str(data.get("primary_category", "")).strip().lower()
+    if cat not in KB_SECTION_KEYS:
+        cat = "additional"
+    data["primary_category"] = cat
+    data.setdefault("url", url)
+    data.setdefault("title_suggestion", title)
+    data.setdefault("extracted_chunk", "")
+    return data
+
+
+def _parse_extraction_completion(completion, url: str, title: str, clean_text: str) -> tuple[dict, int, int, int]:
+    p_tokens, c_tokens = _usage_tokens(completion, clean_text)
+    cached_tokens = _cached_prompt_tokens(completion)
     try:
         data = parse_json_response(completion.choices[0].message.content)
-        cat = str(data.get("primary_category", "")).strip().lower()
-        if cat not in KB_SECTION_KEYS:
-            cat = "additional"
-        data["primary_category"] = cat
-        data.setdefault("url", url)
-        data.setdefault("title_suggestion", title)
-        data.setdefault("extracted_chunk", "")
-        return data, p_tokens, c_tokens
+        return _normalize_extraction(data, url, title), p_tokens, c_tokens, cached_tokens
     except (json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error parsing knowledge extraction response for {url}: {e}")
         return {
@@ -1659,24 +3602,80 @@ PAGE CONTENT:
             "title_suggestion": title,
             "primary_category": "additional",
             "extracted_chunk": ""
-        }, p_tokens, c_tokens
+        }, p_tokens, c_tokens, cached_tokens
 
-def compile_final_knowledge_base_with_openai(chunks: list[dict], url: str, lang: str) -> tuple[str, int, int]:
+
+def extract_knowledge_from_page_with_openai(html_content: str, url: str, title: str, lang: str, screenshot_base64: str = None) -> tuple[dict, int, int, int]:
+    """Extract customer-relevant knowledge from one page into a structured chunk.
+
+    Feeds CLEAN main-content text (not raw HTML) to the cheap model and classifies the page
+    into exactly one canonical KB section, so the final document can be synthesised
+    section-by-section instead of through a single token-capped compile call.
+    Returns (data, prompt_tokens, completion_tokens) where data has keys:
+    url, title_suggestion, primary_category, extracted_chunk.
+    """
     if not openai_client: raise ConnectionError("OpenAI client not initialized.")
-    guidelines = KB_WRITING_GUIDELINES_TEMPLATE.format(target_language=lang)
-    chunks_text = "\n\n".join([f"--- Chunk from {c.get('url', 'N/A')} ---\nTitle: {c.get('title_suggestion', 'N/A')}\nContent:\n{c.get('extracted_chunk', 'N/A')}" for c in chunks])
+    messages, clean_text = _build_extraction_messages(html_content, url, title, lang, screenshot_base64)
+    completion = create_chat_completion(
+        model=OPENAI_MODEL_CHEAP, messages=messages,
+        max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE_EXTRACTION, response_format={"type": "json_object"}
+    )
+    return _parse_extraction_completion(completion, url, title, clean_text)
+
+
+async def aextract_knowledge_from_page_with_openai(html_content: str, url: str, title: str, lang: str,
+                                                   screenshot_base64: str = None,
+                                                   clean_text: str = None) -> tuple[dict, int, int, int]:
+    """Async extract_knowledge_from_page_with_openai(); HTML cleaning runs off the event loop."""
+    if not async_openai_client: raise ConnectionError("OpenAI client not initialized.")
+    if clean_text is None:
+        messages, clean_text = await asyncio.to_thread(
+            _build_extraction_messages, html_content, url, title, lang, screenshot_base64)
+    else:
+        messages, clean_text = _build_extraction_messages(html_content, url, title, lang, screenshot_base64,
+                                                          clean_text=clean_text)
+    completion = await acreate_chat_completion(
+        model=OPENAI_MODEL_CHEAP, messages=messages,
+        max_completion_tokens=MAX_RESPONSE_TOKENS_PAGE_EXTRACTION, response_format={"type": "json_object"}
+    )
+    return _parse_extraction_completion(completion, url, title, clean_text)
+
+
+async def aextract_knowledge_from_pages_batch(pages: list, lang: str) -> tuple[dict, int, int, int]:
+    """Extract several small pages in one completion.
+
+    pages are {url, title, clean_text} dicts. Returns ({url: data}, prompt_tokens,
+    completion_tokens); pages the model left out (or a response that did not parse) are
+    simply absent, so the caller can extract those one by one.
+    """
+    if not async_openai_client: raise ConnectionError("OpenAI client not initialized.")
+    user_text = json_dumps([{"url": pg["url"], "title": pg["title"], "content": pg["clean_text"]}
+                            for pg in pages]).decode()
     messages = [
-        {
-            "role": "developer",
-            "content": (
-                f"You are a technical writer creating a structured knowledge base in {lang}. "
-                f"Synthesize multiple page extracts into a single, deduplicated Markdown document. "
-                f"Remove duplicate information. Resolve conflicts by keeping the most complete version."
-            )
-        },
-        {
-            "role": "user",
-            "content": f"""Compile these page extracts from {url} into one cohesive knowledge base.
+        {"role": "developer", "content": _extraction_instructions(lang, batched=True)},
+        {"role": "user", "content": user_text},
+    ]
+    completion = await acreate_chat_completion(
+        model=OPENAI_MODEL_CHEAP, messages=messages,
+        max_completion_tokens=MAX_RESPONSE_TOKENS_BATCH_EXTRACTION, response_format={"type": "json_object"}
+    )
+    p_tokens, c_tokens = _usage_tokens(completion, user_text)
+    cached_tokens = _cached_prompt_tokens(completion)
+    titles = {pg["url"]: pg["title"] for pg in pages}
+    results = {}
+    try:
+        entries = parse_json_response(completion.choices[0].message.content).get("pages") or []
+        for data in entries:
+            url = data.get("url") if isinstance(data, dict) else None
+            if url in titles and url not in results:
+                results[url] = _normalize_extraction(data, url, titles[url])
+    except (json.JSONDecodeError, TypeError, ValueError, AttributeError) as e:
+        logger.error(f"Error parsing batched knowledge extraction response for {len(pages)} pages: {e}")
+    return results, p_tokens, c_tokens, cached_tokens
+
+KB_COMPILATION_INSTRUCTIONS_TEMPLATE = """You are a technical writer creating a structured knowledge base in {lang}.
+Synthesize multiple page extracts into a single, deduplicated Markdown document.
+Remove duplicate information. Resolve conflicts by keeping the most complete version.
 
 Required document structure (use ## for each section that has data):
 ## Company Overview
@@ -1697,41 +3696,80 @@ Rules:
 - Include all policy clauses verbatim (do not paraphrase legal text)
 
 Guidelines:
-{guidelines}
+{guidelines}"""
 
-Page extracts:
-{chunks_text}"""
-        }
+@functools.lru_cache(maxsize=64)
+def _compilation_instructions(lang: str) -> str:
+    """Compilation developer message (with the writing guidelines) for lang, formatted once per language."""
+    return KB_COMPILATION_INSTRUCTIONS_TEMPLATE.format(
+        lang=lang, guidelines=KB_WRITING_GUIDELINES_TEMPLATE.format(target_language=lang))
+
+KB_COMPILATION_INPUT_TOKEN_BUDGET = 60000      # per-call input budget before compile is map-reduced
+KB_COMPILATION_MAX_ROUNDS = 3                  # reduce rounds before a final single call regardless of size
+
+def compile_final_knowledge_base_with_openai(chunks: list[dict], url: str, lang: str) -> tuple[str, int, int]:
+    """Compile page chunks into one KB document.
+
+    Inputs over KB_COMPILATION_INPUT_TOKEN_BUDGET are compiled hierarchically: token-bounded
+    batches are compiled into partial KBs concurrently, then the partials are compiled again,
+    so no single call carries the whole site.
+    """
+    if not openai_client: raise ConnectionError("OpenAI client not initialized.")
+    texts = [f"--- Chunk from {c.get('url', 'N/A')} ---\nTitle: {c.get('title_suggestion', 'N/A')}\nContent:\n{c.get('extracted_chunk', 'N/A')}" for c in chunks]
+    p_total, c_total = 0, 0
+    for _ in range(KB_COMPILATION_MAX_ROUNDS):
+        batches = _batch_chunks_by_tokens(texts, KB_COMPILATION_INPUT_TOKEN_BUDGET)
+        if len(batches) <= 1 or len(batches) >= len(texts):
+            break  # fits in one call, or batching can no longer shrink the input
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(batches), KB_EXTRACTION_WORKERS)) as executor:
+            partials = list(executor.map(lambda batch: _compile_kb_text("\n\n".join(batch), url, lang), batches))
+        texts = []
+        for i, (content, p, c) in enumerate(partials):
+            p_total, c_total = p_total + p, c_total + c
+            texts.append(f"--- Partial knowledge base {i+1}/{len(partials)} ---\n{content}")
+    content, p, c = _compile_kb_text("\n\n".join(texts), url, lang)
+    return content, p_total + p, c_total + c
+
+def _compile_kb_text(chunks_text: str, url: str, lang: str) -> tuple[str, int, int]:
+    messages = [
+        {"role": "developer", "content": _compilation_instructions(lang)},
+        {"role": "user", "content": f"Compile these page extracts from {url} into one cohesive knowledge base.\n\nPage extracts:\n{chunks_text}"},
     ]
-    p_tokens = count_tokens(chunks_text)
-    completion = openai_client.chat.completions.create(
+    completion = create_chat_completion(
         model=OPENAI_MODEL, messages=messages, max_completion_tokens=MAX_RESPONSE_TOKENS_KB_COMPILATION
     )
-    c_tokens = completion.usage.completion_tokens if completion.usage else 0
+    p_tokens, c_tokens = _usage_tokens(completion, chunks_text)
     return completion.choices[0].message.content.strip(), p_tokens, c_tokens
 
 
 # --- Report Helpers ---
+PROSPECT_CSV_HEADERS = ['website', 'status', 'is_potential_customer', 'confidence_score', 'reasoning_for', 'reasoning_against', 'error']
+
+def prospect_csv_path(job_id: str) -> str:
+    return os.path.join(REPORTS_DIR, f"prospect_report_{job_id}.csv")
+
+def prospect_csv_row(result: dict) -> dict:
+    analysis = result.get('analysis') or {}  # None for failed prospects
+    return {
+        'website': result.get('url'), 'status': result.get('status'),
+        'is_potential_customer': analysis.get('is_potential_customer', ''),
+        'confidence_score': analysis.get('confidence_score', ''),
+        'reasoning_for': analysis.get('reasoning_for', ''),
+        'reasoning_against': analysis.get('reasoning_against', ''),
+        'error': result.get('error') or ''
+    }
+
 def save_results_to_csv(job_id: str, results_data: list):
     """Save prospect qualification results to CSV."""
     if not results_data: return None
     os.makedirs(REPORTS_DIR, exist_ok=True)
-    filepath = os.path.join(REPORTS_DIR, f"prospect_report_{job_id}.csv")
-    headers = ['website', 'status', 'is_potential_customer', 'confidence_score', 'reasoning_for', 'reasoning_against', 'error']
+    filepath = prospect_csv_path(job_id)
     try:
         with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=headers)
+            writer = csv.DictWriter(csvfile, fieldnames=PROSPECT_CSV_HEADERS)
             writer.writeheader()
             for result in results_data:
-                row = {
-                    'website': result.get('url'), 'status': result.get('status'),
-                    'is_potential_customer': result.get('analysis', {}).get('is_potential_customer', ''),
-                    'confidence_score': result.get('analysis', {}).get('confidence_score', ''),
-                    'reasoning_for': result.get('analysis', {}).get('reasoning_for', ''),
-                    'reasoning_against': result.get('analysis', {}).get('reasoning_against', ''),
-                    'error': result.get('error', '')
-                }
-                writer.writerow(row)
+                writer.writerow(prospect_csv_row(result))
         logger.info(f"Successfully saved prospect report to {filepath}")
         return filepath
     except IOError as e:
@@ -1789,8 +3827,8 @@ def save_knowledge_base_report(job_id: str, url: str, knowledge_base: str, metad
             **metadata
         }
         
-        with open(metadata_filepath, 'w', encoding='utf-8') as f:
-            json.dump(full_metadata, f, indent=2, ensure_ascii=False)
+        with open(metadata_filepath, 'wb') as f:
+            f.write(json_dumps(full_metadata, indent=True))
         
         logger.info(f"Knowledge base report saved: {kb_filepath}")
         logger.info(f"Metadata saved: {metadata_filepath}")
@@ -1805,43 +3843,54 @@ def save_knowledge_base_report(job_id: str, url: str, knowledge_base: str, metad
 
 def run_company_analysis_job(job_id, url, max_pages, use_selenium):
     logger.info(f"Starting analysis job {job_id} for {url}")
-    with jobs_lock: jobs[job_id]["status"] = "running"
+    job_store.update(job_id, {"status": "running"})
     
     try:
         crawl_func = selenium_crawl_website if use_selenium else simple_crawl_website
         found_pages = crawl_func(url, max_pages)
         
-        page_summaries = []
-        for i, page in enumerate(found_pages):
-            with jobs_lock: jobs[job_id]["progress"] = f"Analyzing page {i+1}/{len(found_pages)}"
-            try:
-                content = fetch_url_content(page['url'])
-                if content:
-                    summary = analyze_single_page_with_openai(content, page['url'])
-                    page_summaries.append({'url': page['url'], 'description': summary})
-            except Exception as e:
-                logger.error(f"Failed to analyze page {page['url']}: {e}")
+        def _analyze_page(page):
+            content = fetch_url_content(page['url'])
+            if not content:
+                return None
+            return {'url': page['url'], 'description': analyze_single_page_with_openai(content, page['url'])}
+
+        # Fetch + summarize pages concurrently; results are kept in crawl order so the
+        # company summary prompt is stable across runs.
+        results = [None] * len(found_pages)
+        progress = ProgressCounter(job_id, len(found_pages), "Analyzing page {done}/{total}")
+        workers = max(1, min(PAGE_ANALYSIS_WORKERS, len(found_pages)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_analyze_page, page): i for i, page in enumerate(found_pages)}
+            for future in concurrent.futures.as_completed(futures):
+                progress.step()
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to analyze page {found_pages[i]['url']}: {e}")
+        page_summaries = [r for r in results if r]
         
-        with jobs_lock: jobs[job_id]["progress"] = "Summarizing company..."
+        job_store.update(job_id, {"progress": "Summarizing company..."})
         final_summary = summarize_company_with_openai(page_summaries, url)
         
-        with jobs_lock:
-            jobs[job_id].update({
-                "status": "completed",
-                "results": {"company_summary": final_summary, "analyzed_pages": page_summaries}
-            })
+        job_store.update(job_id, {
+            "status": "completed",
+            "results": {"company_summary": final_summary, "analyzed_pages": page_summaries},
+            "finished_at": time.time(),
+        })
     except Exception as e:
         logger.error(f"Job {job_id} failed: {e}", exc_info=True)
-        with jobs_lock: jobs[job_id].update({"status": "failed", "error": str(e)})
+        job_store.update(job_id, {"status": "failed", "error": str(e), "finished_at": time.time()})
 
 def run_prospect_qualification_job(job_id, user_profile, user_personas, prospect_urls):
     logger.info(f"Starting prospect qualification job {job_id}")
-    with jobs_lock: jobs[job_id]["status"] = "running"
+    job_store.update(job_id, {"status": "running"})
     
-    results = []
-    total_prompt_tokens, total_completion_tokens = 0, 0
-    for i, url in enumerate(prospect_urls):
-        with jobs_lock: jobs[job_id]["progress"] = f"Qualifying {i+1}/{len(prospect_urls)}: {url}"
+    totals_lock = threading.Lock()
+    totals = {"prompt": 0, "completion": 0}
+
+    def _qualify(url):
         result_entry = {"url": url, "status": "pending", "analysis": None, "error": None}
         try:
             page_content = fetch_url_content(url)
@@ -1849,27 +3898,64 @@ def run_prospect_qualification_job(job_id, user_profile, user_personas, prospect
             
             analysis, usage = qualify_prospect_with_openai(page_content, url, user_profile, user_personas)
             result_entry.update({"status": "completed", "analysis": analysis})
-            total_prompt_tokens += usage.prompt_tokens
-            total_completion_tokens += usage.completion_tokens
+            with totals_lock:
+                totals["prompt"] += usage.prompt_tokens
+                totals["completion"] += usage.completion_tokens
         except Exception as e:
             result_entry.update({"status": "failed", "error": str(e)})
-        results.append(result_entry)
+        return result_entry
+
+    # The CSV report is written row by row as prospects finish (line-buffered), so a long job
+    # leaves a usable partial report behind if it is interrupted.
+    csv_report_path, csvfile, writer = None, None, None
+    if prospect_urls:
+        try:
+            os.makedirs(REPORTS_DIR, exist_ok=True)
+            csv_report_path = prospect_csv_path(job_id)
+            csvfile = open(csv_report_path, 'w', newline='', encoding='utf-8', buffering=1)
+            writer = csv.DictWriter(csvfile, fieldnames=PROSPECT_CSV_HEADERS)
+            writer.writeheader()
+        except IOError as e:
+            logger.error(f"Failed to open CSV report for job {job_id}: {e}")
+            csv_report_path, csvfile, writer = None, None, None
+
+    # Prospects are independent fetch + LLM round-trips; fan them out and keep input order.
+    results = [None] * len(prospect_urls)
+    progress = ProgressCounter(job_id, len(prospect_urls), "Qualifying {done}/{total}: {url}")
+    workers = max(1, min(QUALIFY_WORKERS, len(prospect_urls)))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_qualify, url): i for i, url in enumerate(prospect_urls)}
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if writer is not None:
+                    try:
+                        writer.writerow(prospect_csv_row(results[i]))
+                    except IOError as e:
+                        logger.error(f"Failed to write CSV row for job {job_id}: {e}")
+                progress.step(url=prospect_urls[i])
+    finally:
+        if csvfile is not None:
+            csvfile.close()
+    if csv_report_path:
+        logger.info(f"Successfully saved prospect report to {csv_report_path}")
+    total_prompt_tokens, total_completion_tokens = totals["prompt"], totals["completion"]
     
-    csv_report_path = save_results_to_csv(job_id, results)
     input_cost = (total_prompt_tokens / 1_000_000) * PRICE_PER_INPUT_TOKEN_MILLION
     output_cost = (total_completion_tokens / 1_000_000) * PRICE_PER_OUTPUT_TOKEN_MILLION
     
-    with jobs_lock:
-        jobs[job_id].update({
-            "status": "completed",
-            "results": results,
-            "csv_report_path": csv_report_path,
-            "cost_estimation": {
-                "total_cost_usd": f"{(input_cost + output_cost):.6f}",
-                "prompt_tokens": total_prompt_tokens,
-                "completion_tokens": total_completion_tokens
-            }
-        })
+    job_store.update(job_id, {
+        "status": "completed",
+        "results": results,
+        "csv_report_path": csv_report_path,
+        "cost_estimation": {
+            "total_cost_usd": f"{(input_cost + output_cost):.6f}",
+            "prompt_tokens": total_prompt_tokens,
+            "completion_tokens": total_completion_tokens
+        },
+        "finished_at": time.time(),
+    })
 
 # =====================================================================================
 # Overhauled KB pipeline: discovery -> deterministic pre-filter -> AI selection ->
@@ -1895,15 +3981,22 @@ _ARCHIVE_PATH_HINTS = ('/tag/', '/tags/', '/author/', '/feed/', '/page/', '/comm
                        '/برچسب/', '/نویسنده/')
 _QUERY_JUNK_HINTS = ('add-to-cart', 'orderby=', 'filter_', 'filter=', 'replytocom=',
                      'add_to_wishlist', 'compare=', 'paged=', 'page=', 'sort=', 'pagenum')
+_PRODUCT_PATH_HINTS = ('/product/', '/products/', '/dp/', '/item/',
+                       '/sku/', '/-p-', '/buy/', '/محصول/', '/کالا/')
+_TRANSACTIONAL_PATH_MATCH = _substring_search(_TRANSACTIONAL_PATH_HINTS)
+_ARCHIVE_PATH_MATCH = _substring_search(_ARCHIVE_PATH_HINTS)
+_QUERY_JUNK_MATCH = _substring_search(_QUERY_JUNK_HINTS)
+_PRODUCT_PATH_MATCH = _substring_search(_PRODUCT_PATH_HINTS)
 
 _EMAIL_RE = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}')
 _PHONE_RE = re.compile(r'(?:(?:\+|00)\d{1,3}[\s-]?)?(?:\(?\d{2,4}\)?[\s-]?){2,5}\d{2,4}')
+_NON_DIGIT_RE = re.compile(r'\D')
+_PHONE_HINT_RE = re.compile(r'\d{3}[\s-]?\d{3,}')
 
 
 def _looks_like_product_url(path_lower: str) -> bool:
     """Heuristic for individual product-detail pages (skipped for a knowledge base)."""
-    return any(h in path_lower for h in ('/product/', '/products/', '/dp/', '/item/',
-                                         '/sku/', '/-p-', '/buy/', '/محصول/', '/کالا/'))
+    return _PRODUCT_PATH_MATCH(path_lower) is not None
 
 
 def prefilter_candidate_urls(urls: list, base_domain: str, keep_product_sample: int = 15):
@@ -1920,10 +4013,11 @@ def prefilter_candidate_urls(urls: list, base_domain: str, keep_product_sample:
             dropped['invalid'] += 1
             continue
         norm = urlparse(u)._replace(fragment="").geturl()
-        if norm in seen:
+        key = canonicalize_url(norm)
+        if key in seen:
             dropped['duplicate'] += 1
             continue
-        seen.add(norm)
+        seen.add(key)
         p = urlparse(norm)
         if p.scheme not in ('http', 'https'):
             dropped['non_http'] += 1
@@ -1936,13 +4030,13 @@ def prefilter_candidate_urls(urls: list, base_domain: str, keep_product_sample:
         if path_lower.endswith(_ASSET_EXTENSIONS):
             dropped['asset'] += 1
             continue
-        if any(h in path_lower for h in _TRANSACTIONAL_PATH_HINTS):
+        if _TRANSACTIONAL_PATH_MATCH(path_lower):
             dropped['transactional'] += 1
             continue
-        if any(h in path_lower for h in _ARCHIVE_PATH_HINTS):
+        if _ARCHIVE_PATH_MATCH(path_lower):
             dropped['archive'] += 1
             continue
-        if query_lower and any(h in query_lower for h in _QUERY_JUNK_HINTS):
+        if query_lower and _QUERY_JUNK_MATCH(query_lower):
             dropped['faceted'] += 1
             continue
         if _looks_like_product_url(path_lower):
@@ -1963,6 +4057,9 @@ def prefilter_candidate_urls(urls: list, base_domain: str, keep_product_sample:
 def discover_all_candidate_urls(base_url: str, use_selenium: bool = False):
     """Discover candidate page URLs: sitemap first (scales to huge sites), crawl fallback.
 
+    The fallback crawl uses plain requests first; Selenium (when requested) only runs if that
+    still finds fewer than 5 URLs, e.g. on JavaScript-rendered sites.
+
     Returns (candidate_urls_including_base, discovery_meta).
     """
     meta = {"sitemap_urls": 0, "crawled_urls": 0, "method": None, "capped": False}
@@ -1981,10 +4078,14 @@ def discover_all_candidate_urls(base_url: str, use_selenium: bool = False):
         meta["method"] = "crawl"
         try:
             crawl_cap = min(MAX_PAGES_FOR_FALLBACK_DISCOVERY_CRAWL, MAX_DISCOVERY_URLS)
-            if use_selenium and SELENIUM_AVAILABLE:
-                crawled = selenium_crawl_website(base_url, max_pages=crawl_cap)
-            else:
-                crawled = simple_crawl_website(base_url, max_pages=crawl_cap)
+            crawled = simple_crawl_website(base_url, max_pages=crawl_cap)
+            if use_selenium and SELENIUM_AVAILABLE and len(candidates) + len(crawled) < 5:
+                logger.info(f"Plain crawl found {len(crawled)} pages on {base_url}; retrying with Selenium")
+                try:
+                    crawled = selenium_crawl_website(base_url, max_pages=crawl_cap)
+                    meta["method"] = "selenium_crawl"
+                except Exception as e:  # e.g. no browser driver; keep what the plain crawl found
+                    logger.warning(f"Selenium crawl failed for {base_url}, using plain crawl results: {e}")
             crawl_urls = [c['url'] for c in crawled]
             meta["crawled_urls"] = len(crawl_urls)
             candidates.extend(crawl_urls)
@@ -1992,6 +4093,12 @@ def discover_all_candidate_urls(base_url: str, use_selenium: bool = False):
             logger.warning(f"Fallback crawl failed for {base_url}: {e}")
 
     candidates.insert(0, base_url)
+    # Sitemap and crawl results overlap heavily; drop canonical duplicates before the cap so
+    # they do not crowd out distinct pages.
+    unique = {}
+    for u in candidates:
+        unique.setdefault(canonicalize_url(u), u)
+    candidates = list(unique.values())
 
     if len(candidates) > MAX_DISCOVERY_URLS:
         meta["capped"] = True
@@ -2021,16 +4128,18 @@ def select_knowledge_pages(base_url: str, candidate_urls: list, lang: str, page_
     }
 
     base_norm = urlparse(base_url)._replace(fragment="").geturl()
-    if base_norm not in kept:
+    base_key = canonicalize_url(base_norm)
+    if not any(canonicalize_url(u) == base_key for u in kept):
         kept.insert(0, base_norm)
 
     selected = []
-    seen = set()
+    seen = set()  # canonical keys, so '/about' and '/about/' are selected once
 
     def _add(u, cluster):
-        if u in seen:
+        key = canonicalize_url(u)
+        if key in seen:
             return
-        seen.add(u)
+        seen.add(key)
         selected.append({"url": u, "cluster": cluster})
 
     _add(base_norm, "company_information")
@@ -2038,8 +4147,8 @@ def select_knowledge_pages(base_url: str, candidate_urls: list, lang: str, page_
     if len(kept) > 1:
         try:
             page_details = [{"url": u} for u in kept]
-            clusters, p, c = identify_knowledge_rich_content_clusters(page_details, base_url, lang)
-            cost.add(OPENAI_MODEL_CHEAP, p, c)
+            clusters, p, c, cached = identify_knowledge_rich_content_clusters(page_details, base_url, lang)
+            cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
             selection_meta["clusters"] = {
                 k: len(v.get("urls", [])) for k, v in clusters.items() if isinstance(v, dict)
             }
@@ -2055,8 +4164,8 @@ def select_knowledge_pages(base_url: str, candidate_urls: list, lang: str, page_
                 for u in cval.get("urls", []):
                     if not isinstance(u, str):
                         continue
-                    nu = urlparse(u)._replace(fragment="").geturl()
-                    if urlparse(nu).netloc != base_domain:
+                    nu = _strip_fragment(u)
+                    if _url_netloc(nu) != base_domain:
                         continue
                     _add(nu, cname)
                     if len(selected) >= page_budget:
@@ -2085,63 +4194,177 @@ def harvest_contact_candidates(texts: list) -> dict:
         for m in _EMAIL_RE.findall(t):
             emails.add(m.strip())
         for m in _PHONE_RE.findall(t):
-            digits = re.sub(r'\D', '', m)
+            digits = _NON_DIGIT_RE.sub('', m)
             if 7 <= len(digits) <= 15:
                 phones.add(m.strip())
     return {"emails": sorted(emails)[:30], "phones": sorted(phones)[:30]}
 
 
-def extract_pages_parallel(pages: list, lang: str, cost: CostAccumulator,
-                           main_page_url: str = None, main_page_screenshot: str = None,
-                           job_id: str = None) -> list:
-    """Fetch + clean + extract knowledge for many pages concurrently (cheap model).
+def bulk_fetch_html(pages: list, max_workers: int = CRAWL_WORKERS, known_html: dict = None) -> None:
+    """Fetch HTML for all selected pages concurrently, storing it under page['html'].
 
-    Returns chunk dicts: {url, title_suggestion, primary_category, extracted_chunk}.
+    Decouples page I/O from the LLM stages: language detection and extraction then read
+    the prefetched markup instead of fetching one page at a time. Failures are logged and
+    stored as None so a single slow or broken URL never blocks the pipeline.
     """
-    results = []
-    results_lock = threading.Lock()
-    total = len(pages)
-    done = {"n": 0}
+    known_html = known_html or {}
+    to_fetch = collections.defaultdict(list)  # url -> pages sharing it, so each URL is fetched once
+    for page in pages:
+        if page.get("url") in known_html:
+            page["html"] = known_html[page["url"]]
+        else:
+            to_fetch[page["url"]].append(page)
+    if not to_fetch:
+        return
 
-    def _work(page):
-        url = page["url"]
+    def _fetch(url):
         try:
             html = fetch_url_html_content(url)
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {url}: {e}")
+            html = None
+        for page in to_fetch[url]:
+            page["html"] = html
+
+    workers = max(1, min(max_workers, len(to_fetch)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_fetch, list(to_fetch)))
+
+
+async def aextract_pages(pages: list, lang: str, cost: CostAccumulator,
+                         main_page_url: str = None, main_page_screenshot: str = None,
+                         job_id: str = None) -> list:
+    """Fetch + clean + extract knowledge for many pages concurrently on the shared event loop.
+
+    LLM calls are coroutines gated only by the OpenAI concurrency limit, so waiting on the API
+    no longer ties up a thread per page; blocking fetches and HTML cleaning run in worker
+    threads, at most KB_EXTRACTION_WORKERS at a time. Returns chunk dicts
+    {url, title_suggestion, primary_category, extracted_chunk} in the order of `pages`.
+
+    Each page is extracted once: URLs that canonicalise alike are dropped up front, and a page
+    whose HTML is byte-identical to one already taken (redirect aliases, tracking parameters)
+    is skipped instead of paying for a second LLM call.
+
+    Large pages are extracted as soon as they are fetched. Small ones (at most
+    KB_BATCH_PAGE_MAX_TOKENS of clean text, e.g. contact or policy pages) are held back and
+    extracted several per call once all fetches are done, saving per-request overhead and
+    re-sending the instructions prefix once per batch instead of once per page.
+    """
+    unique_pages, seen_urls = [], set()
+    for page in pages:
+        key = canonicalize_url(page["url"])
+        if key not in seen_urls:
+            seen_urls.add(key)
+            unique_pages.append(page)
+    if len(unique_pages) < len(pages):
+        logger.info(f"Skipping {len(pages) - len(unique_pages)} duplicate page URLs before extraction")
+    pages = unique_pages
+    seen_html = set()  # digests of page HTML already claimed for extraction
+    progress = ProgressCounter(job_id, len(pages), "Extracting knowledge {done}/{total} pages...",
+                               publish=update_job_progress_nowait)
+    fetch_slots = asyncio.Semaphore(max(1, KB_EXTRACTION_WORKERS))
+    results = [None] * len(pages)
+    small = []  # (index, {url, title, clean_text}) held back for batched extraction
+
+    def _accept(data, page):
+        if data and data.get("extracted_chunk", "").strip():
+            data.setdefault("cluster", page.get("cluster"))
+            return data
+        return None
+
+    async def _work(i, page):
+        url = page["url"]
+        deferred = False
+        try:
+            # Use (and release) HTML prefetched by bulk_fetch_html; fetch only if absent.
+            if "html" in page:
+                html = page.pop("html")
+            else:
+                async with fetch_slots:
+                    html = await asyncio.to_thread(fetch_url_html_content, url)
             if not html:
                 return None
+            # Checked and claimed with no await in between, so concurrent duplicates can't both pass.
+            digest = hashlib.blake2b(html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            if digest in seen_html:
+                logger.info(f"Skipping {url}: same HTML as a page already being extracted")
+                return None
+            seen_html.add(digest)
             title = get_page_title_from_html(html) or page.get("title", "N/A")
             screenshot = main_page_screenshot if (main_page_url and url == main_page_url) else None
-            data, p, c = extract_knowledge_from_page_with_openai(html, url, title, lang, screenshot)
-            cost.add(OPENAI_MODEL_CHEAP, p, c)
-            if data and data.get("extracted_chunk", "").strip():
-                data.setdefault("cluster", page.get("cluster"))
-                return data
-            return None
+            async with fetch_slots:
+                clean_text, text_tokens = await asyncio.to_thread(_extraction_text_and_tokens, html, url)
+            if not screenshot and text_tokens <= KB_BATCH_PAGE_MAX_TOKENS:
+                small.append((i, {"url": url, "title": title, "clean_text": clean_text}))
+                deferred = True
+                return
+            data, p, c, cached = await aextract_knowledge_from_page_with_openai(html, url, title, lang, screenshot,
+                                                                                clean_text=clean_text)
+            cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
+            results[i] = _accept(data, page)
         except Exception as e:
             logger.error(f"Failed to extract {url}: {e}")
-            return None
         finally:
-            with results_lock:
-                done["n"] += 1
-                if job_id:
-                    update_job_progress(job_id, f"Extracting knowledge {done['n']}/{total} pages...")
+            if not deferred:
+                progress.step()
+
+    async def _work_batch(batch):
+        extracted = {}
+        if len(batch) > 1:
+            try:
+                extracted, p, c, cached = await aextract_knowledge_from_pages_batch([item for _, item in batch], lang)
+                cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
+            except Exception as e:
+                logger.error(f"Batched extraction of {len(batch)} pages failed: {e}")
+        for i, item in batch:
+            try:
+                data = extracted.get(item["url"])
+                if data is None:  # single page, or left out of the batch response
+                    data, p, c, cached = await aextract_knowledge_from_page_with_openai(
+                        "", item["url"], item["title"], lang, clean_text=item["clean_text"])
+                    cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
+                results[i] = _accept(data, pages[i])
+            except Exception as e:
+                logger.error(f"Failed to extract {item['url']}: {e}")
+            finally:
+                progress.step()
+
+    await asyncio.gather(*[_work(i, page) for i, page in enumerate(pages)])
+    if small:
+        small.sort(key=lambda entry: entry[0])
+        batches, current, current_tokens = [], [], 0
+        for entry, tokens in zip(small, count_tokens_batch([item["clean_text"] for _, item in small])):
+            tokens = tokens or max(1, len(entry[1]["clean_text"]) // 4)
+            if current and (len(current) >= KB_BATCH_MAX_PAGES
+                            or current_tokens + tokens > KB_BATCH_INPUT_TOKEN_BUDGET):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(entry)
+            current_tokens += tokens
+        batches.append(current)
+        logger.info(f"Extracting {len(small)} small pages in {len(batches)} batched calls")
+        await asyncio.gather(*[_work_batch(batch) for batch in batches])
+    return [r for r in results if r]
+
+
+def extract_pages_parallel(pages: list, lang: str, cost: CostAccumulator,
+                           main_page_url: str = None, main_page_screenshot: str = None,
+                           job_id: str = None) -> list:
+    """Synchronous entry point for aextract_pages() (runs it on the shared event loop)."""
+    return run_coroutine(aextract_pages(pages, lang, cost, main_page_url, main_page_screenshot, job_id))
 
-    workers = max(1, min(KB_EXTRACTION_WORKERS, total))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = [executor.submit(_work, pg) for pg in pages]
-        for fut in concurrent.futures.as_completed(futures):
-            r = fut.result()
-            if r:
-                with results_lock:
-                    results.append(r)
-    return results
+
+def _chunk_digest(text: str) -> bytes:
+    """Fingerprint of an extracted chunk, insensitive to case and whitespace layout."""
+    normalized = _WHITESPACE_RUN_RE.sub(" ", text or "").strip().casefold()
+    return hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"), digest_size=16).digest()
 
 
 def _batch_chunks_by_tokens(texts: list, token_budget: int) -> list:
     """Split chunk texts into batches whose combined token count stays under budget."""
     batches, current, current_tokens = [], [], 0
-    for t in texts:
-        tt = count_tokens(t) or max(1, len(t) // 4)
+    for t, tt in zip(texts, count_tokens_batch(texts)):
+        tt = tt or max(1, len(t) // 4)
         if current and current_tokens + tt > token_budget:
             batches.append(current)
             current, current_tokens = [], 0
@@ -2152,53 +4375,109 @@ def _batch_chunks_by_tokens(texts: list, token_budget: int) -> list:
     return batches
 
 
-def synthesize_section(section_key: str, section_title: str, chunks: list, base_url: str,
-                       lang: str, cost: CostAccumulator, extra_context: str = "") -> str:
+SECTION_SYNTH_INSTRUCTIONS_TEMPLATE = (
+    "You are a senior technical writer assembling the '{section_title}' section of a "
+    "customer-support knowledge base. Write the ENTIRE section in {lang_name} "
+    "(translate any source content into {lang_name}; never use English unless "
+    "that is the target language). Merge the source extracts into one clean, well-structured "
+    "Markdown section. Remove duplicate facts. Resolve conflicts by keeping the most complete "
+    "version. Preserve phone numbers, emails, addresses, prices and policy clauses VERBATIM. "
+    "Do NOT invent information. Do NOT restate the section title and do NOT mention source "
+    "URLs. Start directly with the content; use heading level #### and below for any "
+    "sub-headings. Output Markdown only (no JSON, no code fences)."
+)
+
+@functools.lru_cache(maxsize=256)
+def _section_synth_instructions(section_title: str, lang: str) -> str:
+    return SECTION_SYNTH_INSTRUCTIONS_TEMPLATE.format(section_title=section_title, lang_name=language_name(lang))
+
+
+async def asynthesize_section(section_key: str, section_title: str, chunks: list, base_url: str,
+                              lang: str, cost: CostAccumulator, extra_context: str = "",
+                              on_delta=None) -> str:
     """Merge all page-chunks for one canonical section into a clean, deduplicated section.
 
     Uses the STRONG model. Large sections are map-reduced (summarise per batch, then merge)
-    so output is never bottlenecked by a single token-capped call.
+    so output is never bottlenecked by a single token-capped call; the map calls run
+    concurrently. `on_delta` (optional) receives streamed text as it is generated.
     """
     texts = [c.get("extracted_chunk", "").strip() for c in chunks if c.get("extracted_chunk", "").strip()]
     if not texts and not extra_context.strip():
         return ""
 
-    def _synth(body: str, note: str, include_extra: bool) -> str:
+    async def _synth(body: str, note: str, include_extra: bool) -> str:
         ctx = (extra_context.strip() + "\n\n") if (include_extra and extra_context.strip()) else ""
         messages = [
-            {"role": "developer", "content": (
-                f"You are a senior technical writer assembling the '{section_title}' section of a "
-                f"customer-support knowledge base. Write the ENTIRE section in {language_name(lang)} "
-                f"(translate any source content into {language_name(lang)}; never use English unless "
-                f"that is the target language). Merge the source extracts into one clean, well-structured "
-                f"Markdown section. Remove duplicate facts. Resolve conflicts by keeping the most complete "
-                f"version. Preserve phone numbers, emails, addresses, prices and policy clauses VERBATIM. "
-                f"Do NOT invent information. Do NOT restate the section title and do NOT mention source "
-                f"URLs. Start directly with the content; use heading level #### and below for any "
-                f"sub-headings. Output Markdown only (no JSON, no code fences)."
-            )},
+            {"role": "developer", "content": _section_synth_instructions(section_title, lang)},
             {"role": "user", "content": (
                 f"{note}\n\n{ctx}Source extracts:\n\n{body}"
             )},
         ]
-        content, p, c = llm_chat(messages, model=OPENAI_MODEL_STRONG,
-                                 max_tokens=MAX_RESPONSE_TOKENS_SECTION_SYNTH,
-                                 cost=cost, input_text_for_count=body)
+        content, p, c = await allm_chat(messages, model=OPENAI_MODEL_STRONG,
+                                        max_tokens=MAX_RESPONSE_TOKENS_SECTION_SYNTH,
+                                        cost=cost, on_delta=on_delta)
         return content.strip()
 
     batches = _batch_chunks_by_tokens(texts, SECTION_SYNTH_INPUT_TOKEN_BUDGET) if texts else [[]]
     if len(batches) <= 1:
         body = "\n\n---\n\n".join(texts)
-        return _synth(body, "Combine these extracts into the final section.", True)
-
-    # Map each batch into a partial section, then reduce (merge) the partials.
-    partials = []
-    for i, batch in enumerate(batches):
-        body = "\n\n---\n\n".join(batch)
-        partials.append(_synth(body, f"This is batch {i+1}/{len(batches)} of a large section; "
-                                     f"produce a thorough partial section (to be merged with others).", False))
+        return await _synth(body, "Combine these extracts into the final section.", True)
+
+    # Map each batch into a partial section (concurrently), then reduce (merge) the partials.
+    partials = await asyncio.gather(*[
+        _synth("\n\n---\n\n".join(batch),
+               f"This is batch {i+1}/{len(batches)} of a large section; "
+               f"produce a thorough partial section (to be merged with others).", False)
+        for i, batch in enumerate(batches)
+    ])
     merge_body = "\n\n---\n\n".join(p for p in partials if p)
-    return _synth(merge_body, "Merge these partial sections into one final, deduplicated section.", True)
+    return await _synth(merge_body, "Merge these partial sections into one final, deduplicated section.", True)
+
+
+def synthesize_section(section_key: str, section_title: str, chunks: list, base_url: str,
+                       lang: str, cost: CostAccumulator, extra_context: str = "") -> str:
+    """Synchronous wrapper around asynthesize_section()."""
+    return run_coroutine(asynthesize_section(section_key, section_title, chunks, base_url,
+                                             lang, cost, extra_context))
+
+
+async def asynthesize_all_sections(section_jobs: list, base_url: str, lang: str,
+                                   cost: CostAccumulator, job_id: str = None) -> dict:
+    """Synthesise every section concurrently. section_jobs: [(key, chunks, extra_context)].
+
+    Returns {key: markdown} for non-empty sections. A failing section is logged and skipped
+    rather than failing the whole knowledge base.
+    """
+    total = len(section_jobs)
+    done = 0
+    generated_chars = 0
+    last_report = 0.0
+
+    def _on_delta(delta: str):
+        # Streamed output from all sections feeds one live, throttled progress line.
+        nonlocal generated_chars, last_report
+        generated_chars += len(delta)
+        now = time.monotonic()
+        if job_id and now - last_report >= STREAM_PROGRESS_INTERVAL_SECONDS:
+            last_report = now
+            update_job_progress_nowait(job_id, f"Writing knowledge base sections ({done}/{total} done, "
+                                               f"{generated_chars} characters written)...")
+
+    async def _one(key, chs, extra):
+        nonlocal done
+        try:
+            return key, await asynthesize_section(key, section_title(key, lang), chs, base_url, lang, cost, extra,
+                                                  on_delta=_on_delta)
+        except Exception as e:
+            logger.error(f"Section synthesis failed for '{key}': {e}")
+            return key, ""
+        finally:
+            done += 1
+            if job_id:
+                update_job_progress_nowait(job_id, f"Writing section: {section_title(key, lang)} ({done}/{total})...")
+
+    results = await asyncio.gather(*[_one(k, chs, extra) for k, chs, extra in section_jobs])
+    return {k: out for k, out in results if out.strip()}
 
 
 def assemble_final_kb(section_outputs: dict, base_url: str, lang: str, cost: CostAccumulator,
@@ -2228,15 +4507,14 @@ def assemble_final_kb(section_outputs: dict, base_url: str, lang: str, cost: Cos
             {"role": "user", "content": f"Website: {base_url}\n\nOverview material:\n{overview_src[:6000]}\n\nSections covered:\n{toc_lines}"},
         ]
         intro, p, c = llm_chat(messages, model=OPENAI_MODEL_STRONG,
-                               max_tokens=MAX_RESPONSE_TOKENS_ASSEMBLY, cost=cost,
-                               input_text_for_count=overview_src)
+                               max_tokens=MAX_RESPONSE_TOKENS_ASSEMBLY, cost=cost)
     except Exception as e:
         logger.warning(f"Intro generation failed: {e}")
 
     working = dict(section_outputs)
 
     def _doc_tokens():
-        return sum(count_tokens(working.get(k, "")) for k, _ in present)
+        return sum(count_tokens_batch([working.get(k, "") for k, _ in present]))
 
     if _doc_tokens() > target_doc_tokens:
         for k in reversed(KB_SECTION_PRIORITY):  # compress lowest-priority sections first
@@ -2257,7 +4535,7 @@ def assemble_final_kb(section_outputs: dict, base_url: str, lang: str, cost: Cos
                 ]
                 condensed, p, c = llm_chat(messages, model=OPENAI_MODEL_STRONG,
                                            max_tokens=MAX_RESPONSE_TOKENS_SECTION_SYNTH // 2,
-                                           cost=cost, input_text_for_count=text)
+                                           cost=cost)
                 if condensed.strip():
                     working[k] = condensed.strip()
                     assembly_meta["compressed_sections"].append(k)
@@ -2282,7 +4560,7 @@ def check_kb_completeness(document: str, lang: str, contact_candidates: dict,
                           cost: CostAccumulator) -> dict:
     """Cheap critic: flag which support-critical dimensions are present/missing."""
     has_email = bool(_EMAIL_RE.search(document)) or bool(contact_candidates.get("emails"))
-    has_phone = bool(contact_candidates.get("phones")) or bool(re.search(r'\d{3}[\s-]?\d{3,}', document))
+    has_phone = bool(contact_candidates.get("phones")) or bool(_PHONE_HINT_RE.search(document))
     report = {"has_email": has_email, "has_phone": has_phone, "doc_tokens": count_tokens(document)}
     try:
         messages = [
@@ -2295,7 +4573,7 @@ def check_kb_completeness(document: str, lang: str, contact_candidates: dict,
         ]
         content, p, c = llm_chat(messages, model=OPENAI_MODEL_CHEAP,
                                  max_tokens=MAX_RESPONSE_TOKENS_COMPLETENESS, json_mode=True,
-                                 cost=cost, input_text_for_count=document[:12000])
+                                 cost=cost)
         audit = parse_json_response(content)
         if isinstance(audit, dict):
             report.update(audit)
@@ -2308,7 +4586,7 @@ def check_kb_completeness(document: str, lang: str, contact_candidates: dict,
 def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, specific_pages=None,
                            depth="deep", target_doc_tokens=TARGET_DOC_TOKENS):
     logger.info(f"Starting KB job {job_id} for {base_url} (depth={depth}, budget={max_pages_for_kb})")
-    with jobs_lock: jobs[job_id].update({"status": "running", "started_at": time.time()})
+    job_store.update(job_id, {"status": "running", "started_at": time.time()})
 
     cost = CostAccumulator()
     main_page_screenshot = None
@@ -2316,7 +4594,7 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
 
     try:
         # 1. Fetch homepage (full) for colour + language detection.
-        update_job_progress(job_id, "Fetching homepage...")
+        update_job_progress_ordered(job_id, "Fetching homepage...")
         try:
             main_page_html = fetch_url_html_content(base_url)
         except Exception as e:
@@ -2324,55 +4602,65 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
             main_page_html = None
         lang = DEFAULT_TARGET_LANGUAGE
 
-        # 2. Main page screenshot (visual context for the main-page extraction)
-        update_job_progress(job_id, "Capturing main page screenshot...")
-        main_page_screenshot = capture_full_page_screenshot(base_url)
-        if not main_page_screenshot:
-            logger.warning("Could not capture main page screenshot - continuing without visual context")
-
-        # 2.5 Website colors (kept for response-shape compatibility)
-        update_job_progress(job_id, "Extracting website colors...")
-        website_colors = {
-            "main_background_color": "#ffffff", "primary_brand_color": "#000000",
-            "background_color_description": "Default fallback", "brand_color_description": "Default fallback",
-        }
-        if main_page_html:
-            try:
-                colors, p, c = extract_website_colors_with_openai(main_page_html, base_url, main_page_screenshot)
-                website_colors = colors
-                cost.add(OPENAI_MODEL_CHEAP, p, c)
-            except Exception as e:
-                logger.error(f"Failed to extract website colors: {e}")
+        # 2. Main page screenshot + website colours (kept for response-shape compatibility).
+        #    Chrome startup, the render and the colour call take seconds and nothing in discovery
+        #    or selection needs them, so they run alongside and are joined before extraction.
+        def _visual_context():
+            screenshot = capture_full_page_screenshot(base_url)
+            if not screenshot:
+                logger.warning("Could not capture main page screenshot - continuing without visual context")
+            colors = {
+                "main_background_color": "#ffffff", "primary_brand_color": "#000000",
+                "background_color_description": "Default fallback", "brand_color_description": "Default fallback",
+            }
+            if main_page_html:
+                try:
+                    colors, p, c, cached = extract_website_colors_with_openai(main_page_html, base_url, screenshot)
+                    cost.add(OPENAI_MODEL_CHEAP, p, c, cached)
+                except Exception as e:
+                    logger.error(f"Failed to extract website colors: {e}")
+            return screenshot, colors
+
+        update_job_progress_ordered(job_id, "Capturing main page screenshot...")
+        visual_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-visual")
+        visual_future = visual_executor.submit(_visual_context)
+        visual_executor.shutdown(wait=False)
 
         # 3. Discovery + intelligent selection
         discovery_meta, selection_meta = {}, {}
         if specific_pages:
-            update_job_progress(job_id, "Discovering core website pages...")
+            update_job_progress_ordered(job_id, "Discovering core website pages...")
             discovered = discover_core_pages_only(base_url, specific_pages)
             selected = [{"url": d["url"], "cluster": d.get("type", "company_information")} for d in discovered][:page_budget]
             discovery_meta = {"method": "specified", "count": len(selected)}
         elif depth == "core":
-            update_job_progress(job_id, "Discovering core website pages...")
+            update_job_progress_ordered(job_id, "Discovering core website pages...")
             discovered = discover_core_pages_only(base_url)
             selected = [{"url": d["url"], "cluster": d.get("type", "company_information")} for d in discovered][:page_budget]
             discovery_meta = {"method": "core_patterns", "count": len(selected)}
         else:
-            update_job_progress(job_id, "Discovering all pages (Sitemap)...")
+            update_job_progress_ordered(job_id, "Discovering all pages (Sitemap)...")
             candidates, discovery_meta = discover_all_candidate_urls(base_url, use_selenium)
-            update_job_progress(job_id, "Identifying knowledge-rich content clusters...")
+            update_job_progress_ordered(job_id, "Identifying knowledge-rich content clusters...")
             selected, selection_meta = select_knowledge_pages(base_url, candidates, lang, page_budget, cost)
 
-        with jobs_lock: jobs[job_id]["initial_found_pages_count"] = len(selected)
+        job_store.update(job_id, {"initial_found_pages_count": len(selected)})
         logger.info(f"Selected {len(selected)} knowledge pages for extraction")
 
+        # 3.2 Prefetch all selected pages' HTML concurrently (homepage already fetched).
+        update_job_progress_ordered(job_id, "Fetching selected pages...")
+        bulk_fetch_html(selected, known_html={base_url: main_page_html} if main_page_html else None)
+
         # 3.5 Detect the site's primary language from SOURCE content (deterministic-first).
-        update_job_progress(job_id, "Detecting language...")
+        update_job_progress_ordered(job_id, "Detecting language...")
         lang = detect_site_language(main_page_html, base_url, selected, cost)
-        with jobs_lock: jobs[job_id]["detected_target_language"] = lang
+        job_store.update(job_id, {"detected_target_language": lang})
         logger.info(f"Detected target language: {lang} ({language_name(lang)})")
 
+        main_page_screenshot, website_colors = visual_future.result()
+
         # 4. Parallel per-page extraction (clean text -> cheap model)
-        update_job_progress(job_id, "Extracting knowledge from pages...")
+        update_job_progress_ordered(job_id, "Extracting knowledge from pages...")
         chunks = extract_pages_parallel(
             selected, lang, cost,
             main_page_url=base_url, main_page_screenshot=main_page_screenshot, job_id=job_id,
@@ -2381,15 +4669,27 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
 
         # 5. Contact safety-net + group chunks by canonical section
         contact_candidates = harvest_contact_candidates([c.get("extracted_chunk", "") for c in chunks])
+        # Pages that share a template (/about vs /about-us, paginated lists) often extract to the
+        # same text; a per-section set of content digests keeps only the first copy of each.
         section_chunks = {k: [] for k in KB_SECTION_KEYS}
+        section_seen = {k: set() for k in KB_SECTION_KEYS}
+        duplicate_chunks = 0
         for ch in chunks:
             cat = ch.get("primary_category", "additional")
             if cat not in section_chunks:
                 cat = "additional"
+            digest = _chunk_digest(ch.get("extracted_chunk", ""))
+            if digest in section_seen[cat]:
+                duplicate_chunks += 1
+                continue
+            section_seen[cat].add(digest)
             section_chunks[cat].append(ch)
+        if duplicate_chunks:
+            logger.info(f"Dropped {duplicate_chunks} duplicate extracted chunks before synthesis")
 
-        # 6. Per-section synthesis (strong model; map-reduce for large sections)
-        section_outputs = {}
+        # 6. Per-section synthesis (strong model; map-reduce for large sections), all sections
+        #    fanned out concurrently on the shared event loop.
+        section_jobs = []
         for key in KB_SECTION_KEYS:
             chs = section_chunks.get(key, [])
             extra = ""
@@ -2400,13 +4700,12 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
                          f"Phones: {', '.join(contact_candidates['phones']) or 'none'}")
             if not chs and not extra:
                 continue
-            update_job_progress(job_id, f"Writing section: {section_title(key, lang)}...")
-            out = synthesize_section(key, section_title(key, lang), chs, base_url, lang, cost, extra)
-            if out.strip():
-                section_outputs[key] = out
+            section_jobs.append((key, chs, extra))
+        update_job_progress_ordered(job_id, "Writing knowledge base sections...")
+        section_outputs = run_coroutine(asynthesize_all_sections(section_jobs, base_url, lang, cost, job_id))
 
         # 7. Assemble the final single-context document
-        update_job_progress(job_id, "Compiling comprehensive knowledge base...")
+        update_job_progress_ordered(job_id, "Compiling comprehensive knowledge base...")
         if section_outputs:
             final_kb, assembly_meta = assemble_final_kb(section_outputs, base_url, lang, cost, target_doc_tokens)
         else:
@@ -2415,7 +4714,7 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
                              "final_doc_tokens": count_tokens(final_kb)}
 
         # 8. Completeness audit (cheap critic)
-        update_job_progress(job_id, "Auditing knowledge base completeness...")
+        update_job_progress_ordered(job_id, "Auditing knowledge base completeness...")
         quality_report = check_kb_completeness(final_kb, lang, contact_candidates, cost)
 
         # 9. Cost + analysis summary
@@ -2438,7 +4737,7 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
                                  f"synthesised {len(section_outputs)} sections."),
         }
 
-        update_job_progress(job_id, "Knowledge base generation completed successfully.")
+        update_job_progress_ordered(job_id, "Knowledge base generation completed successfully.")
 
         # 10. Persist report
         try:
@@ -2458,22 +4757,21 @@ def run_knowledge_base_job(job_id, base_url, max_pages_for_kb, use_selenium, spe
         except Exception as e:
             logger.error(f"Failed to save knowledge base report for job {job_id}: {e}")
 
-        with jobs_lock:
-            jobs[job_id].update({
-                "status": "completed",
-                "final_knowledge_base": final_kb,
-                "extracted_pages_count": len(chunks),
-                "main_page_screenshot_captured": main_page_screenshot is not None,
-                "website_colors": website_colors,
-                "comprehensive_analysis": comprehensive_analysis,
-                "cost_estimation": cost_estimation,
-                "quality_report": quality_report,
-                "finished_at": time.time(),
-            })
+        job_store.update(job_id, {
+            "status": "completed",
+            "final_knowledge_base": final_kb,
+            "extracted_pages_count": len(chunks),
+            "main_page_screenshot_captured": main_page_screenshot is not None,
+            "website_colors": website_colors,
+            "comprehensive_analysis": comprehensive_analysis,
+            "cost_estimation": cost_estimation,
+            "quality_report": quality_report,
+            "finished_at": time.time(),
+        })
     except Exception as e:
         logger.error(f"KB Job {job_id} failed: {e}", exc_info=True)
-        update_job_progress(job_id, "Failed to generate knowledge base.")
-        with jobs_lock: jobs[job_id].update({"status": "failed", "error": str(e), "finished_at": time.time()})
+        update_job_progress_ordered(job_id, "Failed to generate knowledge base.")
+        job_store.update(job_id, {"status": "failed", "error": str(e), "finished_at": time.time()})
 
 
 # --- API Endpoints ---
@@ -2484,14 +4782,12 @@ def start_company_analysis():
     data = request.get_json()
     url = data.get('url')
     if not url: return jsonify({"error": "Valid 'url' is required"}), 400
+    if job_queue_full(): return _job_queue_full_response()
+
+    job_id = job_store.create("company_analysis")
     
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {"id": job_id, "job_type": "company_analysis", "status": "pending"}
-    
-    thread = threading.Thread(target=run_company_analysis_job, args=(
-        job_id, url, int(data.get('max_pages', 10)), bool(data.get('use_selenium', False))
-    ))
-    thread.start()
+    submit_job(job_id, run_company_analysis_job,
+               url, int(data.get('max_pages', 10)), bool(data.get('use_selenium', False)))
     return jsonify({"message": "Company analysis job started.", "job_id": job_id}), 202
 
 @app.route('/api/qualify-prospects', methods=['POST'])
@@ -2500,14 +4796,12 @@ def start_prospect_qualification():
     data = request.get_json()
     if not all(k in data for k in ['user_profile', 'user_personas', 'prospect_urls']):
         return jsonify({"error": "Missing required fields"}), 400
+    if job_queue_full(): return _job_queue_full_response()
 
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {"id": job_id, "job_type": "prospect_qualification", "status": "pending"}
+    job_id = job_store.create("prospect_qualification")
 
-    thread = threading.Thread(target=run_prospect_qualification_job, args=(
-        job_id, data['user_profile'], data['user_personas'], data['prospect_urls']
-    ))
-    thread.start()
+    submit_job(job_id, run_prospect_qualification_job,
+               data['user_profile'], data['user_personas'], data['prospect_urls'])
     return jsonify({"message": "Prospect qualification job started.", "job_id": job_id}), 202
 
 @app.route('/api/generate-knowledge-base', methods=['POST'])
@@ -2533,10 +4827,11 @@ def start_knowledge_base_generation():
         target_doc_tokens = TARGET_DOC_TOKENS
     target_doc_tokens = max(2000, min(target_doc_tokens, 120000))
     max_pages = int(data.get('max_pages', DEFAULT_KB_PAGE_BUDGET))
+    if job_queue_full(): return _job_queue_full_response()
 
     # Validate URL accessibility before starting job
     try:
-        test_response = requests.head(url, timeout=10, allow_redirects=True)
+        test_response = HTTP_SESSION.head(url, timeout=10, allow_redirects=True)
         if test_response.status_code >= 400:
             return jsonify({
                 "error": f"Website is not accessible. HTTP {test_response.status_code}: {test_response.reason}",
@@ -2558,14 +4853,11 @@ def start_knowledge_base_generation():
             "details": "Please check the URL format and try again"
         }), 400
     
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {"id": job_id, "job_type": "knowledge_base_generation", "status": "pending",
-                    "created_at": time.time()}
-
-    thread = threading.Thread(target=run_knowledge_base_job,
-                              args=(job_id, url, max_pages, bool(data.get('use_selenium', False)), specific_pages),
-                              kwargs={"depth": depth, "target_doc_tokens": target_doc_tokens})
-    thread.start()
+    job_id = job_store.create("knowledge_base_generation")
+
+    submit_job(job_id, run_knowledge_base_job,
+               url, max_pages, bool(data.get('use_selenium', False)), specific_pages,
+               depth=depth, target_doc_tokens=target_doc_tokens)
     return jsonify({"message": "Knowledge base generation job started.", "job_id": job_id,
                     "depth": depth, "page_budget": max_pages}), 202
 
@@ -2623,29 +4915,86 @@ def scrape_page():
 @app.route('/api/jobs/<job_id>', methods=['GET'])
 @require_api_key
 def get_job_status(job_id):
-    with jobs_lock:
-        job = jobs.get(job_id)
+    job = job_store.get(job_id)
     if not job: return jsonify({"error": "Job ID not found."}), 404
     
-    # To avoid sending huge KB in status checks, send a preview.
-    job_copy = job.copy()
-    if "final_knowledge_base" in job_copy and job_copy["final_knowledge_base"]:
-        job_copy["final_knowledge_base_preview"] = job_copy["final_knowledge_base"][:500] + "..."
-        # Only send the full KB if the job is completed
-        if job_copy.get("status") != "completed":
-            del job_copy["final_knowledge_base"]
-            
-    return jsonify(job_copy), 200
+    # Build the status payload as a projection; the KB itself goes out only once the job is
+    # completed, in-progress polls get a preview.
+    payload = {k: v for k, v in job.items() if k != "final_knowledge_base"}
+    final_kb = job.get("final_knowledge_base")
+    if final_kb:
+        payload["final_knowledge_base_preview"] = final_kb[:500] + "..."
+        if job.get("status") == "completed":
+            payload["final_knowledge_base"] = final_kb
+
+    # Encoded once, straight to the UTF-8 body: jsonify would build a str of the whole
+    # (possibly multi-hundred-KB) payload and then encode that again into bytes.
+    return Response(json_dumps(payload), status=200, mimetype="application/json")
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+@require_api_key
+def stream_job_events(job_id):
+    """Server-Sent Events: the current state, then every status/progress change until the job ends."""
+    if not job_store.get(job_id): return jsonify({"error": "Job ID not found."}), 404
+    q = job_events.subscribe(job_id)  # subscribe before the snapshot so no update is missed
+
+    def generate():
+        try:
+            job = job_store.get(job_id) or {}
+            last_sent = {k: job.get(k) for k in JOB_EVENT_FIELDS}  # client's view of the job
+            yield _sse_event(last_sent)
+            status = job.get("status")
+            while status not in JOB_TERMINAL_STATUSES:
+                try:
+                    event = q.get(timeout=JOB_STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Re-check the store: with a shared JOB_STORE the job may run in another worker,
+                    # whose status and progress changes are never published here.
+                    job = job_store.get(job_id)
+                    if job is None: return
+                    event = {k: job.get(k) for k in JOB_EVENT_FIELDS}
+                    if event == last_sent:
+                        yield ":keepalive\n\n"
+                        continue
+                last_sent.update(event)
+                status = event.get("status", status)
+                yield _sse_event(event)
+        finally:
+            job_events.unsubscribe(job_id, q)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@require_api_key
+def cancel_job_endpoint(job_id):
+    job = job_store.get(job_id)
+    if not job: return jsonify({"error": "Job ID not found."}), 404
+    if cancel_job(job_id):
+        return jsonify({"message": "Job cancelled.", "job_id": job_id}), 200
+    return jsonify({"error": f"Job cannot be cancelled (status: {job.get('status')}); only queued jobs can be cancelled."}), 409
 
 @app.route('/api/jobs', methods=['GET'])
 @require_api_key
 def list_all_jobs():
-    with jobs_lock:
-        jobs_list = [{
-            "job_id": jid, "job_type": j.get("job_type"), "status": j.get("status"),
-            "created_at": j.get("created_at"), "finished_at": j.get("finished_at")
-        } for jid, j in jobs.items()]
-    return jsonify({"jobs": sorted(jobs_list, key=lambda x: x.get('created_at', 0), reverse=True)})
+    jobs_list = [{
+        "job_id": j["id"], "job_type": j.get("job_type"), "status": j.get("status"),
+        "created_at": j.get("created_at"), "finished_at": j.get("finished_at")
+    } for j in job_store.list()]
+    jobs_list.sort(key=lambda x: x.get('created_at') or 0, reverse=True)
+    # Optional pagination (?limit=&offset=); without `limit` every job is returned, as before.
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"error": "'offset' and 'limit' must be integers."}), 400
+    page = jobs_list[offset:offset + limit] if limit is not None and limit >= 0 else jobs_list[offset:]
+    return jsonify({"jobs": page, "total": len(jobs_list), "offset": offset, "limit": limit})
+
+@app.route('/api/cache/stats', methods=['GET'])
+@require_api_key
+def cache_stats():
+    return jsonify({"llm_cache": llm_cache.snapshot()}), 200
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -2658,6 +5007,9 @@ if __name__ == '__main__':
         exit(1)
     
     os.makedirs(REPORTS_DIR, exist_ok=True)
-    logger.info("Multi-Purpose Analyzer API starting...")
+    threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True).start()
+    if SELENIUM_PREWARM_DRIVERS:
+        threading.Thread(target=prewarm_driver_pool, name="driver-prewarm", daemon=True).start()
+    logger.info("Multi-Purpose Analyzer API starting (development server; use `gunicorn wsgi:app` in production)...")
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
\ No newline at end of file
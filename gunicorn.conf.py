@@ -0,0 +1,29 @@
+# Gunicorn configuration for grand_spider (picked up automatically from the working directory):
+#
+#     gunicorn wsgi:app
+#
+# Every endpoint either returns immediately (jobs run in background threads) or waits on
+# HTTP/OpenAI I/O, so concurrency comes from threads or green threads, not processes.
+# With the default JOB_STORE=memory keep a SINGLE worker: a status poll could otherwise land on
+# a worker that never saw the job. Set JOB_STORE=sqlite (or redis) before raising GUNICORN_WORKERS.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+
+# "gthread" (default) needs nothing extra. "gevent" (pip install gevent) multiplexes thousands
+# of idle connections per worker; gunicorn monkey-patches the stdlib before loading the app,
+# so the module-level locks, sessions and thread pools become green-thread aware.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 32))            # used by gthread
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))  # used by gevent/eventlet
+
+# /api/scrape-page runs a full fetch + LLM extraction inline; allow for slow sites.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 180))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
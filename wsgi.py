@@ -0,0 +1,22 @@
+"""WSGI entry point for production servers.
+
+    gunicorn wsgi:app            # settings from gunicorn.conf.py
+
+Runs the same startup checks as `python grand_spider.py`, which only starts the
+Werkzeug development server.
+"""
+import os
+import threading
+
+from grand_spider import (app, logger, EXPECTED_SERVICE_API_KEY, openai_client, REPORTS_DIR,
+                          SELENIUM_PREWARM_DRIVERS, prewarm_driver_pool, load_tokenizer)
+
+if not EXPECTED_SERVICE_API_KEY or not openai_client:
+    logger.error("FATAL: Service cannot start due to missing configuration.")
+    raise SystemExit(1)
+
+os.makedirs(REPORTS_DIR, exist_ok=True)
+threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True).start()
+if SELENIUM_PREWARM_DRIVERS:
+    threading.Thread(target=prewarm_driver_pool, name="driver-prewarm", daemon=True).start()
+logger.info("Multi-Purpose Analyzer API starting (WSGI)...")